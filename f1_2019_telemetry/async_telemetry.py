@@ -0,0 +1,131 @@
+"""An asyncio API for receiving and recording F1 2019 telemetry packets.
+
+The command line tools use threads to receive packets. Services that are built on asyncio can receive packets
+on their own event loop instead, without any extra threads:
+
+    async for batch in telemetry_stream(20777, decode=True):
+        for (timestamp, packet) in batch:
+            ...
+
+The stream is built on a DatagramProtocol that collects datagrams as they are received. The consumer picks up all
+datagrams that arrived since it last looked, as a single batch; so while the consumer keeps up, batches are small,
+and when it falls behind, it catches up in larger batches rather than being woken up once per packet.
+
+The AsyncPacketRecorder writes batches to SQLite3 session files using the recorder's PacketRecorder, in a worker
+thread, so the event loop is never blocked by database commits.
+"""
+
+import time
+import asyncio
+import logging
+import collections
+import concurrent.futures
+
+from .packets import unpack_udp_packet, UnpackError
+from .sockets import bind_telemetry_socket
+from .recording import PacketRecorder, TimestampedPacket
+
+
+class TelemetryProtocol(asyncio.DatagramProtocol):
+    """Collects received datagrams, with reception timestamps, until the consumer takes them.
+
+    At most 'max_pending' datagrams are kept; if the consumer doesn't keep up, the oldest datagrams are dropped.
+    """
+
+    def __init__(self, max_pending: int = 10000):
+        self._pending = collections.deque(maxlen=max_pending)
+        self._available = asyncio.Event()
+        self._closed = False
+        self.dropped_count = 0
+
+    def datagram_received(self, data, addr):
+        pending = self._pending
+        if len(pending) == pending.maxlen:
+            self.dropped_count += 1
+        pending.append(TimestampedPacket(time.time(), data))
+        self._available.set()
+
+    def error_received(self, exc):
+        logging.error("Error while receiving telemetry packets: {}".format(exc))
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self._available.set()
+
+    async def take(self):
+        """Wait for datagrams to arrive; return all pending datagrams as a list, or None if the connection is lost."""
+        while not self._pending:
+            if self._closed:
+                return None
+            self._available.clear()
+            await self._available.wait()
+        batch = list(self._pending)
+        self._pending.clear()
+        return batch
+
+
+async def telemetry_stream(port: int = 20777, decode: bool = False, host: str = '', max_pending: int = 10000):
+    """Receive telemetry packets on a UDP port; yield them in batches.
+
+    Each batch is a list of TimestampedPacket tuples, holding the POSIX time of reception and the packet. The
+    packet is the raw datagram, or, if 'decode' is True, the packet structure returned by unpack_udp_packet();
+    in that case, bad packets are logged and left out.
+
+    The socket is closed when the generator is closed, e.g. when leaving the 'async for' loop.
+    """
+    loop = asyncio.get_running_loop()
+    (transport, protocol) = await loop.create_datagram_endpoint(lambda: TelemetryProtocol(max_pending), sock=bind_telemetry_socket(port, host))
+    try:
+        while True:
+            batch = await protocol.take()
+            if batch is None:
+                return
+            if decode:
+                decoded_batch = []
+                for (timestamp, packet) in batch:
+                    try:
+                        decoded_batch.append(TimestampedPacket(timestamp, unpack_udp_packet(packet)))
+                    except UnpackError as error:
+                        logging.error("Dropped bad packet: {}".format(error))
+                batch = decoded_batch
+            yield batch
+    finally:
+        transport.close()
+        if protocol.dropped_count != 0:
+            logging.warning("Dropped {} packets because the consumer didn't keep up.".format(protocol.dropped_count))
+
+
+class AsyncPacketRecorder:
+    """Records batches of raw TimestampedPacket tuples to SQLite3 session files, in a worker thread.
+
+    All writes are done by the same worker thread, in the order in which the batches were handed over. Use as an
+    asynchronous context manager, or call close() when done:
+
+        async with AsyncPacketRecorder() as recorder:
+            async for batch in telemetry_stream(20777):
+                await recorder.record(batch)
+
+    Args:
+        filename_format: the session file name format; see PacketRecorder.
+        loss_detector: an optional PacketLossDetector; see PacketRecorder.
+    """
+
+    def __init__(self, filename_format: str = "F1_2019_{:s}.sqlite3", loss_detector=None):
+        self._recorder = PacketRecorder(loss_detector, filename_format)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    async def record(self, batch):
+        """Write a batch of raw TimestampedPacket tuples; returns when they have been committed."""
+        if batch:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._recorder.process_incoming_packets, batch)
+
+    async def close(self):
+        """Close the session file, and stop the worker thread."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._recorder.close)
+        self._executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,278 @@
+"""A catalog of recorded session files, for finding sessions without opening every file.
+
+The catalog is an SQLite3 database with one row per session file in its 'sessions' table, holding the file's size and
+modification time, and the columns of its session summary (see f1_2019_telemetry.summary): track, session type,
+formula, time span, packet counts, lap count and best lap time. The 'participants' table holds the drivers and teams
+of each session, with each car's best lap time.
+
+The catalog is kept up to date incrementally. SessionCatalog.update_file() only reads a session file if its size or
+modification time differs from the catalog's entry; SessionCatalog.scan() does this for all session files in a
+directory, and removes the entries of files that no longer exist. The recorder can update the catalog whenever it
+closes a session file (see its --catalog option).
+
+Queries only read the catalog, and use its indexes:
+
+    with SessionCatalog("f1_2019_catalog.sqlite3") as catalog:
+        sessions = catalog.query(track_ids=track_ids("Monza"), session_types=session_types("qualifying"),
+                                 driver_ids=driver_ids("Hamilton"))
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import ctypes
+
+from .packets import PacketID, PacketParticipantsData_V1, PacketLapData_V1, TrackIDs, DriverIDs, TeamIDs
+from .summary import SessionSummary, SESSION_SUMMARY_COLUMNS, SessionTypes, read_session_summary
+from .sqlite_utils import connect_read_only
+
+DEFAULT_CATALOG_FILENAME = "f1_2019_catalog.sqlite3"
+
+# Groups of session types that can be queried by a single name.
+_SESSION_TYPE_GROUPS = {
+    'practice'   : (1, 2, 3, 4),
+    'qualifying' : (5, 6, 7, 8, 9),
+    'race'       : (10, 11)
+}
+
+_create_catalog_tables_queries = ["""
+    CREATE TABLE IF NOT EXISTS sessions (
+        path      TEXT    PRIMARY KEY,  -- Absolute path of the session file.
+        size      INTEGER NOT NULL,     -- File size in bytes, when the entry was made.
+        mtime_ns  INTEGER NOT NULL,     -- File modification time in nanoseconds, when the entry was made.
+        {}
+    );
+    """.format(",\n        ".join(SESSION_SUMMARY_COLUMNS)), """
+    CREATE TABLE IF NOT EXISTS participants (
+        path          TEXT    NOT NULL REFERENCES sessions(path) ON DELETE CASCADE,
+        carIndex      INTEGER NOT NULL,
+        aiControlled  INTEGER NOT NULL,
+        driverId      INTEGER NOT NULL,  -- See DriverIDs.
+        teamId        INTEGER NOT NULL,  -- See TeamIDs.
+        raceNumber    INTEGER NOT NULL,
+        nationality   INTEGER NOT NULL,
+        name          TEXT    NOT NULL,
+        bestLapTime   REAL,              -- From the last lap data packet.
+        PRIMARY KEY (path, carIndex)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS sessions_track ON sessions(trackId, sessionType);",
+    "CREATE INDEX IF NOT EXISTS participants_driver ON participants(driverId);",
+    "CREATE INDEX IF NOT EXISTS participants_team ON participants(teamId);"
+]
+
+
+def _lookup(names, value, kind):
+    """Return the ids of the names that contain 'value' (case insensitive); raise ValueError if there are none."""
+    ids = [id for (id, name) in names.items() if value.lower() in name.lower()]
+    if not ids:
+        raise ValueError("unknown {} {!r}".format(kind, value))
+    return ids
+
+
+def track_ids(name: str):
+    """Return the track ids of the tracks whose name contains 'name', e.g. track_ids("silverstone") -> [7, 22]."""
+    return _lookup(TrackIDs, name, "track")
+
+
+def driver_ids(name: str):
+    """Return the driver ids of the drivers whose name contains 'name'."""
+    return _lookup(DriverIDs, name, "driver")
+
+
+def team_ids(name: str):
+    """Return the team ids of the teams whose name contains 'name'."""
+    return _lookup(TeamIDs, name, "team")
+
+
+def session_types(name: str):
+    """Return the session types for a session type name (e.g. 'Q1') or group ('practice', 'qualifying', 'race')."""
+    if name.lower() in _SESSION_TYPE_GROUPS:
+        return list(_SESSION_TYPE_GROUPS[name.lower()])
+    ids = [id for (id, session_type_name) in SessionTypes.items() if session_type_name.lower() == name.lower()]
+    if not ids:
+        raise ValueError("unknown session type {!r}".format(name))
+    return ids
+
+
+def _last_packet(conn, packet_id, packet_type):
+    """Return the most recent packet of a type in an open session file, decoded; or None."""
+    row = conn.execute("SELECT packet FROM packets WHERE packetId = ? ORDER BY pkt_id DESC LIMIT 1;", (packet_id, )).fetchone()
+    if row is None or len(row[0]) != ctypes.sizeof(packet_type):
+        return None
+    return packet_type.from_buffer_copy(row[0])
+
+
+def _read_session_file(path):
+    """Return the (summary values, participant rows) of a session file; or None if it contains no packets."""
+    conn = connect_read_only(path)
+    try:
+        values = read_session_summary(conn)
+        if values is None:
+            summary = SessionSummary.from_database(conn)
+            if summary is None:
+                return None
+            values = summary.values()
+
+        participants = _last_packet(conn, PacketID.PARTICIPANTS, PacketParticipantsData_V1)
+        lap_data = _last_packet(conn, PacketID.LAP_DATA, PacketLapData_V1)
+    finally:
+        conn.close()
+
+    participant_rows = []
+    if participants is not None:
+        for car_index in range(min(participants.numActiveCars, 20)):
+            participant = participants.participants[car_index]
+            best_lap_time = lap_data.lapData[car_index].bestLapTime if lap_data is not None else 0.0
+            participant_rows.append((
+                path, car_index, participant.aiControlled, participant.driverId, participant.teamId,
+                participant.raceNumber, participant.nationality, participant.name.decode(errors='replace'),
+                best_lap_time if best_lap_time > 0.0 else None))
+
+    return (values, participant_rows)
+
+
+class SessionCatalog:
+    """An open catalog database. It is created if it doesn't exist yet."""
+
+    def __init__(self, path: str = DEFAULT_CATALOG_FILENAME):
+        self.path = path
+        # Several processes (e.g. the recorder and a scan) may update the catalog at the same time; wait for each other.
+        self._conn = sqlite3.connect(path, timeout=30.0)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys = ON;")
+        with self._conn:
+            for query in _create_catalog_tables_queries:
+                self._conn.execute(query)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update_file(self, path: str) -> bool:
+        """Bring the catalog entry of a session file up to date; return True if the file had to be read.
+
+        Files that don't exist (anymore), or that are not session files, are removed from the catalog.
+        """
+        path = os.path.abspath(path)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.remove_file(path)
+            return False
+
+        row = self._conn.execute("SELECT size, mtime_ns FROM sessions WHERE path = ?;", (path, )).fetchone()
+        if row is not None and (row['size'], row['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return False
+
+        try:
+            session = _read_session_file(path)
+        except sqlite3.DatabaseError as error:
+            logging.warning("Unable to read session file {!r}: {}".format(path, error))
+            session = None
+
+        if session is None:
+            self.remove_file(path)
+            return True
+
+        (values, participant_rows) = session
+        with self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE path = ?;", (path, ))
+            self._conn.execute("INSERT INTO sessions(path, size, mtime_ns, {}) VALUES (?, ?, ?, {});".format(
+                ", ".join(SESSION_SUMMARY_COLUMNS), ", ".join("?" * len(SESSION_SUMMARY_COLUMNS))),
+                [path, stat.st_size, stat.st_mtime_ns] + [values[column] for column in SESSION_SUMMARY_COLUMNS])
+            self._conn.executemany("INSERT INTO participants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);", participant_rows)
+        return True
+
+    def remove_file(self, path: str) -> None:
+        """Remove the catalog entry of a session file, if any."""
+        with self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE path = ?;", (os.path.abspath(path), ))
+
+    def scan(self, directory: str):
+        """Update the catalog entries of all session files (*.sqlite3) in a directory.
+
+        Entries of files in the directory that no longer exist are removed.
+
+        Returns:
+            A (updated_count, unchanged_count, removed_count) tuple.
+        """
+        directory = os.path.abspath(directory)
+        catalog_path = os.path.abspath(self.path)
+
+        paths = [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if filename.endswith(".sqlite3")]
+        paths = [path for path in paths if path != catalog_path]
+
+        updated_count = 0
+        for path in paths:
+            if self.update_file(path):
+                updated_count += 1
+
+        existing_paths = set(paths)
+        removed_paths = [row['path'] for row in self._conn.execute("SELECT path FROM sessions;")
+                         if os.path.dirname(row['path']) == directory and row['path'] not in existing_paths]
+        for path in removed_paths:
+            self.remove_file(path)
+
+        return (updated_count, len(paths) - updated_count, len(removed_paths))
+
+    def query(self, track_ids=None, session_types=None, formulas=None, driver_ids=None, team_ids=None, name=None):
+        """Return the catalog entries of the sessions that match all given criteria, as a list of sqlite3.Row objects.
+
+        Each criterion is a list of acceptable ids; 'name' matches participants whose name contains it. The entries are
+        ordered by the time at which the session was recorded.
+        """
+        conditions = []
+        parameters = []
+
+        def add_condition(column, ids):
+            if ids is not None:
+                ids = list(ids)
+                conditions.append("{} IN ({})".format(column, ", ".join("?" * len(ids))))
+                parameters.extend(ids)
+
+        add_condition("trackId", track_ids)
+        add_condition("sessionType", session_types)
+        add_condition("formula", formulas)
+
+        participant_conditions = []
+        if driver_ids is not None:
+            driver_ids = list(driver_ids)
+            participant_conditions.append("driverId IN ({})".format(", ".join("?" * len(driver_ids))))
+            parameters.extend(driver_ids)
+        if team_ids is not None:
+            team_ids = list(team_ids)
+            participant_conditions.append("teamId IN ({})".format(", ".join("?" * len(team_ids))))
+            parameters.extend(team_ids)
+        if name is not None:
+            participant_conditions.append("name LIKE ?")
+            parameters.append("%{}%".format(name))
+        if participant_conditions:
+            conditions.append("path IN (SELECT path FROM participants WHERE {})".format(" AND ".join(participant_conditions)))
+
+        query = "SELECT * FROM sessions"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY firstTimestamp;"
+
+        return self._conn.execute(query, parameters).fetchall()
+
+    def participants(self, path: str):
+        """Return the participants of a session in the catalog, as a list of sqlite3.Row objects."""
+        return self._conn.execute("SELECT * FROM participants WHERE path = ? ORDER BY carIndex;", (os.path.abspath(path), )).fetchall()
+
+
+def update_catalog(catalog_path: str, session_path: str) -> None:
+    """Bring the catalog entry of a single session file up to date, e.g. after recording it."""
+    t1 = time.monotonic()
+    with SessionCatalog(catalog_path) as catalog:
+        catalog.update_file(session_path)
+    t2 = time.monotonic()
+    logging.info("Updated catalog {!r} in {:.3f} ms.".format(catalog_path, (t2 - t1) * 1000.0))
@@ -0,0 +1,103 @@
+"""Implements some useful command line argument parsing utilities for use in the command line tools."""
+
+import argparse
+
+from ..packets import PacketID, EventStringCode
+
+
+def single_packet_id(value: str) -> PacketID:
+    """Convert a packet type to a PacketID value.
+
+    Packet types can be given by name (e.g. 'LAP_DATA', case insensitive) or by number (e.g. '2').
+    This function is intended to be used as the 'type' argument of argparse.ArgumentParser.add_argument().
+    """
+    item = value.strip()
+    try:
+        if item.isdigit():
+            return PacketID(int(item))
+        return PacketID[item.upper()]
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError("unknown packet type {!r} (choose from: {})".format(
+            item, ", ".join(packet_id.name for packet_id in PacketID)))
+
+
+def packet_id_list(value: str):
+    """Convert a comma-separated list of packet types (see single_packet_id()) to a list of PacketID values.
+
+    This function is intended to be used as the 'type' argument of argparse.ArgumentParser.add_argument().
+    """
+    packet_ids = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        packet_id = single_packet_id(item)
+        if packet_id not in packet_ids:
+            packet_ids.append(packet_id)
+
+    if not packet_ids:
+        raise argparse.ArgumentTypeError("empty list of packet types")
+
+    return packet_ids
+
+
+def event_code_list(value: str):
+    """Convert a comma-separated list of event string codes (e.g. 'RTMT,TMPT', case insensitive) to a list of EventStringCode values.
+
+    This function is intended to be used as the 'type' argument of argparse.ArgumentParser.add_argument().
+    """
+    event_codes = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            event_code = EventStringCode[item.upper()]
+        except KeyError:
+            raise argparse.ArgumentTypeError("unknown event code {!r} (choose from: {})".format(
+                item, ", ".join(event_code.name for event_code in EventStringCode)))
+        if event_code not in event_codes:
+            event_codes.append(event_code)
+
+    if not event_codes:
+        raise argparse.ArgumentTypeError("empty list of event codes")
+
+    return event_codes
+
+
+def positive_int(value: str) -> int:
+    """Convert a string to a strictly positive integer, for use as the 'type' argument of argparse."""
+    try:
+        result = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid integer value {!r}".format(value))
+    if result < 1:
+        raise argparse.ArgumentTypeError("value must be at least 1 (got {})".format(result))
+    return result
+
+
+def car_index_list(value: str):
+    """Convert a comma-separated list of car indices (0 to 19, or 'player') to a list of int and 'player' values.
+
+    This function is intended to be used as the 'type' argument of argparse.ArgumentParser.add_argument().
+    """
+    car_indices = []
+    for item in value.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        if item == 'player':
+            car_index = item
+        else:
+            try:
+                car_index = int(item)
+            except ValueError:
+                car_index = -1
+            if not 0 <= car_index < 20:
+                raise argparse.ArgumentTypeError("invalid car index {!r} (choose from 0 to 19, or 'player')".format(item))
+        if car_index not in car_indices:
+            car_indices.append(car_index)
+
+    if not car_indices:
+        raise argparse.ArgumentTypeError("empty list of car indices")
+
+    return car_indices
@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+
+"""This script maintains and queries a catalog of recorded session files.
+
+The 'scan' command brings the catalog up to date with the session files in one or more directories. Only files that
+are new or changed since the previous scan are read. The 'query' command lists the sessions in the catalog that match
+the given criteria, e.g.:
+
+    f1-2019-telemetry-catalog scan ~/f1-sessions
+    f1-2019-telemetry-catalog query --track monza --session-type qualifying --driver hamilton
+
+Names of tracks, drivers and teams match if they contain the given text (case insensitive). Session types are given
+as a name (e.g. 'Q1', 'R') or a group ('practice', 'qualifying', 'race').
+
+See f1_2019_telemetry.catalog for a description of the catalog.
+"""
+
+import argparse
+import time
+import datetime
+import logging
+
+from ..catalog import SessionCatalog, DEFAULT_CATALOG_FILENAME
+from ..catalog import track_ids, driver_ids, team_ids, session_types
+from ..packets import TrackIDs
+from ..summary import SessionTypes, Formulas
+
+
+def _argument_type(function):
+    """Turn a function that raises ValueError into an argparse 'type' function."""
+    def convert(value):
+        try:
+            return function(value)
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(str(error))
+    return convert
+
+
+def _format_lap_time(lap_time):
+    if lap_time is None:
+        return "-"
+    return "{:d}:{:06.3f}".format(int(lap_time // 60), lap_time % 60)
+
+
+def scan(catalog, directories):
+    """Update the catalog with the session files in the given directories."""
+    for directory in directories:
+        t1 = time.monotonic()
+        (updated_count, unchanged_count, removed_count) = catalog.scan(directory)
+        t2 = time.monotonic()
+        logging.info("Scanned {!r} in {:.3f} s: {} files updated, {} unchanged, {} removed.".format(
+            directory, t2 - t1, updated_count, unchanged_count, removed_count))
+
+
+def query(catalog, args):
+    """Print the sessions that match the query."""
+    t1 = time.monotonic()
+    sessions = catalog.query(args.track_ids, args.session_types, None, args.driver_ids, args.team_ids, args.name)
+    t2 = time.monotonic()
+
+    for session in sessions:
+        print("{}  {:20s} {:10s} {:10s} {:>4} laps  best {:>9s}  {:7.1f} min  {}".format(
+            datetime.datetime.fromtimestamp(session['firstTimestamp']).strftime("%Y-%m-%d %H:%M"),
+            TrackIDs.get(session['trackId'], "-"),
+            SessionTypes.get(session['sessionType'], "-"),
+            Formulas.get(session['formula'], "-"),
+            session['lapCount'] if session['lapCount'] is not None else "-",
+            _format_lap_time(session['bestLapTime']),
+            (session['lastSessionTime'] - session['firstSessionTime']) / 60.0,
+            session['path']))
+
+    logging.info("Found {} sessions in {:.3f} ms.".format(len(sessions), (t2 - t1) * 1000.0))
+
+
+def main():
+    """Scan directories of session files, or query the catalog."""
+
+    # Configure logging.
+
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-23s | %(threadName)-10s | %(levelname)-5s | %(message)s")
+    logging.Formatter.default_msec_format = '%s.%03d'
+
+    # Parse command line arguments.
+
+    parser = argparse.ArgumentParser(description="Maintain and query a catalog of F1 2019 telemetry session files.")
+
+    parser.add_argument("-c", "--catalog", default=DEFAULT_CATALOG_FILENAME, help="catalog file (default: {})".format(DEFAULT_CATALOG_FILENAME), dest='catalog')
+
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    scan_parser = subparsers.add_parser("scan", help="update the catalog with the session files in one or more directories")
+    scan_parser.add_argument("directories", nargs='+', metavar='directory', help="directory that contains session files (*.sqlite3)")
+
+    query_parser = subparsers.add_parser("query", help="list the sessions in the catalog that match all given criteria")
+    query_parser.add_argument("-t", "--track", type=_argument_type(track_ids), metavar='TRACK', help="track name, e.g. monza", dest='track_ids')
+    query_parser.add_argument("-s", "--session-type", type=_argument_type(session_types), metavar='SESSION_TYPE', help="session type, e.g. Q1, R, practice, qualifying, race", dest='session_types')
+    query_parser.add_argument("-d", "--driver", type=_argument_type(driver_ids), metavar='DRIVER', help="driver name, e.g. hamilton", dest='driver_ids')
+    query_parser.add_argument("--team", type=_argument_type(team_ids), metavar='TEAM', help="team name, e.g. ferrari", dest='team_ids')
+    query_parser.add_argument("-n", "--name", help="participant name as shown in the game", dest='name')
+
+    args = parser.parse_args()
+
+    with SessionCatalog(args.catalog) as catalog:
+        if args.command == "scan":
+            scan(catalog, args.directories)
+        else:
+            query(catalog, args)
+
+    # All done.
+
+    logging.info("All done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+#! /usr/bin/env python3
+
+"""This script prepares a directory of recorded session files for analysis, using all CPU cores.
+
+For each session file, it:
+
+* builds the lap index (the 'laps' table, see f1_2019_telemetry.lap_index);
+* writes the session summary (the 'session_summary' table, see f1_2019_telemetry.summary);
+* converts the packets to columnar NumPy arrays, stored in the sidecar cache directory that load_session() uses
+  (see f1_2019_telemetry.session_loader).
+
+Files are processed in parallel by a pool of worker processes, largest file first. When there are fewer files left than
+idle workers, the conversion of a large file is split into pkt_id ranges that are decoded by several workers at once;
+the parts are then joined and written to the cache.
+
+Every step is skipped if its result is already present and up to date, so an interrupted run can simply be started
+again, and running the script again after recording new sessions only processes the new files. Use --force to redo
+all steps.
+
+Progress is logged for each file that is done, along with the overall throughput.
+
+This script requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import argparse
+import os
+import time
+import logging
+import sqlite3
+import collections
+import concurrent.futures
+
+from .argparse_utils import positive_int
+from ..lap_index import build_lap_index, has_lap_index
+from ..summary import SessionSummary, has_session_summary, write_session_summary
+from ..session_loader import read_session, concatenate_sessions, write_cache, cache_is_current, source_signature
+from ..sqlite_utils import connect_read_only, is_session_file
+
+# A session file that has its lap index and summary, and is ready to be converted.
+ConversionPlan = collections.namedtuple('ConversionPlan', 'path, first_pkt_id, stop_pkt_id, packet_count, size, signature')
+
+
+def is_converted(path: str) -> bool:
+    """Return True if all steps have been done for a session file."""
+    if not cache_is_current(path):
+        return False
+    conn = connect_read_only(path)
+    try:
+        return has_lap_index(conn) and has_session_summary(conn)
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+
+
+def prepare_file(path: str, force: bool) -> ConversionPlan:
+    """Build the lap index and the summary of a session file if needed; return its ConversionPlan.
+
+    This runs in a worker process.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        if force or not has_lap_index(conn):
+            build_lap_index(path)
+        if force or not has_session_summary(conn):
+            summary = SessionSummary.from_database(conn)
+            if summary is not None:
+                write_session_summary(conn, summary)
+        (first_pkt_id, last_pkt_id, packet_count) = conn.execute("SELECT MIN(pkt_id), MAX(pkt_id), COUNT(*) FROM packets;").fetchone()
+    finally:
+        conn.close()
+
+    # The file is not modified after this point, so this is the signature that the cache should have.
+    signature = source_signature(path)
+
+    if packet_count == 0:
+        (first_pkt_id, last_pkt_id) = (0, -1)
+
+    return ConversionPlan(path, first_pkt_id, last_pkt_id + 1, packet_count, signature['size'], signature)
+
+
+def convert_file(plan: ConversionPlan) -> None:
+    """Convert an entire session file to its columnar cache. This runs in a worker process."""
+    write_cache(plan.path, read_session(plan.path), plan.signature)
+
+
+def read_range(plan: ConversionPlan, pkt_id_range):
+    """Read the packets of a session file in a pkt_id range as columns. This runs in a worker process."""
+    return read_session(plan.path, pkt_id_range)
+
+
+def split_pkt_id_range(first_pkt_id: int, stop_pkt_id: int, count: int):
+    """Split a half-open pkt_id range in 'count' consecutive ranges of (nearly) equal length."""
+    bounds = [first_pkt_id + (stop_pkt_id - first_pkt_id) * i // count for i in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class ConversionProgress:
+    """Keeps track of the files that are done, and logs the progress and throughput."""
+
+    def __init__(self, total_count):
+        self.total_count = total_count
+        self.done_count = 0
+        self.failed_count = 0
+        self.packet_count = 0
+        self.size = 0
+        self.start_time = time.monotonic()
+
+    def file_done(self, plan, duration):
+        self.done_count += 1
+        self.packet_count += plan.packet_count
+        self.size += plan.size
+        elapsed = time.monotonic() - self.start_time
+        logging.info("[{}/{}] Converted {!r}: {} packets, {:.1f} MB in {:.2f} s; overall {:.0f} packets/s, {:.1f} MB/s.".format(
+            self.done_count + self.failed_count, self.total_count, plan.path, plan.packet_count, plan.size / 1e6, duration,
+            self.packet_count / elapsed, self.size / 1e6 / elapsed))
+
+    def file_failed(self, path, error):
+        self.failed_count += 1
+        logging.error("[{}/{}] Unable to convert {!r}: {}".format(self.done_count + self.failed_count, self.total_count, path, error))
+
+    def report(self):
+        elapsed = time.monotonic() - self.start_time
+        logging.info("Converted {} files ({} failed): {} packets, {:.1f} MB in {:.2f} s ({:.0f} packets/s, {:.1f} MB/s).".format(
+            self.done_count, self.failed_count, self.packet_count, self.size / 1e6, elapsed,
+            self.packet_count / elapsed if elapsed > 0 else 0.0, self.size / 1e6 / elapsed if elapsed > 0 else 0.0))
+
+
+def convert_files(paths, jobs: int, force: bool, split_packets: int) -> ConversionProgress:
+    """Convert session files using a pool of 'jobs' worker processes."""
+
+    progress = ConversionProgress(len(paths))
+
+    # Handle the largest files first, so the small ones can fill up the gaps at the end.
+    to_prepare = collections.deque(sorted(paths, key=os.path.getsize, reverse=True))
+    to_convert = collections.deque()
+
+    # Maps futures to (task, plan or path) tuples.
+    futures = {}
+
+    # For files that are converted in parts: maps paths to lists of futures, and the start times of all files.
+    parts = {}
+    start_times = {}
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        try:
+            while to_prepare or to_convert or futures:
+
+                # Keep all workers busy. Preparing comes first, since it provides the files to be converted.
+                while len(futures) < jobs and (to_prepare or to_convert):
+                    if to_prepare:
+                        path = to_prepare.popleft()
+                        start_times[path] = time.monotonic()
+                        futures[executor.submit(prepare_file, path, force)] = ('prepare', path)
+                        continue
+                    plan = to_convert.popleft()
+                    # Only split if workers would otherwise be idle.
+                    idle_workers = jobs - len(futures) - len(to_convert)
+                    part_count = max(1, min(idle_workers, plan.packet_count // max(1, split_packets)))
+                    if part_count == 1:
+                        futures[executor.submit(convert_file, plan)] = ('convert', plan)
+                    else:
+                        logging.debug("Splitting {!r} into {} parts.".format(plan.path, part_count))
+                        part_futures = [executor.submit(read_range, plan, pkt_id_range)
+                                        for pkt_id_range in split_pkt_id_range(plan.first_pkt_id, plan.stop_pkt_id, part_count)]
+                        parts[plan.path] = part_futures
+                        for future in part_futures:
+                            futures[future] = ('part', plan)
+
+                (done, not_done) = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    (task, item) = futures.pop(future)
+                    path = item if task == 'prepare' else item.path
+                    if path not in start_times:
+                        # Another part of this file failed already.
+                        continue
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        progress.file_failed(path, error)
+                        del start_times[path]
+                        for part_future in parts.pop(path, []):
+                            part_future.cancel()
+                        continue
+
+                    if task == 'prepare':
+                        to_convert.append(result)
+                    elif task == 'convert':
+                        progress.file_done(item, time.monotonic() - start_times.pop(path))
+                    elif all(part_future.done() for part_future in parts[path]):
+                        # The last part of a split file: join the parts, and write the cache.
+                        try:
+                            session = concatenate_sessions(part_future.result() for part_future in parts.pop(path))
+                            write_cache(path, session, item.signature)
+                        except Exception as error:
+                            progress.file_failed(path, error)
+                            del start_times[path]
+                        else:
+                            progress.file_done(item, time.monotonic() - start_times.pop(path))
+
+        except KeyboardInterrupt:
+            logging.warning("Interrupted; waiting for running tasks to finish. Run again to resume.")
+            for future in futures:
+                future.cancel()
+            raise
+
+    return progress
+
+
+def main():
+    """Convert all session files in a directory."""
+
+    # Configure logging.
+
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-23s | %(processName)-10s | %(levelname)-5s | %(message)s")
+    logging.Formatter.default_msec_format = '%s.%03d'
+
+    # Parse command line arguments.
+
+    parser = argparse.ArgumentParser(description="Build the lap index, the summary and the columnar cache of F1 2019 telemetry session files.")
+
+    parser.add_argument("-j", "--jobs", default=os.cpu_count() or 1, type=positive_int, help="number of worker processes (default: number of CPU cores)", dest='jobs')
+    parser.add_argument("-f", "--force", action='store_true', help="redo all steps, even for session files that are up to date", dest='force')
+    parser.add_argument("-s", "--split-packets", default=100000, type=positive_int, help="minimum number of packets per part when splitting a file (default: 100000)", dest='split_packets')
+    parser.add_argument("directory", help="directory that contains the session files (*.sqlite3)")
+
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.directory, filename) for filename in os.listdir(args.directory) if filename.endswith(".sqlite3"))
+
+    # Skip SQLite3 files that are not session files, such as the session catalog.
+    paths = [path for path in paths if is_session_file(path)]
+
+    if not args.force:
+        skipped_paths = {path for path in paths if is_converted(path)}
+        if skipped_paths:
+            logging.info("Skipping {} session files that are up to date.".format(len(skipped_paths)))
+            paths = [path for path in paths if path not in skipped_paths]
+
+    logging.info("Converting {} session files using {} worker processes.".format(len(paths), args.jobs))
+
+    try:
+        progress = convert_files(paths, args.jobs, args.force, args.split_packets)
+    except KeyboardInterrupt:
+        return
+
+    progress.report()
+
+    # All done.
+
+    logging.info("All done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+#! /usr/bin/env python3
+
+"""This script exports the packets of one type from a session file as CSV or JSON Lines, for use outside Python.
+
+    f1-2019-telemetry-export -p car_telemetry -c 0,player -f speed,throttle,brake,gear --start 60 --end 180 session.sqlite3
+
+Packets of per-car types (motion, lap data, participants, car setups, car telemetry, car status) become one row per
+car, with a 'carIndex' column; other packet types become one row per packet. Each row starts with the recorder's
+'timestamp' and the 'sessionTime' and 'frameIdentifier' header fields. Array fields get a column per element
+(e.g. 'tyresPressure[0]'), and fields of nested structures get a dotted name (e.g. 'marshalZones[3].zoneFlag').
+The --fields option selects fields by name, or by the name of an array or nested structure; by default, all fields of
+the per-car array (or, for other packet types, all fields of the packet) are exported.
+
+The export is a pipeline of generators that handles one batch of rows at a time, so memory use doesn't depend on the
+size of the session file:
+
+* read_packet_batches() reads the rows of the selected packet type and time range from the session file;
+* project_rows() decodes only the selected fields of the selected cars, using a FieldProjection: the packets of a
+  batch are viewed as a single NumPy array, with a structured dtype that only has the selected fields, at their
+  offsets in the packet; the fields of the output rows are gathered into a packed array, which is converted to
+  Python values in a single call;
+* write_csv() or write_json_lines() writes the rows to a buffered output file (or standard output). JSON has no
+  NaN or infinite numbers; write_json_lines() writes them as null.
+
+This script requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import argparse
+import sys
+import csv
+import json
+import math
+import time
+import ctypes
+import logging
+
+import numpy as np
+
+from ..packets import PackedLittleEndianStructure, HeaderFieldsToPacketType
+from ..sqlite_utils import connect_read_only
+from .argparse_utils import single_packet_id, car_index_list, positive_int
+
+# The number of cars in the per-car arrays of the packets.
+_NUM_CARS = 20
+
+# The little-endian NumPy types of the ctypes types used in the packets.
+_DTYPE_CODES = {
+    ctypes.c_uint8  : '<u1',
+    ctypes.c_int8   : '<i1',
+    ctypes.c_uint16 : '<u2',
+    ctypes.c_int16  : '<i2',
+    ctypes.c_uint32 : '<u4',
+    ctypes.c_int32  : '<i4',
+    ctypes.c_uint64 : '<u8',
+    ctypes.c_int64  : '<i8',
+    ctypes.c_float  : '<f4',
+    ctypes.c_double : '<f8',
+    ctypes.c_char   : 'S1'
+}
+
+# The columns that come from the 'packets' table rather than from the packet itself.
+_ROW_COLUMNS = ['timestamp', 'sessionTime', 'frameIdentifier']
+
+
+def _is_structure(ctype):
+    return isinstance(ctype, type) and issubclass(ctype, PackedLittleEndianStructure)
+
+
+def _is_structure_array(ctype):
+    return isinstance(ctype, type) and issubclass(ctype, ctypes.Array) and _is_structure(ctype._type_)
+
+
+def _leaf_fields(structure_type, prefix="", base=0):
+    """Yield the (name, offset, ctype) of the scalar and scalar array fields of a structure, flattening nested structures."""
+    for (name, field_type) in structure_type._fields_:
+        offset = base + getattr(structure_type, name).offset
+        if _is_structure(field_type):
+            yield from _leaf_fields(field_type, prefix + name + ".", offset)
+        elif _is_structure_array(field_type):
+            element_size = ctypes.sizeof(field_type._type_)
+            for index in range(field_type._length_):
+                yield from _leaf_fields(field_type._type_, "{}{}[{}].".format(prefix, name, index), offset + index * element_size)
+        else:
+            yield (prefix + name, offset, field_type)
+
+
+def _is_selected(name, field_names):
+    """Return True if a leaf field is selected by its own name, or by the name of an enclosing array or structure."""
+    return any(name == field_name or name.startswith(field_name + ".") or name.startswith(field_name + "[") for field_name in field_names)
+
+
+class _RecordLayout:
+    """A NumPy structured dtype that views a set of leaf fields at their offsets, skipping the bytes in between.
+
+    Array fields are split into a field per element, so each field of the dtype is an output column; its name is the
+    column name. Character arrays are a single bytes field.
+    """
+
+    def __init__(self, leaves, itemsize):
+        (names, formats, offsets) = ([], [], [])
+        for (name, offset, ctype) in sorted(leaves, key=lambda leaf: leaf[1]):
+            if issubclass(ctype, ctypes.Array) and ctype._type_ is ctypes.c_char:
+                names.append(name)
+                formats.append('S{}'.format(ctype._length_))
+                offsets.append(offset)
+            elif issubclass(ctype, ctypes.Array):
+                element_size = ctypes.sizeof(ctype._type_)
+                for index in range(ctype._length_):
+                    names.append("{}[{}]".format(name, index))
+                    formats.append(_DTYPE_CODES[ctype._type_])
+                    offsets.append(offset + index * element_size)
+            else:
+                names.append(name)
+                formats.append(_DTYPE_CODES[ctype])
+                offsets.append(offset)
+        self.columns = names
+        self.formats = formats
+        self.dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': itemsize})
+
+
+class FieldProjection:
+    """Decodes only the selected fields of packets of a single type.
+
+    Args:
+        packet_type: the ctypes structure type of the packets.
+        field_names: the names of the fields to decode (see _is_selected()), or None for the default fields: those of
+            the per-car array if the packet type has one, and all fields of the packet otherwise.
+
+    Raises:
+        ValueError: if a field name doesn't match any field of the packet type.
+    """
+
+    def __init__(self, packet_type, field_names=None):
+        self.packet_type = packet_type
+        self.packet_size = ctypes.sizeof(packet_type)
+
+        # The per-car array, if any.
+        car_arrays = [(name, field_type) for (name, field_type) in packet_type._fields_
+                      if _is_structure_array(field_type) and field_type._length_ == _NUM_CARS]
+        if car_arrays:
+            (car_array_name, car_array_type) = car_arrays[0]
+            self.car_offset = getattr(packet_type, car_array_name).offset
+            self.car_size = ctypes.sizeof(car_array_type._type_)
+            car_leaves = list(_leaf_fields(car_array_type._type_))
+        else:
+            (car_array_name, self.car_offset, self.car_size) = (None, None, None)
+            car_leaves = []
+
+        # The fields outside the per-car array, except the header; its fields are columns of the 'packets' table.
+        excluded = ['header'] + ([car_array_name] if car_array_name is not None else [])
+        packet_leaves = [leaf for leaf in _leaf_fields(packet_type) if not _is_selected(leaf[0], excluded)]
+
+        if field_names is None:
+            selected_car_leaves = car_leaves
+            selected_packet_leaves = [] if car_leaves else packet_leaves
+        else:
+            unknown = [field_name for field_name in field_names
+                       if not any(_is_selected(leaf[0], [field_name]) for leaf in car_leaves + packet_leaves)]
+            if unknown:
+                raise ValueError("unknown fields for {}: {}".format(packet_type.__name__, ", ".join(unknown)))
+            selected_car_leaves = [leaf for leaf in car_leaves if _is_selected(leaf[0], field_names)]
+            selected_packet_leaves = [leaf for leaf in packet_leaves if _is_selected(leaf[0], field_names)]
+
+        self.is_per_car = bool(car_leaves)
+        self.car_array_name = car_array_name
+        self.packet_layout = _RecordLayout(selected_packet_leaves, self.packet_size)
+        self.car_layout = _RecordLayout(selected_car_leaves, self.car_size or 0)
+
+        # The dtype that views the selected fields of a packet, and those of all cars as a single (20, ) field.
+        (names, fields) = (list(self.packet_layout.dtype.names), self.packet_layout.dtype.fields)
+        if self.is_per_car:
+            self.dtype = np.dtype({'names': names + [car_array_name],
+                                   'formats': [fields[name][0] for name in names] + [(self.car_layout.dtype, _NUM_CARS)],
+                                   'offsets': [fields[name][1] for name in names] + [self.car_offset],
+                                   'itemsize': self.packet_size})
+        else:
+            self.dtype = self.packet_layout.dtype
+
+        self.columns = list(_ROW_COLUMNS)
+        formats = ['<f8', '<f8', '<i8']
+        if self.is_per_car:
+            self.columns.append('carIndex')
+            formats.append('<i8')
+        self.columns.extend(self.packet_layout.columns)
+        self.columns.extend(self.car_layout.columns)
+        formats.extend(self.packet_layout.formats)
+        formats.extend(self.car_layout.formats)
+
+        # The packed dtype of the output rows, with a field per column; the fields are named by position, as the
+        # column names may not be unique.
+        self.row_dtype = np.dtype({'names': ["f{}".format(index) for index in range(len(formats))], 'formats': formats})
+        self.string_columns = [index for (index, row_format) in enumerate(formats) if row_format.startswith('S')]
+
+    def rows(self, batch, car_indices):
+        """Return the output rows of a batch of (timestamp, sessionTime, frameIdentifier, playerCarIndex, packet) rows of the 'packets' table, as tuples.
+
+        The packets must have the size of the packet type. A 'player' car index is resolved using the packet's
+        playerCarIndex; each car is output at most once per packet.
+
+        The selected fields are copied into an array of output rows, a column at a time, which is then converted to
+        tuples of Python values in a single call.
+        """
+        if not batch:
+            return []
+        (timestamps, session_times, frame_identifiers, player_car_indices, packets) = zip(*batch)
+        records = np.frombuffer(b"".join(packets), dtype=self.dtype)
+
+        if self.is_per_car:
+            # The car index of each packet (rows) and each requested car (columns); cars that are out of range, or
+            # that were already requested for the same packet, are left out.
+            player_car_indices = np.array(player_car_indices, dtype=np.int64)
+            car_index = np.column_stack([player_car_indices if requested == 'player' else np.full(len(records), requested, dtype=np.int64)
+                                         for requested in car_indices])
+            selected = (car_index >= 0) & (car_index < _NUM_CARS)
+            for column in range(1, car_index.shape[1]):
+                selected[:, column] &= ~np.any(car_index[:, :column] == car_index[:, column:column + 1], axis=1)
+            (packet_index, column_index) = np.nonzero(selected)
+            car_index = car_index[packet_index, column_index]
+        else:
+            packet_index = np.arange(len(records))
+
+        columns = [np.array(timestamps, dtype=np.float64)[packet_index],
+                   np.array(session_times, dtype=np.float64)[packet_index],
+                   np.array(frame_identifiers, dtype=np.int64)[packet_index]]
+        if self.is_per_car:
+            columns.append(car_index)
+        columns.extend(records[name][packet_index] for name in self.packet_layout.dtype.names)
+        if self.is_per_car:
+            cars = records[self.car_array_name][packet_index, car_index]
+            columns.extend(cars[name] for name in self.car_layout.dtype.names)
+
+        output = np.empty(len(packet_index), dtype=self.row_dtype)
+        for (name, column) in zip(self.row_dtype.names, columns):
+            output[name] = column
+        rows = output.tolist()
+
+        if self.string_columns:
+            rows = [self._decode_strings(row) for row in rows]
+        return rows
+
+    def _decode_strings(self, row):
+        """Decode the character array fields of a row, up to their first null character."""
+        row = list(row)
+        for index in self.string_columns:
+            row[index] = row[index].split(b"\0", 1)[0].decode(errors='replace')
+        return tuple(row)
+
+
+def packet_type_of(packet_id):
+    """Return the (packetFormat, packetVersion, packet type) of a packet id; the most recent version if there are several."""
+    (packet_format, packet_version, packet_id) = max(key for key in HeaderFieldsToPacketType if key[2] == packet_id)
+    return (packet_format, packet_version, HeaderFieldsToPacketType[(packet_format, packet_version, packet_id)])
+
+
+def read_packet_batches(path, packet_id, start_time=None, end_time=None, batch_size=1000):
+    """Yield lists of at most 'batch_size' (timestamp, sessionTime, frameIdentifier, playerCarIndex, packet) rows.
+
+    Only packets of the given type, with a session time in the half-open range [start_time, end_time), are read.
+    """
+    (packet_format, packet_version, packet_type) = packet_type_of(packet_id)
+
+    query = "SELECT timestamp, sessionTime, frameIdentifier, playerCarIndex, packet FROM packets WHERE packetId = ? AND packetFormat = ? AND packetVersion = ?"
+    parameters = [packet_id, packet_format, packet_version]
+    if start_time is not None:
+        query += " AND sessionTime >= ?"
+        parameters.append(start_time)
+    if end_time is not None:
+        query += " AND sessionTime < ?"
+        parameters.append(end_time)
+
+    conn = connect_read_only(path)
+    try:
+        cursor = conn.execute(query + " ORDER BY pkt_id;", parameters)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        conn.close()
+
+
+def project_rows(batches, projection, car_indices):
+    """Yield the output rows of each batch of packets, as tuples; packets of the wrong size are skipped."""
+    for batch in batches:
+        yield projection.rows([row for row in batch if len(row[4]) == projection.packet_size], car_indices)
+
+
+def write_csv(row_batches, columns, fo):
+    """Write a header line and the rows as CSV; return the number of rows."""
+    writer = csv.writer(fo)
+    writer.writerow(columns)
+    row_count = 0
+    for rows in row_batches:
+        writer.writerows(rows)
+        row_count += len(rows)
+    return row_count
+
+
+def _encode_json_row(encoder, columns, row):
+    """Encode a row as a JSON object; NaN and infinite values, which JSON doesn't have, are written as null."""
+    try:
+        return encoder.encode(dict(zip(columns, row)))
+    except ValueError:
+        # The encoder refuses non-finite floats; these are rare, so only then do we look for them.
+        return encoder.encode(dict(zip(columns, (None if isinstance(value, float) and not math.isfinite(value) else value for value in row))))
+
+
+def write_json_lines(row_batches, columns, fo):
+    """Write the rows as JSON objects, one per line; return the number of rows."""
+    encoder = json.JSONEncoder(separators=(",", ":"), allow_nan=False)
+    row_count = 0
+    for rows in row_batches:
+        fo.write("".join(_encode_json_row(encoder, columns, row) + "\n" for row in rows))
+        row_count += len(rows)
+    return row_count
+
+
+def _field_list(value):
+    field_names = [item.strip() for item in value.split(",") if item.strip()]
+    if not field_names:
+        raise argparse.ArgumentTypeError("empty list of fields")
+    return field_names
+
+
+def main():
+    """Export the packets of one type from a session file."""
+
+    # Configure logging.
+
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-23s | %(threadName)-10s | %(levelname)-5s | %(message)s")
+    logging.Formatter.default_msec_format = '%s.%03d'
+
+    # Parse command line arguments.
+
+    parser = argparse.ArgumentParser(description="Export F1 2019 telemetry packets of one type as CSV or JSON Lines.")
+
+    parser.add_argument("-p", "--packet-type", required=True, type=single_packet_id, metavar='PACKET_TYPE', help="packet type to export, e.g. CAR_TELEMETRY", dest='packet_id')
+    parser.add_argument("-c", "--cars", default=list(range(_NUM_CARS)), type=car_index_list, metavar='CARS', help="comma-separated list of car indices, or 'player' (default: all cars)", dest='car_indices')
+    parser.add_argument("-f", "--fields", type=_field_list, metavar='FIELDS', help="comma-separated list of fields to export (default: all fields of the per-car array, or of the packet)", dest='field_names')
+    parser.add_argument("--start", type=float, metavar='START', help="only export packets with a session time of at least START seconds", dest='start_time')
+    parser.add_argument("--end", type=float, metavar='END', help="only export packets with a session time before END seconds", dest='end_time')
+    parser.add_argument("--format", choices=['csv', 'jsonl'], default='csv', help="output format (default: csv)", dest='format')
+    parser.add_argument("-o", "--output", help="output file (default: standard output)", dest='output')
+    parser.add_argument("-b", "--batch-size", default=1000, type=positive_int, help="number of packets read per batch (default: 1000)", dest='batch_size')
+    parser.add_argument("filename", help="session file to export")
+
+    args = parser.parse_args()
+
+    packet_id = args.packet_id
+
+    try:
+        projection = FieldProjection(packet_type_of(packet_id)[2], args.field_names)
+    except ValueError as error:
+        parser.error("argument -f/--fields: {}".format(error))
+
+    logging.info("Exporting {} packets from {!r}: {} columns.".format(packet_id.name, args.filename, len(projection.columns)))
+
+    batches = read_packet_batches(args.filename, packet_id, args.start_time, args.end_time, args.batch_size)
+    row_batches = project_rows(batches, projection, args.car_indices)
+    write = write_csv if args.format == 'csv' else write_json_lines
+
+    t1 = time.monotonic()
+    if args.output is None:
+        row_count = write(row_batches, projection.columns, sys.stdout)
+        sys.stdout.flush()
+    else:
+        with open(args.output, "w", newline="", buffering=1 << 20) as fo:
+            row_count = write(row_batches, projection.columns, fo)
+    t2 = time.monotonic()
+
+    logging.info("Exported {} rows in {:.3f} s ({:.0f} rows/s).".format(row_count, t2 - t1, row_count / (t2 - t1) if t2 > t1 else 0.0))
+
+    # All done.
+
+    logging.info("All done.")
+
+
+if __name__ == "__main__":
+    main()
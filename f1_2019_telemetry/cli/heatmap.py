@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+
+"""This script aggregates the telemetry of many session files into heatmaps of a track.
+
+The positions of all cars are binned into a grid of square cells, and the speed, throttle, brake and tyre surface
+temperature are averaged per cell; braking points are counted per cell. The same is done per bin of lap distance,
+with a histogram of each channel per bin (see f1_2019_telemetry.heatmap). Session files are processed in parallel,
+and their partial results are merged as they come in, so memory use doesn't depend on the number of files:
+
+    f1-2019-telemetry-heatmap --track monza --output monza.npz --png monza ~/f1-sessions
+
+The result is saved as NumPy arrays in an .npz file (see TrackHeatmap.load()). With --png, an image is rendered for
+each channel and for the braking points; this requires matplotlib.
+
+This script requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import argparse
+import os
+import time
+import logging
+
+from .argparse_utils import positive_int
+from ..catalog import track_ids
+from ..heatmap import aggregate_session_files, render_png
+from ..packets import TrackIDs
+from ..sqlite_utils import is_session_file
+
+
+def _session_files(paths):
+    """Expand directories to the session files (*.sqlite3) they contain.
+
+    Other SQLite3 files in a directory, such as the session catalog, are left out.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = sorted(os.path.join(path, filename) for filename in os.listdir(path) if filename.endswith(".sqlite3"))
+            files.extend(filename for filename in filenames if is_session_file(filename))
+        else:
+            files.append(path)
+    return files
+
+
+def _track_ids(name):
+    try:
+        return track_ids(name)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def main():
+    """Aggregate session files into track heatmaps."""
+
+    # Configure logging.
+
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-23s | %(processName)-10s | %(levelname)-5s | %(message)s")
+    logging.Formatter.default_msec_format = '%s.%03d'
+
+    # Parse command line arguments.
+
+    parser = argparse.ArgumentParser(description="Aggregate F1 2019 telemetry session files into track heatmaps.")
+
+    parser.add_argument("-j", "--jobs", default=os.cpu_count() or 1, type=positive_int, help="number of worker processes (default: number of CPU cores)", dest='jobs')
+    parser.add_argument("-t", "--track", type=_track_ids, metavar='TRACK', help="only use sessions on this track, e.g. monza (default: the track of the first session)", dest='track_ids')
+    parser.add_argument("-c", "--cell-size", default=5.0, type=float, help="size of the grid cells in metres (default: 5)", dest='cell_size')
+    parser.add_argument("-o", "--output", default="heatmap.npz", help="output file (default: heatmap.npz)", dest='output')
+    parser.add_argument("--png", metavar='PREFIX', help="render the heatmaps to PREFIX-<channel>.png (requires matplotlib)", dest='png')
+    parser.add_argument("paths", nargs='+', metavar='path', help="session file, or directory that contains session files (*.sqlite3)")
+
+    args = parser.parse_args()
+
+    paths = _session_files(args.paths)
+    logging.info("Aggregating {} session files using {} worker processes.".format(len(paths), args.jobs))
+
+    t1 = time.monotonic()
+    heatmap = aggregate_session_files(paths, args.jobs, args.track_ids, cell_size=args.cell_size)
+    t2 = time.monotonic()
+
+    if heatmap.session_count == 0:
+        logging.error("No session files were aggregated.")
+        return
+
+    logging.info("Aggregated {} sessions on {}: {} samples ({} outside the grid) in {:.3f} s.".format(
+        heatmap.session_count, TrackIDs.get(heatmap.track_id, heatmap.track_id), heatmap.sample_count, heatmap.outside_count, t2 - t1))
+
+    heatmap.save(args.output)
+    logging.info("Saved heatmaps to {!r}.".format(args.output))
+
+    if args.png is not None:
+        for name in [channel.name for channel in heatmap.channels] + ['braking_points']:
+            filename = "{}-{}.png".format(args.png, name)
+            try:
+                render_png(heatmap, name, filename)
+            except ImportError:
+                logging.error("Rendering requires matplotlib (pip install f1-2019-telemetry[plots]).")
+                break
+            logging.info("Rendered {!r}.".format(filename))
+
+    # All done.
+
+    logging.info("All done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+
+"""This script receives F1 2019 telemetry packets on a UDP port and distributes them to local subscribers.
+
+The hub is the single receiver of the UDP telemetry stream. Local programs (such as the recorder and the monitor,
+when started with the --hub option) subscribe to the hub over a Unix datagram socket, and receive the raw packets
+they are interested in. Each subscriber has its own bounded queue in the hub, so a slow subscriber cannot hold up
+the others; see module f1_2019_telemetry.hub for details.
+"""
+
+import argparse
+import sys
+import os
+import socket
+import threading
+import logging
+import selectors
+
+from .threading_utils import WaitConsoleThread, Barrier
+from ..hub import TelemetryHub, DEFAULT_HUB_PATH
+from ..shared_state import SharedStateWriter, DEFAULT_SHARED_STATE_NAME
+from ..sockets import MAX_PACKET_SIZE, bind_telemetry_socket
+
+
+class PacketHubThread(threading.Thread):
+    """The PacketHubThread receives incoming telemetry packets via the network and distributes them to subscribers."""
+
+    def __init__(self, udp_port, hub_path, max_queue_length, shared_state_writer=None):
+        super().__init__(name='hub')
+        self._udp_port = udp_port
+        self._hub_path = hub_path
+        self._shared_state_writer = shared_state_writer
+        self._hub = TelemetryHub(max_queue_length, on_remove=self._unregister_subscription)
+        self._socketpair = socket.socketpair()
+
+        # The selector, and the subscriptions whose sockets are registered with it because they have datagrams pending.
+        self._selector = None
+        self._registered_subscriptions = set()
+
+    def close(self):
+        for sock in self._socketpair:
+            sock.close()
+
+    def run(self):
+        """Receive incoming packets and control messages, and distribute packets to subscribers.
+
+        This method runs in its own thread.
+        """
+
+        # Accept UDP packets from any host.
+        udp_socket = bind_telemetry_socket(self._udp_port)
+
+        # Remove a stale control socket left behind by a previous hub.
+        if os.path.exists(self._hub_path):
+            os.unlink(self._hub_path)
+
+        control_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        control_socket.bind(self._hub_path)
+
+        selector = selectors.DefaultSelector()
+        self._selector = selector
+
+        key_udp_socket = selector.register(udp_socket, selectors.EVENT_READ)
+        key_control_socket = selector.register(control_socket, selectors.EVENT_READ)
+        key_socketpair = selector.register(self._socketpair[0], selectors.EVENT_READ)
+
+        logging.info("Hub thread started, reading UDP packets from port {}, control socket {!r}.".format(self._udp_port, self._hub_path))
+
+        quitflag = False
+        while not quitflag:
+            for (key, events) in selector.select():
+                if key == key_udp_socket:
+                    datagram = udp_socket.recv(MAX_PACKET_SIZE)
+                    self._hub.distribute(datagram)
+                    if self._shared_state_writer is not None:
+                        self._shared_state_writer.update(datagram)
+                elif key == key_control_socket:
+                    (message, path) = control_socket.recvfrom(MAX_PACKET_SIZE)
+                    self._hub.handle_control_message(message, path)
+                elif key == key_socketpair:
+                    quitflag = True
+
+            self._hub.send_queued()
+
+            # Wait for writability of the subscriber sockets that have datagrams pending, and only those.
+            pending_subscriptions = set(self._hub.pending_subscriptions())
+            for subscription in self._registered_subscriptions - pending_subscriptions:
+                self._unregister_subscription(subscription)
+            for subscription in pending_subscriptions - self._registered_subscriptions:
+                selector.register(subscription.sock, selectors.EVENT_WRITE)
+                self._registered_subscriptions.add(subscription)
+
+        self._hub.close()
+
+        selector.close()
+        self._selector = None
+        control_socket.close()
+        os.unlink(self._hub_path)
+        udp_socket.close()
+        for sock in self._socketpair:
+            sock.close()
+
+        logging.info("Hub thread stopped.")
+
+    def _unregister_subscription(self, subscription):
+        """Stop waiting for writability of a subscriber socket. Must be called before the socket is closed."""
+        if subscription in self._registered_subscriptions:
+            self._selector.unregister(subscription.sock)
+            self._registered_subscriptions.discard(subscription)
+
+    def request_quit(self):
+        """Request termination of the PacketHubThread.
+
+        Called from the main thread to request that we quit.
+        """
+        self._socketpair[1].send(b'\x00')
+
+
+def main():
+    """Distribute incoming telemetry data until the user presses enter."""
+
+    # Configure logging.
+
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-23s | %(threadName)-10s | %(levelname)-5s | %(message)s")
+    logging.Formatter.default_msec_format = '%s.%03d'
+
+    # Parse command line arguments.
+
+    parser = argparse.ArgumentParser(description="Receive F1 2019 telemetry data and distribute it to local subscribers.")
+
+    parser.add_argument("-p", "--port", default=20777, type=int, help="UDP port to listen to (default: 20777)", dest='port')
+    parser.add_argument("-s", "--socket", default=DEFAULT_HUB_PATH, type=str, help="path of the hub's control socket (default: {})".format(DEFAULT_HUB_PATH), dest='hub_path')
+    parser.add_argument("-q", "--queue-length", default=1000, type=int, help="maximum number of packets queued per subscriber (default: 1000)", dest='queue_length')
+    parser.add_argument("-m", "--shared-memory", nargs='?', const=DEFAULT_SHARED_STATE_NAME, default=None, type=str, metavar='NAME', help="also keep the latest packet of each type in the named shared memory block (default name: {})".format(DEFAULT_SHARED_STATE_NAME), dest='shared_memory')
+
+    args = parser.parse_args()
+
+    if not hasattr(socket, 'AF_UNIX'):
+        parser.error("Unix domain sockets are not supported on this platform")
+
+    if args.shared_memory is not None:
+        if sys.version_info < (3, 8):
+            parser.error("the --shared-memory option requires Python 3.8 or later")
+        shared_state_writer = SharedStateWriter(args.shared_memory)
+        logging.info("Keeping the latest packets in shared memory block {!r}.".format(args.shared_memory))
+    else:
+        shared_state_writer = None
+
+    # Start threads.
+
+    quit_barrier = Barrier()
+
+    hub_thread = PacketHubThread(args.port, args.hub_path, args.queue_length, shared_state_writer)
+    hub_thread.start()
+
+    wait_console_thread = WaitConsoleThread(quit_barrier)
+    wait_console_thread.start()
+
+    # Hub and wait_console threads are now active. Run until we're asked to quit.
+
+    quit_barrier.wait()
+
+    # Stop threads.
+
+    wait_console_thread.request_quit()
+    wait_console_thread.join()
+    wait_console_thread.close()
+
+    hub_thread.request_quit()
+    hub_thread.join()
+    hub_thread.close()
+
+    if shared_state_writer is not None:
+        shared_state_writer.close()
+
+    # All done.
+
+    logging.info("All done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+
+"""This script records F1 2019 telemetry packets into SQLite3 database files and monitors them, from a single socket.
+
+Running the recorder and the monitor side by side means receiving, checking and decoding every packet twice, and
+either two bindings of the same UDP port or a hub in between. This script does both in one process, with a Pipeline
+(see f1_2019_telemetry.pipeline) that receives each packet once and parses its header once:
+
+    PipelineReceiverThread --> ValidateStage --+--> BatchStage --> ThreadedSink(SQLiteSink)
+                                               |
+                                               +--> DecodeStage --> MonitorSink <-- MonitorRenderThread
+
+The recorder and the monitor scripts use the same pipeline elements: the SQLiteSink writes the packets to one file
+per session from its own worker thread, and the MonitorSink assembles the decoded packets into frames, and
+publishes the latest frame for the MonitorRenderThread, which prints it at a fixed refresh rate.
+
+When the script quits, it logs the number of packets handled and the time spent by each stage and sink.
+"""
+
+import argparse
+import logging
+
+from .threading_utils import WaitConsoleThread, Barrier
+from .monitor import MonitorSink, MonitorRenderThread
+from ..hub import HubSubscriber, DEFAULT_HUB_PATH
+from ..catalog import DEFAULT_CATALOG_FILENAME
+from ..pipeline import Pipeline, PipelineReceiverThread, ValidateStage, DecodeStage, BatchStage, SQLiteSink, ThreadedSink
+
+
+def main():
+    """Record and monitor incoming telemetry data until the user presses enter."""
+
+    # Configure logging.
+
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-23s | %(threadName)-10s | %(levelname)-5s | %(message)s")
+    logging.Formatter.default_msec_format = '%s.%03d'
+
+    # Parse command line arguments.
+
+    parser = argparse.ArgumentParser(description="Record F1 2019 telemetry data to SQLite3 files and monitor it, using a single socket.")
+
+    parser.add_argument("-p", "--port", default=20777, type=int, help="UDP port to listen to (default: 20777)", dest='port')
+    parser.add_argument("--hub", nargs='?', const=DEFAULT_HUB_PATH, default=None, help="receive packets from the hub with the given control socket path (default: {}) instead of the UDP port".format(DEFAULT_HUB_PATH), dest='hub_path')
+    parser.add_argument("-i", "--interval", default=1.0, type=float, help="interval for writing incoming data to SQLite3 file, in seconds (default: 1.0)", dest='interval')
+    parser.add_argument("-c", "--catalog", nargs='?', const=DEFAULT_CATALOG_FILENAME, default=None, help="update the given session catalog (default: {}) whenever a file is closed".format(DEFAULT_CATALOG_FILENAME), dest='catalog_path')
+    parser.add_argument("-r", "--refresh-rate", default=5.0, type=float, help="rate at which the table of cars is refreshed, in Hz (default: 5.0)", dest='refresh_rate')
+
+    args = parser.parse_args()
+
+    if args.refresh_rate <= 0.0:
+        parser.error("the refresh rate must be positive")
+
+    # Subscribe to the hub (if requested) before starting any threads, so we can quit right away if it isn't running.
+
+    if args.hub_path is not None:
+        try:
+            hub_subscriber = HubSubscriber(hub_path=args.hub_path)
+        except OSError as error:
+            logging.error("Hub not running at {!r}: {}".format(args.hub_path, error))
+            return
+    else:
+        hub_subscriber = None
+
+    # Build the pipeline: all packets are validated once, then recorded in batches, and decoded for the monitor.
+
+    monitor_sink = MonitorSink()
+
+    pipeline = Pipeline([ValidateStage()])
+    pipeline.add_sink(ThreadedSink(SQLiteSink(catalog_path=args.catalog_path, inactivity_timeout=args.interval)), [BatchStage(interval=args.interval)])
+    pipeline.add_sink(monitor_sink, [DecodeStage()])
+
+    # Start the receiver thread first, then the render thread.
+
+    quit_barrier = Barrier()
+
+    receiver_thread = PipelineReceiverThread(pipeline, args.port, hub_subscriber, monitor_sink.loss_detector)
+    receiver_thread.start()
+
+    render_thread = MonitorRenderThread(monitor_sink, args.refresh_rate)
+    render_thread.start()
+
+    wait_console_thread = WaitConsoleThread(quit_barrier)
+    wait_console_thread.start()
+
+    # Receiver, render, and wait_console threads are now active. Run until we're asked to quit.
+
+    quit_barrier.wait()
+
+    # Stop threads. Stopping the receiver thread closes the pipeline, which writes the remaining packets.
+
+    wait_console_thread.request_quit()
+    wait_console_thread.join()
+    wait_console_thread.close()
+
+    receiver_thread.request_quit()
+    receiver_thread.join()
+    receiver_thread.close()
+
+    if hub_subscriber is not None:
+        hub_subscriber.close()
+
+    render_thread.request_quit()
+    render_thread.join()
+    render_thread.close()
+
+    logging.info("Pipeline statistics:\n{}".format(pipeline.report()))
+
+    # All done.
+
+    logging.info("All done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,117 +1,423 @@
 #! /usr/bin/env python3
 
-"""This script monitors a UDP port for F1 2019 telemetry packets and prints useful info upon reception."""
+"""This script monitors a UDP port for F1 2019 telemetry packets and prints useful info upon reception.
+
+The work is divided over 2 threads.
+
+The PipelineReceiver thread receives UDP packets at full speed, and feeds them into a Pipeline (see
+f1_2019_telemetry.pipeline) that validates and decodes them. The MonitorSink at the end of the pipeline assembles
+the packets into frames. Each completed frame is published as the latest state; publishing is just a reference swap.
+
+    PipelineReceiverThread --> ValidateStage --> DecodeStage --+--> MonitorSink <-- MonitorRenderThread
+                                                               |
+                                                               +--> ReplaySink --> ReplayDumpThread
+
+The MonitorRender thread wakes up at a fixed refresh rate, picks up the latest published frame, and prints it as a
+table of all cars. Frames that were published in between two refreshes are never rendered; their number is reported.
+This keeps the (relatively expensive) formatting and output out of the receive loop.
+
+The f1-2019-telemetry-live script uses the same MonitorSink and MonitorRenderThread.
+
+Instant replay
+--------------
+
+With the --replay-seconds option, a ReplaySink keeps the raw packets of the last N seconds in a preallocated
+ReplayBuffer. A replay is triggered by entering 'r' on the console, by sending the process a SIGUSR1 signal (not on
+Windows), or by any of the event codes given with the --replay-events option (e.g. RTMT,TMPT).
+
+A replay is taken a few seconds (--replay-delay) after the trigger, to include the aftermath of an incident; triggers
+in between are merged. The buffer holds the replay duration plus the delay, so that a replay covers N seconds before
+its (first) trigger. The ReplaySink copies the packets out of the buffer and hands them to a third thread, the
+ReplayDump thread, which writes them to F1_2019_<sessionUID>_replay_<time>.sqlite3 files in the format of the
+recorder. Reception is only paused for the duration of the copy.
+"""
 
 import argparse
 import sys
+import time
 import socket
 import threading
 import logging
 import selectors
-import math
+import signal
 
 from .threading_utils import WaitConsoleThread, Barrier
-from ..packets import PacketID, unpack_udp_packet
+from .argparse_utils import event_code_list
+from ..recording import PacketRecorder
+from ..packets import PacketID, DriverIDs
+from ..frames import FrameAssembler
+from ..packet_loss import PacketLossDetector
+from ..timing import TimingEngine
+from ..hub import HubSubscriber, DEFAULT_HUB_PATH
+from ..replay_buffer import ReplayBuffer, REPLAY_SLOT_SIZE
+from ..pipeline import Pipeline, PipelineSink, PipelineReceiverThread, ValidateStage, DecodeStage
+
+# Single-letter abbreviations of the visual tyre compounds.
+_VISUAL_TYRE_COMPOUNDS = {16: 'S', 17: 'M', 18: 'H', 7: 'I', 8: 'W', 9: 'D', 10: 'W', 11: 'SS', 12: 'S', 13: 'M', 14: 'H', 15: 'W'}
+
+
+class MonitorSink(PipelineSink):
+    """Assembles decoded packets into frames, and publishes the latest frame for the MonitorRenderThread.
+
+    Also keeps track of packet loss, and of the gaps and intervals between the cars. Must come after a DecodeStage.
+    """
+
+    name = 'monitor'
+
+    def __init__(self):
+        super().__init__()
+        self._frame_assembler = FrameAssembler()
+        self.loss_detector = PacketLossDetector()
+        self.timing_engine = TimingEngine()
+
+        self._latest_lock = threading.Lock()
+        self._latest_frame = None
+        self._published_frame_count = 0
+
+    def consume(self, batch):
+        for item in batch:
+            packet = item.packet
+            self.loss_detector.update(item.header)
+            if item.header.packetId == PacketID.LAP_DATA:
+                self.timing_engine.update(packet)
+            for frame in self._frame_assembler.add(packet):
+                self.publish(frame)
 
+    def close(self):
+        for frame in self._frame_assembler.flush():
+            self.publish(frame)
 
-class PacketMonitorThread(threading.Thread):
-    """The PacketMonitorThread receives incoming telemetry packets via the network and shows interesting information."""
+    def publish(self, frame):
+        """Make 'frame' the latest state, replacing the previous one."""
+        with self._latest_lock:
+            self._latest_frame = frame
+            self._published_frame_count += 1
 
-    def __init__(self, udp_port):
-        super().__init__(name='monitor')
-        self._udp_port = udp_port
-        self._socketpair = socket.socketpair()
+    def latest(self):
+        """Return a (frame, published_frame_count) tuple for the most recently published frame.
+
+        Called from the render thread.
+        """
+        with self._latest_lock:
+            return (self._latest_frame, self._published_frame_count)
+
+
+class ReplaySink(PipelineSink):
+    """Keeps the most recent packets in a ReplayBuffer, and hands instant replays to the ReplayDumpThread.
+
+    A replay is triggered by an event packet with one of the 'replay_events' codes, or by request_replay(); it is
+    taken 'replay_delay' seconds after the trigger. Must come after a DecodeStage.
+    """
+
+    name = 'replay'
 
-        self._current_frame = None
-        self._current_frame_data = {}
+    def __init__(self, replay_buffer, replay_dump_thread, replay_events=(), replay_delay=0.0):
+        super().__init__()
+        self._replay_buffer = replay_buffer
+        self._replay_dump_thread = replay_dump_thread
+        self._replay_events = frozenset(event_code.value for event_code in replay_events)
+        self._replay_delay = replay_delay
+        self._replay_deadline = None
+        self._replay_reasons = []
+        self._replay_requested = threading.Event()
+
+    def consume(self, batch):
+        replay_buffer = self._replay_buffer
+        for item in batch:
+            replay_buffer.add(item.timestamp, item.datagram)
+            if item.header.packetId == PacketID.EVENT and item.packet.eventStringCode in self._replay_events:
+                self.trigger_replay("event {}".format(item.packet.eventStringCode.decode()))
+        self._check_replay()
+
+    def tick(self):
+        self._check_replay()
+
+    def close(self):
+        if self._replay_deadline is not None:
+            self._dump_replay()
+
+    def _check_replay(self):
+        """Trigger a requested replay, and dump the pending replay when its time has come."""
+        if self._replay_requested.is_set():
+            self._replay_requested.clear()
+            self.trigger_replay("replay requested")
+        if self._replay_deadline is not None and time.monotonic() >= self._replay_deadline:
+            self._dump_replay()
+
+    def trigger_replay(self, reason):
+        """Schedule a replay dump, unless one is already pending; in that case, it will cover this trigger as well."""
+        self._replay_reasons.append(reason)
+        if self._replay_deadline is None:
+            logging.info("Replay triggered ({}); saving in {:.1f} seconds.".format(reason, self._replay_delay))
+            self._replay_deadline = time.monotonic() + self._replay_delay
+
+    def _dump_replay(self):
+        """Copy the packets out of the replay buffer, and hand them to the ReplayDumpThread."""
+        packets = self._replay_buffer.packets()
+        self._replay_dump_thread.dump(packets, ", ".join(self._replay_reasons))
+        self._replay_deadline = None
+        self._replay_reasons = []
+
+    def request_replay(self):
+        """Request a replay dump; it is triggered when the pipeline next processes packets or ticks.
+
+        Can be called from any thread, and from a signal handler.
+        """
+        self._replay_requested.set()
+
+
+class MonitorRenderThread(threading.Thread):
+    """The MonitorRenderThread periodically prints the latest frame published by a MonitorSink."""
+
+    def __init__(self, monitor_sink, refresh_rate, output=sys.stdout):
+        super().__init__(name='render')
+        self._monitor_sink = monitor_sink
+        self._refresh_interval = 1.0 / refresh_rate
+        self._output = output
+        self._socketpair = socket.socketpair()
 
     def close(self):
         for sock in self._socketpair:
             sock.close()
 
     def run(self):
-        """Receive incoming packets and print info about them.
+        """Print the latest frame at the refresh rate, until asked to quit.
 
         This method runs in its own thread.
         """
-
-        udp_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-
-        # Allow multiple receiving endpoints.
-        if sys.platform in ['darwin']:
-            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        elif sys.platform in ['linux', 'win32']:
-            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-        # Accept UDP packets from any host.
-        address = ('', self._udp_port)
-        udp_socket.bind(address)
-
         selector = selectors.DefaultSelector()
-
-        key_udp_socket = selector.register(udp_socket, selectors.EVENT_READ)
         key_socketpair = selector.register(self._socketpair[0], selectors.EVENT_READ)
 
-        logging.info("Monitor thread started, reading UDP packets from port {}.".format(self._udp_port))
+        # Clear the screen between tables if we're writing to a terminal.
+        clear_screen = "\x1b[H\x1b[J" if self._output.isatty() else "\n"
+
+        logging.info("Render thread started, refreshing at {:.1f} Hz.".format(1.0 / self._refresh_interval))
+
+        rendered_frame = None
+        rendered_frame_count = 0
+        total_coalesced_count = 0
 
         quitflag = False
         while not quitflag:
-            for (key, events) in selector.select():
-                if key == key_udp_socket:
-                    # All telemetry UDP packets fit in 2048 bytes with room to spare.
-                    udp_packet = udp_socket.recv(2048)
-                    packet = unpack_udp_packet(udp_packet)
-                    self.process(packet)
-                elif key == key_socketpair:
+
+            # Calculate the timeout value that will bring us in sync with the next period.
+            timeout = (-time.time()) % self._refresh_interval
+
+            for (key, events) in selector.select(timeout):
+                if key == key_socketpair:
                     quitflag = True
 
-        self.report()
+            (frame, published_frame_count) = self._monitor_sink.latest()
+
+            if frame is None or frame is rendered_frame:
+                continue
+
+            # All frames published since the previous refresh, except the one we render now, were skipped.
+            coalesced_count = published_frame_count - rendered_frame_count - 1
+            total_coalesced_count += coalesced_count
+
+            self._output.write(clear_screen + self.render(frame, coalesced_count, self._monitor_sink.timing_engine.timings))
+            self._output.write("\npacket {}\n".format(self._monitor_sink.loss_detector.report()))
+            self._output.flush()
+
+            rendered_frame = frame
+            rendered_frame_count = published_frame_count
 
         selector.close()
-        udp_socket.close()
+
+        logging.info("Render thread stopped ({} frames coalesced in total).".format(total_coalesced_count))
+
+    @staticmethod
+    def render(frame, coalesced_count, timings=()):
+        """Render the frame as a table of all cars, ordered by race position.
+
+        The gaps and intervals are taken from 'timings', a list of CarTiming tuples.
+        """
+
+        lap_packet = frame.get(PacketID.LAP_DATA)
+        telemetry_packet = frame.get(PacketID.CAR_TELEMETRY)
+        status_packet = frame.get(PacketID.CAR_STATUS)
+        participants_packet = frame.get(PacketID.PARTICIPANTS)
+
+        session_time = lap_packet.header.sessionTime if lap_packet is not None else float('nan')
+
+        lines = ["frame {:6d}   session time {:10.3f}   ({} frames coalesced)".format(frame.frameIdentifier, session_time, coalesced_count), ""]
+        lines.append("pos  car  driver                lap       gap  interval  speed  gear  tyre  wear  temp")
+
+        if lap_packet is None:
+            lines.append("(no lap data)")
+            return "\n".join(lines) + "\n"
+
+        if participants_packet is not None:
+            num_cars = participants_packet.numActiveCars
+        else:
+            num_cars = sum(1 for lap_data in lap_packet.lapData if lap_data.carPosition != 0)
+
+        cars = sorted((car_index for car_index in range(20) if lap_packet.lapData[car_index].carPosition != 0),
+                      key=lambda car_index: lap_packet.lapData[car_index].carPosition)[:num_cars]
+
+        timing_by_car = {timing.carIndex: timing for timing in timings}
+
+        for car_index in cars:
+            lap_data = lap_packet.lapData[car_index]
+
+            if participants_packet is not None:
+                participant = participants_packet.participants[car_index]
+                driver = participant.name.decode('utf-8', errors='replace') or DriverIDs.get(participant.driverId, "")
+            else:
+                driver = ""
+
+            timing = timing_by_car.get(car_index)
+            if timing is None:
+                (gap, interval) = ("-", "-")
+            elif timing.position == 1:
+                (gap, interval) = ("leader", "")
+            else:
+                gap = "-" if timing.gapToLeader is None else "{:+.3f}".format(timing.gapToLeader)
+                interval = "-" if timing.interval is None else "{:+.3f}".format(timing.interval)
+
+            if telemetry_packet is not None:
+                telemetry = telemetry_packet.carTelemetryData[car_index]
+                speed = "{:5d}".format(telemetry.speed)
+                gear = "{:4d}".format(telemetry.gear)
+                temperature = "{:4d}".format(max(telemetry.tyresSurfaceTemperature))
+            else:
+                (speed, gear, temperature) = ("    -", "   -", "   -")
+
+            if status_packet is not None:
+                status = status_packet.carStatusData[car_index]
+                tyre = "{:>4s}".format(_VISUAL_TYRE_COMPOUNDS.get(status.tyreVisualCompound, "?"))
+                wear = "{:3d}%".format(max(status.tyresWear))
+            else:
+                (tyre, wear) = ("   -", "   -")
+
+            lines.append("{:3d}  {:3d}  {:20.20s}  {:3d}  {:>8s}  {:>8s}  {}  {}  {}  {}  {}".format(
+                lap_data.carPosition, car_index, driver, lap_data.currentLapNum, gap, interval, speed, gear, tyre, wear, temperature))
+
+        return "\n".join(lines) + "\n"
+
+    def request_quit(self):
+        """Request termination of the MonitorRenderThread.
+
+        Called from the main thread to request that we quit.
+        """
+        self._socketpair[1].send(b'\x00')
+
+
+class ReplayDumpThread(threading.Thread):
+    """The ReplayDumpThread writes the replays handed to it by the ReplaySink to SQLite3 files."""
+
+    def __init__(self):
+        super().__init__(name='replay')
+        self._replays = []
+        self._replays_lock = threading.Lock()
+        self._socketpair = socket.socketpair()
+
+    def close(self):
         for sock in self._socketpair:
             sock.close()
 
-        logging.info("Monitor thread stopped.")
+    def run(self):
+        """Write replays as they come in, until asked to quit.
+
+        This method runs in its own thread.
+        """
+        selector = selectors.DefaultSelector()
+        key_socketpair = selector.register(self._socketpair[0], selectors.EVENT_READ)
+
+        logging.info("Replay dump thread started.")
 
-    def process(self, packet):
+        quitflag = False
+        while not quitflag:
+            for (key, events) in selector.select():
+                if key == key_socketpair:
+                    if b'\x00' in self._socketpair[0].recv(64):
+                        quitflag = True
+
+            # Write any replays that are waiting, including those handed over right before we were asked to quit.
+            with self._replays_lock:
+                (replays, self._replays) = (self._replays, [])
 
-        if packet.header.frameIdentifier != self._current_frame:
-            self.report()
-            self._current_frame = packet.header.frameIdentifier
-            self._current_frame_data = {}
+            for (timestamp, packets, reason) in replays:
+                self._write_replay(timestamp, packets, reason)
 
-        self._current_frame_data[PacketID(packet.header.packetId)] = packet
+        selector.close()
 
+        logging.info("Replay dump thread stopped.")
 
-    def report(self):
-        if self._current_frame is None:
+    @staticmethod
+    def _write_replay(timestamp, packets, reason):
+        if not packets:
+            logging.info("Replay ({}): no packets to save.".format(reason))
             return
+        logging.info("Saving replay ({}) of {} packets covering {:.1f} seconds.".format(reason, len(packets), packets[-1][0] - packets[0][0]))
+        filename_format = "F1_2019_{:s}_replay_" + time.strftime("%Y%m%d_%H%M%S", time.localtime(timestamp)) + ".sqlite3"
+        recorder = PacketRecorder(filename_format=filename_format)
+        recorder.process_incoming_packets(packets)
+        recorder.close()
+
+    def dump(self, packets, reason):
+        """Called from the pipeline receiver thread to hand over a list of (timestamp, packet) tuples to be written."""
+        with self._replays_lock:
+            self._replays.append((time.time(), packets, reason))
+        self._socketpair[1].send(b'd')
 
-        any_packet = next(iter(self._current_frame_data.values()))
+    def request_quit(self):
+        """Request termination of the ReplayDumpThread.
 
-        player_car = any_packet.header.playerCarIndex
+        Called from the main thread to request that we quit.
+        """
+        self._socketpair[1].send(b'\x00')
 
-        try:
-            distance = self._current_frame_data[PacketID.LAP_DATA].lapData[player_car].totalDistance
-        except:
-            distance = math.nan
 
-        message = "frame {:6d} distance {:10.3f}".format(self._current_frame, distance)
+class MonitorConsoleThread(threading.Thread):
+    """The MonitorConsoleThread reads console input: a line with just 'r' requests a replay; anything else quits."""
 
-        if message is not None:
-            logging.info(message)
+    def __init__(self, quit_barrier, replay_sink):
+        super().__init__(name='console')
+        self._quit_barrier = quit_barrier
+        self._replay_sink = replay_sink
+        self._socketpair = socket.socketpair()
 
-    def request_quit(self):
-        """Request termination of the PacketMonitorThread.
+    def close(self):
+        for sock in self._socketpair:
+            sock.close()
 
-        Called from the main thread to request that we quit.
+    def run(self):
+        """Read console input until asked to quit.
+
+        The run method executes in its own thread.
         """
+        selector = selectors.DefaultSelector()
+        key_socketpair = selector.register(self._socketpair[0], selectors.EVENT_READ)
+        key_stdin      = selector.register(sys.stdin, selectors.EVENT_READ)
+
+        logging.info("Console thread started; enter 'r' for a replay, or just press enter to quit.")
+
+        quitflag = False
+        while not quitflag:
+            for (key, events) in selector.select():
+                if key == key_socketpair:
+                    quitflag = True
+                elif key == key_stdin:
+                    if sys.stdin.readline().strip().lower() == "r":
+                        self._replay_sink.request_replay()
+                    else:
+                        quitflag = True
+
+        selector.close()
+
+        self._quit_barrier.proceed()
+
+        logging.info("Console thread stopped.")
+
+    def request_quit(self):
+        """Called from the any thread to request that we quit."""
         self._socketpair[1].send(b'\x00')
 
 
 def main():
-    """Record incoming telemetry data until the user presses enter."""
+    """Monitor incoming telemetry data until the user presses enter."""
 
     # Configure logging.
 
@@ -123,32 +429,100 @@ def main():
     parser = argparse.ArgumentParser(description="Monitor UDP port for incoming F1 2019 telemetry data and print information.")
 
     parser.add_argument("-p", "--port", default=20777, type=int, help="UDP port to listen to (default: 20777)", dest='port')
+    parser.add_argument("--hub", nargs='?', const=DEFAULT_HUB_PATH, default=None, help="receive packets from the hub with the given control socket path (default: {}) instead of the UDP port".format(DEFAULT_HUB_PATH), dest='hub_path')
+    parser.add_argument("-r", "--refresh-rate", default=5.0, type=float, help="rate at which the table of cars is refreshed, in Hz (default: 5.0)", dest='refresh_rate')
+    parser.add_argument("-s", "--replay-seconds", default=None, type=float, help="save instant replays that start REPLAY_SECONDS seconds before the trigger (default: no replays)", dest='replay_seconds')
+    parser.add_argument("--replay-rate", default=300.0, type=float, help="maximum packet rate for which the full replay duration is kept, in packets per second (default: 300)", dest='replay_rate')
+    parser.add_argument("--replay-delay", default=10.0, type=float, help="time between a replay trigger and saving the replay, in seconds (default: 10.0)", dest='replay_delay')
+    parser.add_argument("--replay-events", default=[], type=event_code_list, help="comma-separated list of event codes that trigger a replay, e.g. RTMT,TMPT", dest='replay_events')
 
     args = parser.parse_args()
 
-    # Start recorder thread first, then receiver thread.
+    if args.refresh_rate <= 0.0:
+        parser.error("the refresh rate must be positive")
 
-    quit_barrier = Barrier()
+    if args.replay_seconds is not None and (args.replay_seconds <= 0.0 or args.replay_rate <= 0.0):
+        parser.error("the replay duration and rate must be positive")
+
+    if args.replay_delay < 0.0:
+        parser.error("the replay delay must not be negative")
+
+    # Subscribe to the hub (if requested) before starting any threads, so we can quit right away if it isn't running.
+
+    if args.hub_path is not None:
+        try:
+            hub_subscriber = HubSubscriber(hub_path=args.hub_path)
+        except OSError as error:
+            logging.error("Hub not running at {!r}: {}".format(args.hub_path, error))
+            return
+    else:
+        hub_subscriber = None
 
-    monitor_thread = PacketMonitorThread(args.port)
-    monitor_thread.start()
+    # Build the pipeline: all packets are validated and decoded once, then assembled into frames, and (if replays
+    # are enabled) kept for instant replays.
 
-    wait_console_thread = WaitConsoleThread(quit_barrier)
-    wait_console_thread.start()
+    monitor_sink = MonitorSink()
 
-    # Monitor and wait_console threads are now active. Run until we're asked to quit.
+    pipeline = Pipeline([ValidateStage(), DecodeStage()])
+    pipeline.add_sink(monitor_sink)
+
+    # Start the replay dump thread (if replays are enabled) and the receiver thread first, then the render thread.
+
+    quit_barrier = Barrier()
+
+    if args.replay_seconds is not None:
+        # The packets received between the trigger and saving the replay must fit in the buffer as well.
+        replay_buffer = ReplayBuffer(args.replay_seconds + args.replay_delay, args.replay_rate)
+        logging.info("Keeping up to {} packets ({:.1f} MB) for instant replays of {:.1f} seconds before and {:.1f} seconds after the trigger.".format(
+            replay_buffer.capacity, replay_buffer.capacity * REPLAY_SLOT_SIZE / 1e6, args.replay_seconds, args.replay_delay))
+        replay_dump_thread = ReplayDumpThread()
+        replay_dump_thread.start()
+        replay_sink = ReplaySink(replay_buffer, replay_dump_thread, args.replay_events, args.replay_delay)
+        pipeline.add_sink(replay_sink)
+    else:
+        replay_dump_thread = None
+        replay_sink = None
+
+    receiver_thread = PipelineReceiverThread(pipeline, args.port, hub_subscriber, monitor_sink.loss_detector)
+    receiver_thread.start()
+
+    render_thread = MonitorRenderThread(monitor_sink, args.refresh_rate)
+    render_thread.start()
+
+    if replay_sink is not None:
+        console_thread = MonitorConsoleThread(quit_barrier, replay_sink)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: replay_sink.request_replay())
+    else:
+        console_thread = WaitConsoleThread(quit_barrier)
+    console_thread.start()
+
+    # Receiver, render, and console threads are now active. Run until we're asked to quit.
 
     quit_barrier.wait()
 
-    # Stop threads.
+    # Stop threads. Stopping the receiver thread closes the pipeline, which hands a pending replay to the replay
+    # dump thread.
+
+    console_thread.request_quit()
+    console_thread.join()
+    console_thread.close()
+
+    receiver_thread.request_quit()
+    receiver_thread.join()
+    receiver_thread.close()
+
+    if hub_subscriber is not None:
+        hub_subscriber.close()
 
-    wait_console_thread.request_quit()
-    wait_console_thread.join()
-    wait_console_thread.close()
+    render_thread.request_quit()
+    render_thread.join()
+    render_thread.close()
 
-    monitor_thread.request_quit()
-    monitor_thread.join()
-    monitor_thread.close()
+    if replay_dump_thread is not None:
+        replay_dump_thread.request_quit()
+        replay_dump_thread.join()
+        replay_dump_thread.close()
 
     # All done.
 
@@ -1,41 +1,222 @@
 #! /usr/bin/env python3
 
-"""This script reads F1 2019 telemetry packets stored in a SQLite3 database file and sends them out over UDP, effectively replaying a session of the F1 2019 game."""
+"""This script reads F1 2019 telemetry packets stored in SQLite3 database files and sends them out over UDP, effectively replaying sessions of the F1 2019 game.
+
+Multiple files can be given; they are played back one after the other, without a gap in between, as the next file is
+preloaded in the background while the current file is playing. Optionally, the list of files is looped indefinitely.
+
+If a file has a session summary (written by the recorder when it closes the file), it is shown when the file starts
+playing. With --info, the summaries of the files are shown without playing them.
+"""
 
 import sys
 import logging
 import threading
 import argparse
 import time
+import math
+import struct
 import sqlite3
 import socket
 import selectors
 
 from .threading_utils import WaitConsoleThread, Barrier
-from ..packets import HeaderFieldsToPacketType
+from .argparse_utils import packet_id_list, positive_int
+from ..packets import PacketHeader, PacketID
+from ..summary import read_session_summary, format_session_summary
+from ..sqlite_utils import connect_read_only
+
+# Offsets of the header fields that are rewritten when monotonic playback is requested.
+_SESSION_TIME_OFFSET = PacketHeader.sessionTime.offset
+_FRAME_IDENTIFIER_OFFSET = PacketHeader.frameIdentifier.offset
+
+
+def playback_query(packet_ids=None, decimate=1):
+    """Return the SQLite3 query (and its parameters) that selects the packets to be played back.
+
+    Filtering is done by SQLite3 on the 'packetId' column, so unwanted packets never make it into Python.
+
+    If 'packet_ids' is given, only packets of those types are selected.
+
+    If 'decimate' is larger than 1, only one in every 'decimate' packets is selected for the packet types
+    that are sent at the menu-selected rate (motion, lap data, car telemetry, car status). The low-rate packet
+    types (session, participants, car setups) and event packets are always passed on in full.
+    Decimation is done by numbering the packets of each type using a window function over the (small)
+    'pkt_id' and 'packetId' columns only; the packet BLOBs are only read for the rows that survive.
+    """
+    conditions = []
+    parameters = []
+
+    if packet_ids is not None:
+        conditions.append("packetId IN ({})".format(", ".join("?" for packet_id in packet_ids)))
+        parameters.extend(int(packet_id) for packet_id in packet_ids)
+
+    if decimate > 1:
+        if sqlite3.sqlite_version_info < (3, 25, 0):
+            raise RuntimeError("Decimation requires SQLite3 version 3.25.0 or higher (found version {}).".format(sqlite3.sqlite_version))
+        menu_rate_packet_ids = sorted(int(packet_id) for packet_id in PacketID.menu_rate_packets)
+        conditions.append("""pkt_id IN (
+            SELECT pkt_id FROM (
+                SELECT pkt_id, packetId, ROW_NUMBER() OVER (PARTITION BY packetId ORDER BY pkt_id) AS seqnr FROM packets
+            ) WHERE packetId NOT IN ({}) OR (seqnr - 1) % ? = 0
+        )""".format(", ".join("?" for packet_id in menu_rate_packet_ids)))
+        parameters.extend(menu_rate_packet_ids)
+        parameters.append(decimate)
+
+    query = "SELECT timestamp, packet FROM packets"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY pkt_id;"
+
+    return (query, parameters)
+
+
+class PlaybackFile:
+    """A session file that is opened for playback.
+
+    Opening the file and fetching the first 'preload_count' packets is done by the 'preload' method, which may be
+    called from a background thread. Afterwards, the 'packets' method yields all packets of the file in playback
+    order; it continues reading from the database where the preloaded packets end.
+    """
+
+    def __init__(self, filename, query, parameters, preload_count):
+        self.filename = filename
+        self._query = query
+        self._parameters = parameters
+        self._preload_count = preload_count
+        self._conn = None
+        self._cursor = None
+        self._preloaded = []
+        self._error = None
+        self.summary = None
+
+    def preload(self):
+        """Open the database file, read its session summary (if any), and fetch the first packets."""
+        try:
+            # The connection is created in the preload thread, but used in the playback thread.
+            self._conn = sqlite3.connect(self.filename, check_same_thread=False)
+            self.summary = read_session_summary(self._conn)
+            self._cursor = self._conn.cursor()
+            self._cursor.execute(self._query, self._parameters)
+            self._preloaded = self._cursor.fetchmany(self._preload_count)
+        except sqlite3.Error as error:
+            self._error = error
+
+    def packets(self):
+        """Yield (timestamp, packet) tuples. If the file could not be opened, an exception is raised."""
+        if self._error is not None:
+            raise self._error
+        yield from self._preloaded
+        self._preloaded = []
+        while True:
+            rows = self._cursor.fetchmany(self._preload_count)
+            if not rows:
+                break
+            yield from rows
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class PlaybackFilePreloadThread(threading.Thread):
+    """The PlaybackFilePreloadThread opens the next file to be played back while the current file is playing."""
+
+    def __init__(self, playback_file):
+        super().__init__(name='preload')
+        self.playback_file = playback_file
+
+    def run(self):
+        logging.info("Preloading file {!r}.".format(self.playback_file.filename))
+        self.playback_file.preload()
+
+
+class PlaybackStatistics:
+    """Cumulative throughput and timing jitter statistics over a complete playback run.
+
+    The jitter is the difference between the actual and the scheduled send time of a packet.
+    Its mean and standard deviation are maintained incrementally using Welford's algorithm.
+    """
+
+    def __init__(self):
+        self.t_start = time.monotonic()
+        self.file_count = 0
+        self.packet_count = 0
+        self.byte_count = 0
+        self.max_jitter = 0.0
+        self._mean_jitter = 0.0
+        self._m2_jitter = 0.0
+
+    def add(self, packet_size, jitter):
+        self.packet_count += 1
+        self.byte_count += packet_size
+        delta = jitter - self._mean_jitter
+        self._mean_jitter += delta / self.packet_count
+        self._m2_jitter += delta * (jitter - self._mean_jitter)
+        if jitter > self.max_jitter:
+            self.max_jitter = jitter
+
+    def summary(self):
+        """Return a one-line description of the statistics."""
+        duration = time.monotonic() - self.t_start
+        if duration <= 0.0:
+            duration = math.nan
+        stddev_jitter = math.sqrt(self._m2_jitter / self.packet_count) if self.packet_count > 0 else math.nan
+        return "{} files, {} packets, {:.1f} packets/s, {:.1f} kB/s, jitter mean {:.3f} ms, stddev {:.3f} ms, max {:.3f} ms".format(
+            self.file_count, self.packet_count, self.packet_count / duration, self.byte_count / duration / 1000.0,
+            1000.0 * self._mean_jitter, 1000.0 * stddev_jitter, 1000.0 * self.max_jitter)
 
 
 class PacketPlaybackThread(threading.Thread):
-    """The PacketPlaybackThread reads telemetry data from an SQLite3 file and plays it back as UDP packets."""
+    """The PacketPlaybackThread reads telemetry data from SQLite3 files and plays it back as UDP packets."""
 
-    def __init__(self, filename, destination, port, realtime_factor, quit_barrier):
+    # The number of packets read from a file in one go.
+    _preload_count = 2000
+
+    def __init__(self, filenames, destination, port, realtime_factor, quit_barrier, packet_ids=None, decimate=1, loop=False, monotonic=False):
         super().__init__(name='playback')
-        self._filename = filename
+        self._filenames = filenames
         self._destination = destination
         self._port = port
         self._realtime_factor = realtime_factor
         self._quit_barrier = quit_barrier
+        self._packet_ids = packet_ids
+        self._decimate = decimate
+        self._loop = loop
+        self._monotonic = monotonic
 
-        self._packets = []
-        self._packets_lock = threading.Lock()
         self._socketpair = socket.socketpair()
 
     def close(self):
         for sock in self._socketpair:
             sock.close()
 
+    def _playlist(self):
+        """Yield the filenames to be played, in order; loop indefinitely if requested."""
+        while True:
+            yield from self._filenames
+            if not self._loop:
+                break
+
+    def _start_preload(self, filename, query, parameters):
+        if filename is None:
+            return None
+        preload_thread = PlaybackFilePreloadThread(PlaybackFile(filename, query, parameters, self._preload_count))
+        preload_thread.start()
+        return preload_thread
+
     def run(self):
-        """Read packets from database and replay them as UDP packets.
+        """Read packets from the database files and replay them as UDP packets.
+
+        The playback schedule is continuous over file boundaries: the first packet of a file is scheduled one
+        packet interval after the last packet of the previous file.
+
+        If monotonic playback is requested, the 'sessionTime' and 'frameIdentifier' header fields of the packets
+        are rewritten so they keep increasing over file boundaries, as if all files were a single session.
 
         The run method executes in its own thread.
         """
@@ -51,52 +232,115 @@ class PacketPlaybackThread(threading.Thread):
         else:
             sock.connect((self._destination, self._port))
 
-        conn = sqlite3.connect(self._filename)
-        cursor = conn.cursor()
-
-        query = "SELECT timestamp, packet FROM packets ORDER BY pkt_id;"
-
-        cursor.execute(query)
+        (query, parameters) = playback_query(self._packet_ids, self._decimate)
 
         logging.info("Playback thread started.")
 
-        packet_count = 0
+        statistics = PlaybackStatistics()
         quitflag = False
 
-        t_first_packet = None
-        t_start_playback = time.monotonic()
-        while not quitflag:
-            timestamped_packet = cursor.fetchone()
-            if timestamped_packet is None:
-                quitflag = True
-                continue
-
-            (timestamp, packet) = timestamped_packet
-            if t_first_packet is None:
-                t_first_packet = timestamp
-            t_playback = t_start_playback + (timestamp - t_first_packet) / self._realtime_factor
-
-            while True:
-                t_sleep = max(0.0, t_playback - time.monotonic())
-                for (key, events) in selector.select(t_sleep):
-                    if key == key_socketpair:
-                        quitflag = True
-
-                if quitflag:
-                    break
-
-                delay = time.monotonic() - t_playback
-
-                if delay >= 0:
-                    sock.send(packet)
-                    packet_count += 1
-                    if packet_count % 500 == 0:
-                        logging.info("{} packages sent, delay: {:.3f} ms".format(packet_count, 1000.0 * delay))
-                    break
+        playlist = self._playlist()
+        preload_thread = self._start_preload(next(playlist, None), query, parameters)
 
+        t_start_playback = time.monotonic()
 
-        cursor.close()
-        conn.close()
+        # The time of the previous packet on the playback time axis, and the last non-zero interval between packets.
+        t_previous = None
+        t_interval = 0.0
+        # Header values of the previous packet and the last non-zero session time interval, for monotonic playback.
+        previous_session_time = None
+        previous_frame_identifier = None
+        session_time_interval = 0.0
+
+        # The number of consecutive files that did not contain any packets to play.
+        empty_file_count = 0
+
+        while not quitflag and preload_thread is not None:
+
+            preload_thread.join()
+            playback_file = preload_thread.playback_file
+
+            # Start preloading the next file while we play the current file.
+            preload_thread = self._start_preload(next(playlist, None), query, parameters)
+
+            logging.info("Playing file {!r}.".format(playback_file.filename))
+            if playback_file.summary is not None:
+                logging.info("Session: {}.".format(format_session_summary(playback_file.summary)))
+            statistics.file_count += 1
+
+            t_offset = None
+            session_time_offset = 0.0
+            frame_identifier_offset = 0
+
+            try:
+                for (timestamp, packet) in playback_file.packets():
+
+                    if t_offset is None:
+                        # First packet of this file: continue the schedule where the previous file ended.
+                        t_offset = -timestamp if t_previous is None else (t_previous + t_interval - timestamp)
+                        if self._monotonic and previous_frame_identifier is not None:
+                            (session_time, frame_identifier) = self._read_header_times(packet)
+                            session_time_offset = previous_session_time + session_time_interval - session_time
+                            frame_identifier_offset = previous_frame_identifier + 1 - frame_identifier
+
+                    timestamp += t_offset
+                    if t_previous is not None and timestamp > t_previous:
+                        t_interval = timestamp - t_previous
+                    t_previous = timestamp
+
+                    if self._monotonic:
+                        packet = bytearray(packet)
+                        (session_time, frame_identifier) = self._read_header_times(packet)
+                        session_time += session_time_offset
+                        if previous_session_time is not None and session_time > previous_session_time:
+                            session_time_interval = session_time - previous_session_time
+                        previous_session_time = session_time
+                        previous_frame_identifier = (frame_identifier + frame_identifier_offset) & 0xffffffff
+                        struct.pack_into("<f", packet, _SESSION_TIME_OFFSET, session_time)
+                        struct.pack_into("<I", packet, _FRAME_IDENTIFIER_OFFSET, previous_frame_identifier)
+
+                    t_playback = t_start_playback + timestamp / self._realtime_factor
+
+                    while True:
+                        t_sleep = max(0.0, t_playback - time.monotonic())
+                        for (key, events) in selector.select(t_sleep):
+                            if key == key_socketpair:
+                                quitflag = True
+
+                        if quitflag:
+                            break
+
+                        delay = time.monotonic() - t_playback
+
+                        if delay >= 0:
+                            sock.send(packet)
+                            statistics.add(len(packet), delay)
+                            if statistics.packet_count % 500 == 0:
+                                logging.info("{} packages sent, delay: {:.3f} ms".format(statistics.packet_count, 1000.0 * delay))
+                            break
+
+                    if quitflag:
+                        break
+
+            except sqlite3.Error as error:
+                logging.error("Unable to play file {!r}: {}".format(playback_file.filename, error))
+
+            playback_file.close()
+
+            if t_offset is None:
+                empty_file_count += 1
+                if empty_file_count >= len(self._filenames):
+                    # None of the files has packets to play; looping would be a busy loop.
+                    logging.error("No packets to play.")
+                    quitflag = True
+            else:
+                empty_file_count = 0
+
+        if preload_thread is not None:
+            preload_thread.join()
+            preload_thread.playback_file.close()
+
+        logging.info("Playback statistics: {}".format(statistics.summary()))
 
         sock.close()
 
@@ -104,11 +348,36 @@ class PacketPlaybackThread(threading.Thread):
 
         logging.info("playback thread stopped.")
 
+    @staticmethod
+    def _read_header_times(packet):
+        """Return the (sessionTime, frameIdentifier) header fields of a raw packet."""
+        (session_time, ) = struct.unpack_from("<f", packet, _SESSION_TIME_OFFSET)
+        (frame_identifier, ) = struct.unpack_from("<I", packet, _FRAME_IDENTIFIER_OFFSET)
+        return (session_time, frame_identifier)
+
     def request_quit(self):
         """Called from the main thread to request that we quit."""
         self._socketpair[1].send(b'\x00')
 
 
+def show_session_summaries(filenames):
+    """Print the session summaries of the given files."""
+    for filename in filenames:
+        try:
+            conn = connect_read_only(filename)
+            try:
+                summary = read_session_summary(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as error:
+            print("{}: {}".format(filename, error))
+            continue
+        if summary is None:
+            print("{}: no session summary".format(filename))
+        else:
+            print("{}: {}".format(filename, format_session_summary(summary)))
+
+
 def main():
 
     # Configure logging.
@@ -118,20 +387,30 @@ def main():
 
     # Parse command line arguments.
 
-    parser = argparse.ArgumentParser(description="Replay an F1 2019 session as UDP packets.")
+    parser = argparse.ArgumentParser(description="Replay F1 2019 sessions as UDP packets.")
 
     parser.add_argument("-r", "--rtf", dest='realtime_factor', type=float, default=1.0, help="playback real-time factor (higher is faster, default=1.0)")
     parser.add_argument("-d", "--destination", type=str, default=None, help="destination UDP address; omit to use broadcast (default)")
     parser.add_argument("-p", "--port", type=int, default=20777, help="destination UDP port (default: 20777)")
-    parser.add_argument("filename", type=str, help="SQLite3 file to replay packets from")
+    parser.add_argument("-t", "--packet-types", dest='packet_ids', type=packet_id_list, default=None, help="comma-separated list of packet types to replay, e.g. LAP_DATA,CAR_TELEMETRY (default: all)")
+    parser.add_argument("-n", "--decimate", type=positive_int, default=1, help="replay only one in every N motion, lap data, car telemetry and car status packets (default: 1)")
+    parser.add_argument("-l", "--loop", action='store_true', help="loop over the files indefinitely")
+    parser.add_argument("-m", "--monotonic", action='store_true', help="rewrite session time and frame identifier to increase monotonically over file boundaries")
+    parser.add_argument("--info", action='store_true', help="show the session summaries of the files, without playing them")
+    parser.add_argument("filenames", type=str, nargs='+', metavar='filename', help="SQLite3 file(s) to replay packets from")
 
     args = parser.parse_args()
 
+    if args.info:
+        show_session_summaries(args.filenames)
+        return
+
     # Start threads.
 
     quit_barrier = Barrier()
 
-    playback_thread = PacketPlaybackThread(args.filename, args.destination, args.port, args.realtime_factor, quit_barrier)
+    playback_thread = PacketPlaybackThread(args.filenames, args.destination, args.port, args.realtime_factor, quit_barrier,
+                                           args.packet_ids, args.decimate, args.loop, args.monotonic)
     playback_thread.start()
 
     wait_console_thread = WaitConsoleThread(quit_barrier)
@@ -0,0 +1,259 @@
+#! /usr/bin/env python3
+
+"""This script receives F1 2019 telemetry packets on a UDP port and forwards them to one or more destinations.
+
+Each destination is given as HOST:PORT, optionally followed by a colon and a comma-separated list of packet types
+that should not be forwarded to that destination. IPv6 addresses are written in brackets, e.g.:
+
+    f1-2019-telemetry-relay 192.168.1.10:20777 192.168.1.20:20777:MOTION,CAR_SETUPS [fd00::20]:20777
+
+Packets are handled in batches: whenever the UDP socket becomes readable, all datagrams that are available are read
+(up to a maximum batch size), and then sent to each of the destinations in turn. Each destination has its own connected
+UDP socket, so no address lookup is needed per send. Packet type filtering looks at the packetId byte of the header
+directly; packets are never decoded.
+
+The relay measures the latency it adds to each packet: the time between reading a packet from the receive socket and
+having sent it to all destinations. Latency statistics are logged periodically.
+"""
+
+import argparse
+import time
+import socket
+import threading
+import logging
+import selectors
+import collections
+
+from .threading_utils import WaitConsoleThread, Barrier
+from .argparse_utils import packet_id_list, positive_int
+from ..packets import PacketHeader
+from ..sockets import MAX_PACKET_SIZE, bind_telemetry_socket
+from ..latency import LatencyStatistics
+
+# Offset of the packetId field in the raw packet.
+_PACKET_ID_OFFSET = PacketHeader.packetId.offset
+
+# A relay destination, with the packet types that are not to be forwarded to it.
+RelayDestination = collections.namedtuple('RelayDestination', 'host, port, excluded_packet_ids')
+
+
+def relay_destination(value: str) -> RelayDestination:
+    """Convert a HOST:PORT[:EXCLUDED_PACKET_TYPES] string to a RelayDestination, for use as an argparse type.
+
+    An IPv6 address is written in brackets, e.g. [::1]:20777.
+    """
+    if value.startswith("["):
+        (host, bracket, rest) = value[1:].partition("]")
+        if not bracket or not rest.startswith(":"):
+            host = None
+        parts = [host] + rest[1:].split(":")
+    else:
+        parts = value.split(":")
+    if len(parts) not in (2, 3) or not parts[0]:
+        raise argparse.ArgumentTypeError("bad destination {!r}; expected HOST:PORT[:EXCLUDED_PACKET_TYPES] or [IPV6_ADDRESS]:PORT[:EXCLUDED_PACKET_TYPES]".format(value))
+    try:
+        port = int(parts[1])
+    except ValueError:
+        raise argparse.ArgumentTypeError("bad port number in destination {!r}".format(value))
+    excluded_packet_ids = packet_id_list(parts[2]) if len(parts) == 3 else []
+    return RelayDestination(parts[0], port, excluded_packet_ids)
+
+
+def format_destination(destination: RelayDestination) -> str:
+    """Format the address of a destination as HOST:PORT, with an IPv6 address in brackets."""
+    if ":" in destination.host:
+        return "[{}]:{}".format(destination.host, destination.port)
+    return "{}:{}".format(destination.host, destination.port)
+
+
+def connect_destination(destination: RelayDestination):
+    """Return a UDP socket connected to the destination, with the address family (IPv4 or IPv6) of its address.
+
+    Raises OSError if the host name cannot be resolved, or the socket cannot be connected.
+    """
+    (family, socktype, proto, canonname, address) = socket.getaddrinfo(destination.host, destination.port, type=socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, socktype, proto)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class PacketRelayThread(threading.Thread):
+    """The PacketRelayThread receives incoming telemetry packets via the network and forwards them to the destinations.
+
+    The 'destination_sockets' are connected sockets, one per destination (see connect_destination()); they are
+    closed when the thread stops.
+    """
+
+    def __init__(self, udp_port, destinations, destination_sockets, batch_size, report_interval):
+        super().__init__(name='relay')
+        self._udp_port = udp_port
+        self._destinations = destinations
+        self._destination_sockets = destination_sockets
+        self._batch_size = batch_size
+        self._report_interval = report_interval
+        self._socketpair = socket.socketpair()
+
+    def close(self):
+        for sock in self._socketpair:
+            sock.close()
+
+    def run(self):
+        """Receive incoming packets in batches and forward them to all destinations.
+
+        This method runs in its own thread.
+        """
+
+        # Accept UDP packets from any host.
+        udp_socket = bind_telemetry_socket(self._udp_port)
+        udp_socket.setblocking(False)
+
+        # For each destination: its connected socket and a 256-entry table that tells which packetId values to forward.
+        outputs = []
+        for (destination, sock) in zip(self._destinations, self._destination_sockets):
+            forward = [True] * 256
+            for packet_id in destination.excluded_packet_ids:
+                forward[packet_id] = False
+            outputs.append((sock, forward))
+
+        selector = selectors.DefaultSelector()
+
+        key_udp_socket = selector.register(udp_socket, selectors.EVENT_READ)
+        key_socketpair = selector.register(self._socketpair[0], selectors.EVENT_READ)
+
+        logging.info("Relay thread started, forwarding UDP packets from port {} to {}.".format(
+            self._udp_port, ", ".join(format_destination(destination) for destination in self._destinations)))
+
+        statistics = LatencyStatistics()
+        send_error_count = 0
+        batch = []
+        receive_times = []
+
+        t_report = time.monotonic() + self._report_interval
+
+        quitflag = False
+        while not quitflag:
+            timeout = max(0.0, t_report - time.monotonic())
+            for (key, events) in selector.select(timeout):
+                if key == key_udp_socket:
+
+                    # Read all available datagrams, up to the batch size.
+                    while len(batch) < self._batch_size:
+                        try:
+                            datagram = udp_socket.recv(MAX_PACKET_SIZE)
+                        except BlockingIOError:
+                            break
+                        except OSError:
+                            # E.g., an ICMP error from an earlier send on Windows; not fatal.
+                            continue
+                        receive_times.append(time.perf_counter())
+                        batch.append(datagram)
+
+                    # Send the batch to each destination in turn.
+                    for (sock, forward) in outputs:
+                        for datagram in batch:
+                            if len(datagram) > _PACKET_ID_OFFSET and forward[datagram[_PACKET_ID_OFFSET]]:
+                                try:
+                                    sock.send(datagram)
+                                except OSError:
+                                    # E.g., 'connection refused' reported for an earlier datagram if nobody listens.
+                                    send_error_count += 1
+
+                    t_sent = time.perf_counter()
+                    for t_received in receive_times:
+                        statistics.add(1e6 * (t_sent - t_received))
+
+                    batch.clear()
+                    receive_times.clear()
+
+                elif key == key_socketpair:
+                    quitflag = True
+
+            if time.monotonic() >= t_report or quitflag:
+                logging.info("Relayed {}; {} send errors.".format(statistics.summary(), send_error_count))
+                statistics.reset()
+                send_error_count = 0
+                t_report = time.monotonic() + self._report_interval
+
+        selector.close()
+        for (sock, forward) in outputs:
+            sock.close()
+        udp_socket.close()
+        for sock in self._socketpair:
+            sock.close()
+
+        logging.info("Relay thread stopped.")
+
+    def request_quit(self):
+        """Request termination of the PacketRelayThread.
+
+        Called from the main thread to request that we quit.
+        """
+        self._socketpair[1].send(b'\x00')
+
+
+def main():
+    """Relay incoming telemetry data until the user presses enter."""
+
+    # Configure logging.
+
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-23s | %(threadName)-10s | %(levelname)-5s | %(message)s")
+    logging.Formatter.default_msec_format = '%s.%03d'
+
+    # Parse command line arguments.
+
+    parser = argparse.ArgumentParser(description="Forward F1 2019 telemetry data to one or more destinations.")
+
+    parser.add_argument("-p", "--port", default=20777, type=int, help="UDP port to listen to (default: 20777)", dest='port')
+    parser.add_argument("-b", "--batch-size", default=64, type=positive_int, help="maximum number of packets read before forwarding them (default: 64)", dest='batch_size')
+    parser.add_argument("-i", "--interval", default=10.0, type=float, help="interval for reporting latency statistics, in seconds (default: 10.0)", dest='interval')
+    parser.add_argument("destinations", type=relay_destination, nargs='+', metavar='destination', help="destination as HOST:PORT[:EXCLUDED_PACKET_TYPES], with an IPv6 address in brackets, e.g. 192.168.1.20:20777:MOTION,CAR_SETUPS or [fd00::20]:20777")
+
+    args = parser.parse_args()
+
+    # Connect to the destinations before starting any threads, so we can quit right away if one of them is bad.
+
+    destination_sockets = []
+    for destination in args.destinations:
+        try:
+            destination_sockets.append(connect_destination(destination))
+        except OSError as error:
+            logging.error("Unable to connect to destination {}: {}".format(format_destination(destination), error))
+            for sock in destination_sockets:
+                sock.close()
+            return
+
+    # Start threads.
+
+    quit_barrier = Barrier()
+
+    relay_thread = PacketRelayThread(args.port, args.destinations, destination_sockets, args.batch_size, args.interval)
+    relay_thread.start()
+
+    wait_console_thread = WaitConsoleThread(quit_barrier)
+    wait_console_thread.start()
+
+    # Relay and wait_console threads are now active. Run until we're asked to quit.
+
+    quit_barrier.wait()
+
+    # Stop threads.
+
+    wait_console_thread.request_quit()
+    wait_console_thread.join()
+    wait_console_thread.close()
+
+    relay_thread.request_quit()
+    relay_thread.join()
+    relay_thread.close()
+
+    # All done.
+
+    logging.info("All done.")
+
+
+if __name__ == "__main__":
+    main()
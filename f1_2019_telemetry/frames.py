@@ -0,0 +1,178 @@
+"""Assemble decoded telemetry packets into consolidated per-frame snapshots.
+
+The F1 2019 game sends its telemetry as a number of separate packets, one per packet type, that are tied together
+by the 'frameIdentifier' header field. Most consumers are interested in the combined information of all packets
+belonging to the same frame. The FrameAssembler collects incoming packets into Frame instances.
+
+The packets of a frame may arrive interleaved with packets of neighbouring frames, or late. The assembler therefore
+keeps a bounded number of frames open (the reorder window) before it declares a frame complete.
+
+Some packet types are only sent a few times per second (session, car setups) or once every five seconds
+(participants). For these packet types, the assembler carries the last known packet forward into frames that do not
+have a packet of their own, so that every completed frame gives a full view of the session.
+"""
+
+import heapq
+
+from .packets import PacketID
+
+
+# Packet types that are carried forward into subsequent frames by default.
+DEFAULT_CARRY_FORWARD = (PacketID.SESSION, PacketID.PARTICIPANTS, PacketID.CAR_SETUPS)
+
+
+class Frame:
+    """All packets belonging to a single frame of a session.
+
+    Packets are stored in a list indexed by packet type, so lookup and update are O(1).
+    Event packets are not stored in the packet list, since a single frame may have multiple events;
+    they are available via the 'events' attribute instead.
+    """
+
+    __slots__ = ('sessionUID', 'frameIdentifier', 'packets', 'events')
+
+    def __init__(self, sessionUID: int, frameIdentifier: int):
+        self.sessionUID = sessionUID
+        self.frameIdentifier = frameIdentifier
+        self.packets = [None] * len(PacketID)
+        self.events = []
+
+    def __repr__(self):
+        present = ", ".join(packet_id.name for packet_id in PacketID if self.packets[packet_id] is not None)
+        return "Frame(sessionUID={:016x}, frameIdentifier={}, packets=[{}], events={})".format(
+            self.sessionUID, self.frameIdentifier, present, len(self.events))
+
+    def __getitem__(self, packet_id):
+        """Return the packet of the given type; raise KeyError if there is no such packet in the frame."""
+        packet = self.packets[packet_id]
+        if packet is None:
+            raise KeyError(PacketID(packet_id))
+        return packet
+
+    def __contains__(self, packet_id):
+        return self.packets[packet_id] is not None
+
+    def get(self, packet_id, default=None):
+        """Return the packet of the given type, or 'default' if there is no such packet in the frame."""
+        packet = self.packets[packet_id]
+        return default if packet is None else packet
+
+    @property
+    def playerCarIndex(self):
+        """The 'playerCarIndex' header field of the frame, or None if the frame is empty."""
+        for packet in self.packets:
+            if packet is not None:
+                return packet.header.playerCarIndex
+        for packet in self.events:
+            return packet.header.playerCarIndex
+        return None
+
+
+class FrameAssembler:
+    """The FrameAssembler builds Frame snapshots from a stream of decoded packets.
+
+    Args:
+        reorder_window: the maximum number of frames that are kept open at any time. When a packet of a new frame
+            arrives and the window is full, the oldest open frame is completed. A packet that arrives for a frame
+            that was already completed is counted as late and dropped. A packet for a frame that is more than the
+            reorder window behind the last completed frame is taken as a rewind of the frame identifier (after a
+            flashback, or when a recording is replayed in a loop): the open frames are completed, and assembly
+            starts over from the new frame identifier.
+        carry_forward: the packet types whose last known packet is carried forward into subsequent frames.
+        expected_packet_ids: if given, a frame is completed as soon as it has a packet of each of these types,
+            without waiting for it to drop out of the reorder window.
+
+    The cost of adding a packet is O(1) (more precisely, O(log reorder_window) for the ordering of open frames).
+    """
+
+    def __init__(self, reorder_window: int = 2, carry_forward=DEFAULT_CARRY_FORWARD, expected_packet_ids=None):
+        if reorder_window < 1:
+            raise ValueError("The reorder window should be at least 1 frame.")
+        self._reorder_window = reorder_window
+        self._carry_forward = tuple(carry_forward)
+        self._expected_packet_ids = None if expected_packet_ids is None else tuple(expected_packet_ids)
+
+        self._sessionUID = None
+        self._open_frames = {}
+        self._open_frame_identifiers = []  # heap
+        self._last_completed_frame_identifier = None
+        self._carried = [None] * len(PacketID)
+
+        self.latest = None
+        self.completed_frame_count = 0
+        self.late_packet_count = 0
+        self.rewind_count = 0
+
+    def add(self, packet):
+        """Add a decoded packet; return a (possibly empty) list of frames completed as a result, oldest first."""
+        header = packet.header
+        completed = []
+
+        if header.sessionUID != self._sessionUID:
+            # A new session starts; complete all frames of the previous session and forget carried-forward packets.
+            self._complete_all(completed)
+            self._sessionUID = header.sessionUID
+            self._last_completed_frame_identifier = None
+            self._carried = [None] * len(PacketID)
+
+        frame_identifier = header.frameIdentifier
+        frame = self._open_frames.get(frame_identifier)
+
+        if frame is None and self._last_completed_frame_identifier is not None and \
+                frame_identifier < self._last_completed_frame_identifier - self._reorder_window:
+            # The frame identifier went back; complete the open frames, but keep the carried-forward packets.
+            self._complete_all(completed)
+            self._last_completed_frame_identifier = None
+            self.rewind_count += 1
+
+        if frame is None:
+            if self._last_completed_frame_identifier is not None and frame_identifier <= self._last_completed_frame_identifier:
+                # Late packet. Low-rate packets are still useful for carrying forward into the next frames.
+                self.late_packet_count += 1
+                if header.packetId in self._carry_forward:
+                    self._carried[header.packetId] = packet
+                return completed
+            frame = Frame(header.sessionUID, frame_identifier)
+            self._open_frames[frame_identifier] = frame
+            heapq.heappush(self._open_frame_identifiers, frame_identifier)
+            while len(self._open_frame_identifiers) > self._reorder_window:
+                self._complete_oldest(completed)
+
+        if header.packetId == PacketID.EVENT:
+            frame.events.append(packet)
+        else:
+            frame.packets[header.packetId] = packet
+            if self._expected_packet_ids is not None and frame_identifier in self._open_frames and \
+                    all(frame.packets[packet_id] is not None for packet_id in self._expected_packet_ids):
+                # The frame is complete; complete it (and any older open frames) right away.
+                while self._open_frame_identifiers and self._open_frame_identifiers[0] <= frame_identifier:
+                    self._complete_oldest(completed)
+
+        return completed
+
+    def flush(self):
+        """Complete all open frames; return them as a list, oldest first."""
+        completed = []
+        self._complete_all(completed)
+        return completed
+
+    def _complete_all(self, completed):
+        while self._open_frame_identifiers:
+            self._complete_oldest(completed)
+
+    def _complete_oldest(self, completed):
+        frame_identifier = heapq.heappop(self._open_frame_identifiers)
+        frame = self._open_frames.pop(frame_identifier)
+
+        packets = frame.packets
+        carried = self._carried
+        for packet_id in self._carry_forward:
+            if packets[packet_id] is None:
+                packets[packet_id] = carried[packet_id]
+            else:
+                carried[packet_id] = packets[packet_id]
+
+        self._last_completed_frame_identifier = frame_identifier
+        self.latest = frame
+        self.completed_frame_count += 1
+        completed.append(frame)
@@ -5,11 +5,14 @@ import sys
 
 from collections import namedtuple, Counter
 
-from PyQt5.QtCore import QObject, pyqtSignal, QAbstractListModel, QVariant, Qt
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QHBoxLayout, QLabel, QListView
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QAbstractListModel, QModelIndex, QVariant, Qt, QThread, QTimer
+from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QListView, QListWidget, QListWidgetItem
 from PyQt5.QtNetwork import QAbstractSocket, QUdpSocket
 
-from f1_2019_telemetry.packets import PacketID, unpack_udp_packet, UnpackError
+from f1_2019_telemetry.packets import PacketID
+from f1_2019_telemetry.frames import FrameAssembler
+from f1_2019_telemetry.pipeline import Pipeline, ValidateStage, DecodeStage, CallbackSink
+from f1_2019_telemetry.gui.plots import TelemetryRingBuffer, TelemetryPlotWidget
 
 IncomingPacket = namedtuple("IncomingPacket", "timestamp, recv_port, src_address, src_port, packet")
 
@@ -20,32 +23,44 @@ class Session(QObject):
         self.first_timestamp = first_timestamp
         self.counter = 0
         self.cmap = Counter()
+        self.frameAssembler = FrameAssembler()
+
+    def latestFrame(self):
+        """Return the most recent completed Frame of the session, or None."""
+        return self.frameAssembler.latest
 
     def processIncomingPacket(self, incomingPacket):
         packet_id = PacketID(incomingPacket.packet.header.packetId)
         self.counter += 1
         self.cmap[packet_id] += 1
-        #print(self.sessionUID, self.counter, self.cmap)
-        if packet_id == PacketID.PARTICIPANTS:
-            print(incomingPacket)
+        self.frameAssembler.add(incomingPacket.packet)
 
 
 class SessionManager(QObject):
 
-    updated = pyqtSignal()
+    # Emitted with the row of a new session, right before and right after it is added to the session list.
+    sessionAboutToBeAdded = pyqtSignal(int)
+    sessionAdded = pyqtSignal(int)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.sessions = {}
         self.session_list = []
 
+    def processIncomingPackets(self, incomingPackets):
+        """Process a batch of packets, as emitted by the NetworkMonitor."""
+        for incomingPacket in incomingPackets:
+            self.processIncomingPacket(incomingPacket)
+
     def processIncomingPacket(self, incomingPacket):
         sessionUID = incomingPacket.packet.header.sessionUID
         if sessionUID not in self.sessions:
             new_session = Session(sessionUID, incomingPacket.timestamp)
+            row = len(self.session_list)
+            self.sessionAboutToBeAdded.emit(row)
             self.sessions[sessionUID] = new_session
             self.session_list.append(new_session)
-            self.updated.emit()
+            self.sessionAdded.emit(row)
         self.sessions[sessionUID].processIncomingPacket(incomingPacket)
 
     def count(self):
@@ -58,7 +73,8 @@ class SessionManagerListModel(QAbstractListModel):
     def __init__(self, sessionManager, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.sessionManager = sessionManager
-        self.sessionManager.updated.connect(self.reset)
+        self.sessionManager.sessionAboutToBeAdded.connect(self.beginAddSession)
+        self.sessionManager.sessionAdded.connect(self.endAddSession)
 
     def rowCount(self, parent):
         if parent.isValid():
@@ -73,9 +89,11 @@ class SessionManagerListModel(QAbstractListModel):
             return d
         return None
 
-    def reset(self):
-        self.beginResetModel()
-        self.endResetModel()
+    def beginAddSession(self, row):
+        self.beginInsertRows(QModelIndex(), row, row)
+
+    def endAddSession(self, row):
+        self.endInsertRows()
 
 class MyCentralWidget(QWidget):
 
@@ -86,11 +104,29 @@ class MyCentralWidget(QWidget):
         app = QApplication.instance()
         smlm = SessionManagerListModel(app.sessionManager)
         left.setModel(smlm)
-        right = QLabel("Right")
         layout.addWidget(left)
-        layout.addWidget(right)
+
+        # The cars to plot; if none are checked, the player's car is plotted.
+        self.carList = QListWidget()
+        for carIndex in range(20):
+            item = QListWidgetItem("Car {}".format(carIndex))
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+            self.carList.addItem(item)
+        self.carList.itemChanged.connect(self.updateSelectedCars)
+
+        self.plot = TelemetryPlotWidget(app.telemetryBuffer, app.historySeconds, app.refreshRate)
+
+        right = QVBoxLayout()
+        right.addWidget(self.plot, 4)
+        right.addWidget(self.carList, 1)
+        layout.addLayout(right, 1)
         self.setLayout(layout)
 
+    def updateSelectedCars(self, item):
+        self.plot.setSelectedCars(carIndex for carIndex in range(self.carList.count())
+                                  if self.carList.item(carIndex).checkState() == Qt.Checked)
+
 
 class MyMainWindow(QMainWindow):
 
@@ -101,12 +137,32 @@ class MyMainWindow(QMainWindow):
 
 
 class UdpSocketMonitor(QObject):
+    """Receives and decodes the datagrams sent to a single UDP port.
+
+    The UdpSocketMonitor lives in the NetworkMonitor's worker thread, so decoding never holds up the GUI thread.
+    Datagrams are validated and decoded by a Pipeline (see f1_2019_telemetry.pipeline), like in the monitor script.
+    Decoded packets are collected, and emitted as a single batch every 'updateInterval' milliseconds.
+    """
 
-    incomingPacket = pyqtSignal(IncomingPacket)
+    incomingPackets = pyqtSignal(list)
 
-    def __init__(self, port, *args, **kwargs):
+    def __init__(self, port, updateInterval, telemetryBuffer=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.port = port
+        self.updateInterval = updateInterval
+        self.telemetryBuffer = telemetryBuffer
+        self.sock = None
+        self.timer = None
+        self.pendingPackets = []
+
+        # The pipeline calls addDecodedPackets right away, while the source of the datagram is still known.
+        self.pipeline = Pipeline([ValidateStage(), DecodeStage()])
+        self.pipeline.add_sink(CallbackSink(self.addDecodedPackets))
+        self.source = None
+
+    @pyqtSlot()
+    def start(self):
+        """Create the socket and the update timer. Called in the worker thread, so they belong to that thread."""
 
         # Bind mode: either QAbstractSocket.ShareAddress or QAbstractSocket.ReuseAddressHint.
         #
@@ -118,45 +174,81 @@ class UdpSocketMonitor(QObject):
         # MacOS ReuseAddressHint
         # Win10 ReuseAddressHint
 
-        self.sock = QUdpSocket()
+        self.sock = QUdpSocket(self)
         self.sock.bind(self.port, QAbstractSocket.ShareAddress)
         self.sock.readyRead.connect(self.readSocketData)
 
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.emitPendingPackets)
+        self.timer.start(self.updateInterval)
+
     def readSocketData(self):
         while self.sock.hasPendingDatagrams():
             timestamp = time.time()
             (datagram, address, port) = self.sock.readDatagram(2048)
-            try:
-                packet = unpack_udp_packet(datagram)
-                incoming_packet = IncomingPacket(timestamp, self.port, address.toString(), port, packet)
-                self.incomingPacket.emit(incoming_packet)
-            except UnpackError:
-                pass
+            self.source = (address.toString(), port)
+            self.pipeline.process_datagram(timestamp, datagram)
+
+    def addDecodedPackets(self, batch):
+        (address, port) = self.source
+        for item in batch:
+            packet = item.packet
+            if self.telemetryBuffer is not None and item.header.packetId == PacketID.CAR_TELEMETRY:
+                self.telemetryBuffer.append(packet)
+            self.pendingPackets.append(IncomingPacket(item.timestamp, self.port, address, port, packet))
+
+    def emitPendingPackets(self):
+        if self.pendingPackets:
+            (incomingPackets, self.pendingPackets) = (self.pendingPackets, [])
+            self.incomingPackets.emit(incomingPackets)
 
 
 class NetworkMonitor(QObject):
+    """Receives packets on one or more UDP ports in a worker thread; emits them in batches to the GUI thread."""
 
-    incomingPacket = pyqtSignal(IncomingPacket)
+    incomingPackets = pyqtSignal(list)
 
-    def __init__(self, ports, *args, **kwargs):
+    def __init__(self, ports, updateInterval, telemetryBuffer=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        self.thread = QThread()
+        self.thread.setObjectName("network")
+
         self.udp_port_monitors = []
         for port in ports:
-            udp_port_monitor = UdpSocketMonitor(port)
-            udp_port_monitor.incomingPacket.connect(self.incomingPacket)
+            udp_port_monitor = UdpSocketMonitor(port, updateInterval, telemetryBuffer)
+            udp_port_monitor.moveToThread(self.thread)
+            self.thread.started.connect(udp_port_monitor.start)
+            # The worker thread emits; the connection is queued, so our signal is emitted in the GUI thread.
+            udp_port_monitor.incomingPackets.connect(self.incomingPackets)
             self.udp_port_monitors.append(udp_port_monitor)
 
+        self.thread.start()
+
+    def stop(self):
+        """Stop the worker thread, and wait for it to finish."""
+        self.thread.quit()
+        self.thread.wait()
+
 
 class MyApplication(QApplication):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.networkMonitor = NetworkMonitor([20777])
+        # Deliver incoming packets to the GUI thread once per display refresh.
+        self.refreshRate = self.primaryScreen().refreshRate() or 60.0
+        updateInterval = max(1, int(1000.0 / self.refreshRate))
+
+        # Keep 5 minutes of car telemetry, at the game's highest packet rate of 60 Hz.
+        self.historySeconds = 300.0
+        self.telemetryBuffer = TelemetryRingBuffer(int(self.historySeconds * 60))
+
+        self.networkMonitor = NetworkMonitor([20777], updateInterval, self.telemetryBuffer)
         self.sessionManager = SessionManager()
 
-        self.networkMonitor.incomingPacket.connect(self.sessionManager.processIncomingPacket)
+        self.networkMonitor.incomingPackets.connect(self.sessionManager.processIncomingPackets)
+        self.aboutToQuit.connect(self.networkMonitor.stop)
 
         self.mainWindow = MyMainWindow()
         self.mainWindow.show()
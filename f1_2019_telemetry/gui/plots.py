@@ -0,0 +1,205 @@
+"""Live telemetry plots for the GUI.
+
+The TelemetryRingBuffer keeps the history of a few car telemetry channels (speed, throttle, brake, gear, RPM) for all
+cars, in NumPy arrays that are allocated once. It is filled directly from car telemetry packets in the network worker
+thread: the packet is viewed as a NumPy record array, so storing a sample for all 20 cars is a single vectorized copy
+per channel.
+
+The TelemetryPlotWidget draws the channels of the selected cars. Before drawing, the history of each channel is
+reduced to a minimum and a maximum per pixel column (min/max decimation). Peaks are preserved, and the number of
+points drawn only depends on the width of the widget, not on the length of the history.
+"""
+
+import threading
+import ctypes
+
+import numpy as np
+
+from PyQt5.QtCore import Qt, QPointF, QTimer
+from PyQt5.QtGui import QPainter, QPen, QColor, QPolygonF
+from PyQt5.QtWidgets import QWidget
+
+from f1_2019_telemetry.packets import PacketHeader, CarTelemetryData_V1
+
+# The NumPy equivalent of the CarTelemetryData_V1 structure.
+_CAR_TELEMETRY_DTYPE = np.dtype(CarTelemetryData_V1)
+
+# The plotted channels: (field name, label, lowest value, highest value).
+TELEMETRY_CHANNELS = [
+    ('speed'     , 'speed [km/h]',  0.0,   360.0),
+    ('throttle'  , 'throttle'    ,  0.0,     1.0),
+    ('brake'     , 'brake'       ,  0.0,     1.0),
+    ('gear'      , 'gear'        , -1.0,     8.0),
+    ('engineRPM' , 'RPM'         ,  0.0, 15000.0)
+]
+
+# Colors used to tell the selected cars apart.
+_CAR_COLORS = [QColor(c) for c in ("#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4", "#42d4f4", "#f032e6", "#bfef45")]
+
+
+class TelemetryRingBuffer:
+    """The most recent 'capacity' car telemetry samples of a session, for all cars.
+
+    Samples are added from the network worker thread, and read from the GUI thread; a lock protects the arrays.
+
+    The session times of the samples always increase from oldest to newest. After a flashback, the game sends samples
+    from earlier in the session again; the samples of the stretch that was rewound are dropped.
+    """
+
+    def __init__(self, capacity: int, numCars: int = 20):
+        self.capacity = capacity
+        self.numCars = numCars
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.channels = {name: np.zeros((numCars, capacity), dtype=np.float32) for (name, label, low, high) in TELEMETRY_CHANNELS}
+        self.sessionUID = None
+        self.playerCarIndex = 0
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, packet):
+        """Add a sample for all cars from a PacketCarTelemetryData_V1 packet."""
+        cars = np.frombuffer(packet, dtype=_CAR_TELEMETRY_DTYPE, count=self.numCars, offset=ctypes.sizeof(PacketHeader))
+        header = packet.header
+        with self._lock:
+            if header.sessionUID != self.sessionUID:
+                # A new session: forget the history of the previous one.
+                self.sessionUID = header.sessionUID
+                self._next = 0
+                self._count = 0
+            elif self._count != 0 and header.sessionTime < self.times[self._next - 1]:
+                # A flashback: forget the samples from the session time we went back to onwards.
+                first = self._first()
+                self._count = self._countBefore(header.sessionTime)
+                self._next = (first + self._count) % self.capacity
+            self.playerCarIndex = header.playerCarIndex
+            index = self._next
+            self.times[index] = header.sessionTime
+            for (name, values) in self.channels.items():
+                values[:, index] = cars[name]
+            self._next = (index + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def history(self, name, carIndex, seconds: float = None):
+        """Return copies of the (times, values) arrays of a channel of a car, oldest sample first.
+
+        If 'seconds' is given, only the samples of the last 'seconds' of session time are copied.
+        """
+        with self._lock:
+            first = self._first()
+            count = self._count
+            if seconds is not None and count != 0:
+                skipped = self._countBefore(self.times[self._next - 1] - seconds)
+                first = (first + skipped) % self.capacity
+                count -= skipped
+            if first + count <= self.capacity:
+                times = self.times[first:first + count].copy()
+                values = self.channels[name][carIndex, first:first + count].copy()
+            else:
+                last = (first + count) % self.capacity
+                times = np.concatenate((self.times[first:], self.times[:last]))
+                values = np.concatenate((self.channels[name][carIndex, first:], self.channels[name][carIndex, :last]))
+        return (times, values)
+
+    def _first(self):
+        """Return the index of the oldest sample."""
+        return (self._next - self._count) % self.capacity
+
+    def _countBefore(self, sessionTime):
+        """Return the number of samples before 'sessionTime'. Must be called with the lock held."""
+        first = self._first()
+        if first + self._count <= self.capacity:
+            return int(np.searchsorted(self.times[first:first + self._count], sessionTime))
+        older = self.times[first:]
+        count = int(np.searchsorted(older, sessionTime))
+        if count < len(older):
+            return count
+        return count + int(np.searchsorted(self.times[:self._next], sessionTime))
+
+
+def minMaxDecimate(times, values, numBins: int):
+    """Reduce a series to the minimum and maximum values in each of 'numBins' equal-length bins.
+
+    Returns (times, values) arrays of at most 2 * numBins points, which trace the outline of the original series.
+    """
+    numSamples = len(values)
+    if numSamples <= 2 * numBins:
+        return (times, values)
+
+    # Drop the oldest samples that don't fill a whole bin.
+    binSize = numSamples // numBins
+    start = numSamples - binSize * numBins
+    binnedValues = values[start:].reshape(numBins, binSize)
+    binnedTimes = times[start:].reshape(numBins, binSize)
+
+    rows = np.arange(numBins)
+    argMin = binnedValues.argmin(axis=1)
+    argMax = binnedValues.argmax(axis=1)
+
+    # Within each bin, keep the minimum and the maximum in the order in which they occurred.
+    first = np.minimum(argMin, argMax)
+    second = np.maximum(argMin, argMax)
+
+    outTimes = np.empty(2 * numBins, dtype=times.dtype)
+    outValues = np.empty(2 * numBins, dtype=values.dtype)
+    outTimes[0::2] = binnedTimes[rows, first]
+    outTimes[1::2] = binnedTimes[rows, second]
+    outValues[0::2] = binnedValues[rows, first]
+    outValues[1::2] = binnedValues[rows, second]
+    return (outTimes, outValues)
+
+
+class TelemetryPlotWidget(QWidget):
+    """Draws the telemetry channels of the selected cars as stacked plots, refreshed 'refreshRate' times per second.
+
+    The most recent 'historySeconds' of session time are shown. If no cars are selected, the player's car is shown.
+    """
+
+    def __init__(self, telemetryBuffer, historySeconds: float = 120.0, refreshRate: float = 60.0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.telemetryBuffer = telemetryBuffer
+        self.historySeconds = historySeconds
+        self.selectedCars = []
+        self.setMinimumSize(400, 300)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update)
+        self.timer.start(max(1, int(1000.0 / refreshRate)))
+
+    def setSelectedCars(self, carIndices):
+        self.selectedCars = list(carIndices)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+
+        cars = self.selectedCars or [self.telemetryBuffer.playerCarIndex]
+
+        width = self.width()
+        plotHeight = self.height() / len(TELEMETRY_CHANNELS)
+
+        for (channelIndex, (name, label, low, high)) in enumerate(TELEMETRY_CHANNELS):
+            top = channelIndex * plotHeight
+
+            painter.setPen(QPen(QColor(80, 80, 80)))
+            painter.drawLine(QPointF(0, top + plotHeight - 1), QPointF(width, top + plotHeight - 1))
+            painter.drawText(QPointF(4, top + 14), label)
+
+            for (carNumber, carIndex) in enumerate(cars):
+                # Only show the last 'historySeconds' of session time.
+                (times, values) = self.telemetryBuffer.history(name, carIndex, self.historySeconds)
+                if len(times) < 2:
+                    continue
+
+                tStart = times[-1] - self.historySeconds
+                (times, values) = minMaxDecimate(times, values, max(1, width))
+
+                xs = (times - tStart) * (width / self.historySeconds)
+                ys = top + (plotHeight - 2) * (1.0 - (np.clip(values, low, high) - low) / (high - low))
+
+                polygon = QPolygonF([QPointF(x, y) for (x, y) in zip(xs.tolist(), ys.tolist())])
+                painter.setPen(QPen(_CAR_COLORS[carNumber % len(_CAR_COLORS)]))
+                painter.drawPolyline(polygon)
+
+        painter.end()
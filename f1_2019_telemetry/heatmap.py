@@ -0,0 +1,332 @@
+"""Aggregate telemetry channels over many sessions into heatmaps of a track.
+
+A TrackHeatmap bins the positions of all cars (from the motion packets) into a grid of square cells in the horizontal
+(x, z) plane, and accumulates telemetry channels (speed, throttle, brake, tyre temperature, ...) per cell. Channels are
+taken at the session time of each motion packet, which is the time of the car telemetry packet of the same frame.
+The heatmap holds:
+
+    count, sums[name]            per cell: the number of samples, and the sum of each channel (see mean())
+    braking_points               per cell: the number of times a car started braking there
+    distance_count, distance_sums[name], distance_histograms[name], braking_distance
+                                 the same per bin of lap distance, with a histogram of each channel per bin;
+                                 these give the per-corner profile of the track
+
+All accumulators are arrays of a fixed size, set by the grid and channel settings, so memory does not grow with the
+number of sessions. Heatmaps of the same track are combined with merge(), which simply adds the arrays; this is how
+aggregate_session_files() combines the partial heatmaps of session files processed in parallel:
+
+    heatmap = aggregate_session_files(paths, jobs=8)
+    speed = heatmap.mean('speed')           # 2-D array of mean speeds; NaN for cells without samples
+    render_png(heatmap, 'speed', "speed.png")
+
+Rendering requires matplotlib, which is only imported when needed. The rest of the module requires NumPy
+(pip install f1-2019-telemetry[analysis]).
+"""
+
+import os
+import json
+import logging
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from .packets import PacketID, TrackIDs
+from .session_loader import load_session
+from .resample import resample_session, packet_times
+from .track_index import session_track_id
+
+# A channel to aggregate: its name, the car telemetry field, and the range of its histograms. Fields with a value per
+# wheel (such as 'tyresSurfaceTemperature') are averaged over the four wheels.
+HeatmapChannel = collections.namedtuple('HeatmapChannel', 'name, field, low, high')
+
+DEFAULT_CHANNELS = (
+    HeatmapChannel('speed'           , 'speed'                  , 0.0 , 360.0),
+    HeatmapChannel('throttle'        , 'throttle'               , 0.0 ,   1.0),
+    HeatmapChannel('brake'           , 'brake'                  , 0.0 ,   1.0),
+    HeatmapChannel('tyreTemperature' , 'tyresSurfaceTemperature', 20.0, 140.0)
+)
+
+# The area covered by the grid, in metres: (x_min, x_max, z_min, z_max). All tracks fit in it.
+DEFAULT_EXTENT = (-1500.0, 1500.0, -1500.0, 1500.0)
+
+# The version of the saved file layout.
+_FILE_VERSION = 1
+
+
+class TrackHeatmap:
+    """Fixed-size accumulators of telemetry channels per grid cell and per lap distance bin, for a single track.
+
+    Args:
+        channels: the HeatmapChannel tuples of the channels to aggregate.
+        cell_size: the size of the grid cells, in metres.
+        extent: the area covered by the grid, (x_min, x_max, z_min, z_max) in metres; samples outside it are counted
+            in 'outside_count' only.
+        distance_step: the size of the lap distance bins, in metres.
+        max_distance: the lap distance covered by the bins, in metres.
+        histogram_bins: the number of bins of the channel histograms.
+        brake_threshold: the brake value at which a car is considered to start braking.
+    """
+
+    def __init__(self, channels=DEFAULT_CHANNELS, cell_size: float = 5.0, extent=DEFAULT_EXTENT, distance_step: float = 10.0,
+                 max_distance: float = 8000.0, histogram_bins: int = 32, brake_threshold: float = 0.2):
+        self.channels = tuple(HeatmapChannel(*channel) for channel in channels)
+        self.cell_size = cell_size
+        self.extent = tuple(extent)
+        self.distance_step = distance_step
+        self.max_distance = max_distance
+        self.histogram_bins = histogram_bins
+        self.brake_threshold = brake_threshold
+
+        self.nx = int(np.ceil((self.extent[1] - self.extent[0]) / cell_size))
+        self.nz = int(np.ceil((self.extent[3] - self.extent[2]) / cell_size))
+        self.n_distance = int(np.ceil(max_distance / distance_step))
+
+        self.track_id = None
+        self.session_count = 0
+        self.sample_count = 0
+        self.outside_count = 0
+
+        names = [channel.name for channel in self.channels]
+        self.count = np.zeros((self.nz, self.nx), dtype=np.int64)
+        self.sums = {name: np.zeros((self.nz, self.nx)) for name in names}
+        self.braking_points = np.zeros((self.nz, self.nx), dtype=np.int64)
+        self.distance_count = np.zeros(self.n_distance, dtype=np.int64)
+        self.distance_sums = {name: np.zeros(self.n_distance) for name in names}
+        self.distance_histograms = {name: np.zeros((self.n_distance, histogram_bins), dtype=np.int64) for name in names}
+        self.braking_distance = np.zeros(self.n_distance, dtype=np.int64)
+
+    def settings(self):
+        """Return the settings of the heatmap, as keyword arguments for TrackHeatmap()."""
+        return {'channels': [tuple(channel) for channel in self.channels], 'cell_size': self.cell_size, 'extent': list(self.extent),
+                'distance_step': self.distance_step, 'max_distance': self.max_distance, 'histogram_bins': self.histogram_bins,
+                'brake_threshold': self.brake_threshold}
+
+    def _accumulators(self):
+        """Return the names and arrays of all accumulators."""
+        arrays = [('count', self.count), ('braking_points', self.braking_points), ('distance_count', self.distance_count),
+                  ('braking_distance', self.braking_distance)]
+        for channel in self.channels:
+            arrays.append(('sum_' + channel.name, self.sums[channel.name]))
+            arrays.append(('distance_sum_' + channel.name, self.distance_sums[channel.name]))
+            arrays.append(('distance_histogram_' + channel.name, self.distance_histograms[channel.name]))
+        return arrays
+
+    def _check_track(self, track_id):
+        if self.track_id is not None and track_id is not None and track_id != self.track_id:
+            raise ValueError("Track {} doesn't match the heatmap's track {}.".format(
+                TrackIDs.get(track_id, track_id), TrackIDs.get(self.track_id, self.track_id)))
+
+    def add_session(self, session) -> None:
+        """Add all samples of all cars of a session, as loaded by load_session().
+
+        Raises:
+            ValueError: if the session is not on the heatmap's track.
+        """
+        track_id = session_track_id(session)
+        if track_id is None:
+            raise ValueError("The session has no session packets.")
+        self._check_track(track_id)
+
+        fields = sorted(set(channel.field for channel in self.channels).union(['brake']))
+        resampled = resample_session(session, packet_times(session, PacketID.MOTION),
+                                     packet_ids=(PacketID.MOTION, PacketID.LAP_DATA, PacketID.CAR_TELEMETRY),
+                                     fields=['worldPositionX', 'worldPositionZ', 'lapDistance'] + fields)
+
+        x = resampled['worldPositionX']
+        z = resampled['worldPositionZ']
+        # Inactive cars have all-zero positions.
+        active = (x != 0.0) | (z != 0.0)
+
+        values = {}
+        for channel in self.channels:
+            value = np.asarray(resampled[channel.field], dtype=np.float64)
+            values[channel.name] = value.mean(axis=2) if value.ndim == 3 else value
+
+        # A braking point is where the brake goes over the threshold, per car.
+        brake = resampled['brake']
+        braking = np.zeros(x.shape, dtype=bool)
+        braking[1:] = (brake[1:] >= self.brake_threshold) & (brake[:-1] < self.brake_threshold)
+
+        # Grid cells.
+        ix = np.floor((x - self.extent[0]) / self.cell_size).astype(np.int64)
+        iz = np.floor((z - self.extent[2]) / self.cell_size).astype(np.int64)
+        inside = active & (ix >= 0) & (ix < self.nx) & (iz >= 0) & (iz < self.nz)
+        cells = (iz * self.nx + ix)[inside]
+        n_cells = self.nx * self.nz
+
+        self.count += np.bincount(cells, minlength=n_cells).reshape(self.count.shape)
+        self.braking_points += np.bincount((iz * self.nx + ix)[inside & braking], minlength=n_cells).reshape(self.count.shape)
+        for channel in self.channels:
+            self.sums[channel.name] += np.bincount(cells, weights=values[channel.name][inside], minlength=n_cells).reshape(self.count.shape)
+
+        # Lap distance bins. Before a car first crosses the line, its lap distance is negative.
+        distance = resampled['lapDistance']
+        on_lap = active & (distance >= 0.0) & (distance < self.max_distance)
+        bins = (distance[on_lap] / self.distance_step).astype(np.int64)
+
+        self.distance_count += np.bincount(bins, minlength=self.n_distance)
+        self.braking_distance += np.bincount((distance[on_lap & braking] / self.distance_step).astype(np.int64), minlength=self.n_distance)
+        for channel in self.channels:
+            value = values[channel.name][on_lap]
+            self.distance_sums[channel.name] += np.bincount(bins, weights=value, minlength=self.n_distance)
+            value_bins = np.clip(((value - channel.low) / (channel.high - channel.low) * self.histogram_bins).astype(np.int64),
+                                 0, self.histogram_bins - 1)
+            self.distance_histograms[channel.name] += np.bincount(bins * self.histogram_bins + value_bins,
+                                                                  minlength=self.n_distance * self.histogram_bins).reshape(self.n_distance, self.histogram_bins)
+
+        self.track_id = track_id
+        self.session_count += 1
+        self.sample_count += int(active.sum())
+        self.outside_count += int((active & ~inside).sum())
+
+    def merge(self, other: 'TrackHeatmap') -> None:
+        """Add the accumulators of another heatmap with the same settings.
+
+        Raises:
+            ValueError: if the settings or the tracks of the heatmaps differ.
+        """
+        if other.settings() != self.settings():
+            raise ValueError("Unable to merge heatmaps with different settings.")
+        self._check_track(other.track_id)
+
+        for ((name, array), (other_name, other_array)) in zip(self._accumulators(), other._accumulators()):
+            array += other_array
+
+        if other.track_id is not None:
+            self.track_id = other.track_id
+        self.session_count += other.session_count
+        self.sample_count += other.sample_count
+        self.outside_count += other.outside_count
+
+    def mean(self, name: str):
+        """Return the mean of a channel per grid cell; NaN for cells without samples."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.sums[name] / self.count, np.nan)
+
+    def distance_mean(self, name: str):
+        """Return the mean of a channel per lap distance bin; NaN for bins without samples."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.distance_count > 0, self.distance_sums[name] / self.distance_count, np.nan)
+
+    def cell_centres(self):
+        """Return the (x, z) coordinates of the centres of the grid columns and rows."""
+        x = self.extent[0] + (np.arange(self.nx) + 0.5) * self.cell_size
+        z = self.extent[2] + (np.arange(self.nz) + 0.5) * self.cell_size
+        return (x, z)
+
+    def save(self, path: str) -> None:
+        """Save the heatmap to an .npz file."""
+        metadata = {'version': _FILE_VERSION, 'settings': self.settings(), 'track_id': self.track_id, 'session_count': self.session_count,
+                    'sample_count': self.sample_count, 'outside_count': self.outside_count}
+        np.savez_compressed(path, metadata=np.array(json.dumps(metadata)), **dict(self._accumulators()))
+
+    @classmethod
+    def load(cls, path: str) -> 'TrackHeatmap':
+        """Load a heatmap saved by save().
+
+        Raises:
+            ValueError: if the file has an unknown layout.
+        """
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            if metadata.get('version') != _FILE_VERSION:
+                raise ValueError("Unknown heatmap file version in {!r}.".format(path))
+            heatmap = cls(**metadata['settings'])
+            for (name, array) in heatmap._accumulators():
+                array[...] = data[name]
+        heatmap.track_id = metadata['track_id']
+        heatmap.session_count = metadata['session_count']
+        heatmap.sample_count = metadata['sample_count']
+        heatmap.outside_count = metadata['outside_count']
+        return heatmap
+
+
+def heatmap_of_file(path: str, settings, track_ids=None):
+    """Return the heatmap of a single session file; or None if it's not on one of 'track_ids' (if given).
+
+    This runs in a worker process.
+    """
+    session = load_session(path)
+    if track_ids is not None and session_track_id(session) not in track_ids:
+        return None
+    heatmap = TrackHeatmap(**settings)
+    heatmap.add_session(session)
+    return heatmap
+
+
+def aggregate_session_files(paths, jobs: int = None, track_ids=None, **settings) -> TrackHeatmap:
+    """Aggregate session files into a single heatmap, using a pool of 'jobs' worker processes.
+
+    Each worker returns the heatmap of one file, which is merged into the result as soon as it is done; at most 'jobs'
+    partial heatmaps exist at any time. Files that fail, or that are on another track than the first file merged, are
+    logged and skipped.
+
+    Args:
+        paths: the session files.
+        jobs: the number of worker processes (default: the number of CPU cores).
+        track_ids: if given, only files on these tracks are aggregated.
+        settings: keyword arguments for TrackHeatmap().
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    result = TrackHeatmap(**settings)
+    settings = result.settings()
+
+    to_do = collections.deque(paths)
+    futures = {}
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        while to_do or futures:
+            while to_do and len(futures) < jobs:
+                path = to_do.popleft()
+                futures[executor.submit(heatmap_of_file, path, settings, track_ids)] = path
+
+            (done, not_done) = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path = futures.pop(future)
+                try:
+                    heatmap = future.result()
+                    if heatmap is None:
+                        logging.debug("Skipped {!r}: not on the selected track.".format(path))
+                        continue
+                    result.merge(heatmap)
+                except Exception as error:
+                    logging.warning("Skipped {!r}: {}".format(path, error))
+                    continue
+                logging.info("Added {!r}: {} samples.".format(path, heatmap.sample_count))
+
+    return result
+
+
+def render_png(heatmap: TrackHeatmap, name: str, path: str, title: str = None) -> None:
+    """Render the mean of a channel per cell, or the braking points (name 'braking_points'), to a PNG file.
+
+    The image is cropped to the cells that have samples. This requires matplotlib.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    if name == 'braking_points':
+        image = np.where(heatmap.braking_points > 0, heatmap.braking_points, np.nan)
+    else:
+        image = heatmap.mean(name)
+
+    rows = np.flatnonzero(heatmap.count.any(axis=1))
+    columns = np.flatnonzero(heatmap.count.any(axis=0))
+    if len(rows) == 0:
+        raise ValueError("The heatmap has no samples.")
+    image = image[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+    extent = (heatmap.extent[0] + columns[0] * heatmap.cell_size, heatmap.extent[0] + (columns[-1] + 1) * heatmap.cell_size,
+              heatmap.extent[2] + rows[0] * heatmap.cell_size, heatmap.extent[2] + (rows[-1] + 1) * heatmap.cell_size)
+
+    figure = Figure(figsize=(10, 10))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    mappable = axes.imshow(image, origin='lower', extent=extent, cmap='inferno', interpolation='nearest')
+    axes.set_aspect('equal')
+    axes.set_xlabel("x (m)")
+    axes.set_ylabel("z (m)")
+    axes.set_title(title if title is not None else "{} - {} ({} sessions)".format(
+        TrackIDs.get(heatmap.track_id, "unknown track"), name, heatmap.session_count))
+    figure.colorbar(mappable, ax=axes)
+    figure.savefig(path, dpi=100)
@@ -0,0 +1,212 @@
+"""Distribute telemetry packets received on a single UDP socket to local subscribers over Unix datagram sockets.
+
+Binding the same UDP port from multiple processes (using SO_REUSEADDR or SO_REUSEPORT) doesn't reliably deliver
+each packet to each process on all platforms. Instead, the hub (see the f1-2019-telemetry-hub script) owns the UDP
+socket and forwards each raw datagram to any number of local subscribers.
+
+Subscription protocol
+---------------------
+
+The hub listens for control messages on a Unix datagram socket at a well-known path. A subscriber binds its own Unix
+datagram socket to a unique path, and sends one of the following control messages from it to the hub:
+
+  b"SUBSCRIBE"           -- subscribe to all packets.
+  b"SUBSCRIBE 2,6"       -- subscribe to packets with the given packetId values only.
+  b"UNSUBSCRIBE"         -- stop receiving packets.
+
+The hub forwards matching datagrams unaltered to the subscriber's path.
+
+Each subscriber has its own bounded queue in the hub. Datagrams are sent without blocking; if a subscriber doesn't
+keep up, its queue fills up and the oldest datagrams are dropped, for that subscriber only. A subscriber whose socket
+has disappeared is removed.
+
+Unix datagram sockets are not available on Windows.
+"""
+
+import os
+import socket
+import tempfile
+import logging
+import itertools
+import collections
+
+from .packets import PacketHeader
+from .sockets import MAX_PACKET_SIZE
+
+# The default path of the hub's control socket.
+DEFAULT_HUB_PATH = os.path.join(tempfile.gettempdir(), "f1-2019-telemetry-hub.sock")
+
+# Offset of the packetId field in the raw packet; used for filtering without decoding the packet.
+_PACKET_ID_OFFSET = PacketHeader.packetId.offset
+
+
+class HubSubscription:
+    """The hub's administration of a single subscriber."""
+
+    def __init__(self, path, packet_ids, max_queue_length):
+        self.path = path
+        self.packet_ids = None if packet_ids is None else frozenset(packet_ids)
+        self.queue = collections.deque()
+        self.max_queue_length = max_queue_length
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.connect(path)
+
+    def close(self):
+        self.sock.close()
+
+    def wants(self, datagram) -> bool:
+        """Return True if the subscriber wants to receive 'datagram'."""
+        return self.packet_ids is None or (len(datagram) > _PACKET_ID_OFFSET and datagram[_PACKET_ID_OFFSET] in self.packet_ids)
+
+    def enqueue(self, datagram):
+        if len(self.queue) >= self.max_queue_length:
+            # Slow consumer: drop the oldest datagram.
+            self.queue.popleft()
+            self.dropped_count += 1
+        self.queue.append(datagram)
+
+    def send_queued(self):
+        """Send as many queued datagrams as possible without blocking. Return True if the queue is empty afterwards.
+
+        Raises OSError (other than BlockingIOError) if the subscriber's socket is gone.
+        """
+        queue = self.queue
+        while queue:
+            try:
+                self.sock.send(queue[0])
+            except BlockingIOError:
+                return False
+            queue.popleft()
+            self.sent_count += 1
+        return True
+
+
+class TelemetryHub:
+    """Keeps track of subscribers and distributes datagrams to them.
+
+    The hub itself doesn't do any socket I/O on the control socket or the UDP socket; that is left to its owner.
+    After calling distribute(), the owner should call send_queued(), and again whenever a subscriber socket with
+    pending datagrams (see 'pending_subscriptions') becomes writable.
+
+    Args:
+        max_queue_length: the maximum number of datagrams queued per subscriber.
+        on_remove: if given, called with a subscription right before it is removed and its socket is closed.
+    """
+
+    def __init__(self, max_queue_length: int = 1000, on_remove=None):
+        self._max_queue_length = max_queue_length
+        self._on_remove = on_remove
+        self.subscriptions = {}
+
+    def close(self):
+        for path in list(self.subscriptions):
+            self.unsubscribe(path)
+
+    def handle_control_message(self, message: bytes, path):
+        """Process a control message received from 'path'."""
+        if not path:
+            logging.error("Ignoring control message from unbound socket.")
+            return
+
+        words = message.decode('ascii', errors='replace').split()
+
+        if words and words[0] == "SUBSCRIBE" and len(words) <= 2:
+            try:
+                packet_ids = None if len(words) == 1 else [int(packet_id) for packet_id in words[1].split(",")]
+            except ValueError:
+                logging.error("Ignoring bad subscription {!r} from {!r}.".format(message, path))
+                return
+            self.unsubscribe(path)
+            try:
+                self.subscriptions[path] = HubSubscription(path, packet_ids, self._max_queue_length)
+            except OSError as error:
+                logging.error("Unable to connect to subscriber {!r}: {}".format(path, error))
+                return
+            logging.info("Subscriber {!r} subscribed to {}.".format(path, "all packets" if packet_ids is None else "packet types {}".format(packet_ids)))
+        elif words == ["UNSUBSCRIBE"]:
+            self.unsubscribe(path)
+        else:
+            logging.error("Ignoring unknown control message {!r} from {!r}.".format(message, path))
+
+    def unsubscribe(self, path):
+        subscription = self.subscriptions.pop(path, None)
+        if subscription is not None:
+            logging.info("Subscriber {!r} unsubscribed; {} datagrams sent, {} dropped.".format(path, subscription.sent_count, subscription.dropped_count))
+            if self._on_remove is not None:
+                self._on_remove(subscription)
+            subscription.close()
+
+    def distribute(self, datagram):
+        """Queue 'datagram' for all subscribers that want it."""
+        for subscription in self.subscriptions.values():
+            if subscription.wants(datagram):
+                subscription.enqueue(datagram)
+
+    def send_queued(self):
+        """Send queued datagrams to all subscribers, without blocking; remove subscribers that are gone."""
+        gone = []
+        for subscription in self.subscriptions.values():
+            try:
+                subscription.send_queued()
+            except OSError:
+                gone.append(subscription.path)
+        for path in gone:
+            logging.info("Subscriber {!r} is gone.".format(path))
+            self.unsubscribe(path)
+
+    def pending_subscriptions(self):
+        """Return the subscriptions that still have queued datagrams."""
+        return [subscription for subscription in self.subscriptions.values() if subscription.queue]
+
+
+class HubSubscriber:
+    """A client of the hub that receives raw telemetry datagrams on a Unix datagram socket.
+
+    The 'socket' attribute can be registered with a selector; call recv() when it is readable.
+
+    Raises OSError if the hub is not running at 'hub_path'.
+
+    Args:
+        packet_ids: if given, only datagrams with these packetId values are received.
+        hub_path: path of the hub's control socket.
+    """
+
+    _counter = itertools.count()
+
+    def __init__(self, packet_ids=None, hub_path: str = DEFAULT_HUB_PATH):
+        self.hub_path = hub_path
+        self.path = os.path.join(tempfile.gettempdir(), "f1-2019-telemetry-subscriber-{}-{}.sock".format(os.getpid(), next(HubSubscriber._counter)))
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+
+        message = "SUBSCRIBE"
+        if packet_ids is not None:
+            message += " " + ",".join(str(int(packet_id)) for packet_id in packet_ids)
+        try:
+            self.socket.sendto(message.encode('ascii'), self.hub_path)
+        except OSError:
+            self._cleanup()
+            raise
+
+    def recv(self) -> bytes:
+        """Receive a single raw telemetry datagram."""
+        return self.socket.recv(MAX_PACKET_SIZE)
+
+    def close(self):
+        """Unsubscribe from the hub and release the socket."""
+        try:
+            self.socket.sendto(b"UNSUBSCRIBE", self.hub_path)
+        except OSError:
+            # The hub is already gone.
+            pass
+        self._cleanup()
+
+    def _cleanup(self):
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,193 @@
+"""Compare laps by resampling them onto a common distance grid.
+
+Laps are selected by session file, car index and lap number. For each lap, the lap time and the car telemetry
+channels (speed, throttle, brake, ...) are interpolated onto a grid of distances along the lap, so laps of different
+cars and sessions can be compared point by point:
+
+    reference = LapSelection("F1_2019_0123456789abcdef.sqlite3", 0, 5)
+    others = [LapSelection("F1_2019_0123456789abcdef.sqlite3", car_index, 5) for car_index in range(1, 20)]
+    comparison = compare_laps(reference, others)
+    comparison.delta_time[3]             # time lost (positive) or gained to the reference by others[3], per distance
+    comparison.differences['speed'][3]   # speed difference to the reference, per distance
+
+The lap time along the lap comes from the 'currentLapTime' and 'lapDistance' fields of the lap data packets. Car
+telemetry packets are placed on the lap by interpolating the lap distance at their session time. All interpolation
+is done with numpy.interp() on whole laps at once; the laps of a batch are stacked into 2-D arrays with one row per
+lap. Session files are loaded once per call, no matter how many laps they contribute.
+
+Grid points that a lap doesn't cover (e.g. the start of the first lap) are NaN.
+
+This module requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import collections
+
+import numpy as np
+
+from .packets import PacketID
+from .session_loader import load_session
+from .lap_index import read_lap_index, lap_slice
+
+# A lap to compare: the session file, the car index and the lap number.
+LapSelection = collections.namedtuple('LapSelection', 'path, carIndex, lapNum')
+
+# The car telemetry channels that are resampled by default.
+DEFAULT_CHANNELS = ('speed', 'throttle', 'brake', 'gear')
+
+
+class LapTraces:
+    """Laps resampled onto a common distance grid.
+
+    Attributes:
+        selections: the LapSelection of each lap (row).
+        distance: the distance grid in metres, shape (n_grid, ).
+        time: the lap time at each distance, in seconds, shape (n_laps, n_grid).
+        channels: a dict that maps channel names to arrays of shape (n_laps, n_grid).
+        lap_times: the lap time of each lap, in seconds; NaN for incomplete laps.
+    """
+
+    def __init__(self, selections, distance, time, channels, lap_times):
+        self.selections = selections
+        self.distance = distance
+        self.time = time
+        self.channels = channels
+        self.lap_times = lap_times
+
+    def __len__(self):
+        return len(self.selections)
+
+
+class LapComparison:
+    """A reference lap compared to other laps.
+
+    Attributes:
+        reference: the LapTraces of the reference lap (a single row).
+        laps: the LapTraces of the other laps.
+        distance: the distance grid in metres.
+        delta_time: the time difference to the reference at each distance, shape (n_laps, n_grid); positive where
+            the lap is behind the reference.
+        differences: a dict that maps channel names to the differences to the reference, shape (n_laps, n_grid).
+    """
+
+    def __init__(self, reference, laps):
+        self.reference = reference
+        self.laps = laps
+        self.distance = laps.distance
+        self.delta_time = laps.time - reference.time
+        self.differences = {name: laps.channels[name] - reference.channels[name] for name in laps.channels}
+
+
+def _track_length(session):
+    """Return the track length of a session in metres, from its session packets; or None."""
+    if PacketID.SESSION not in session:
+        return None
+    track_length = session[PacketID.SESSION]['trackLength']
+    return float(track_length[-1]) if len(track_length) != 0 else None
+
+
+def _resample_lap(session, lap, grid, channels):
+    """Resample a single lap onto the distance grid; return (time, {channel: values}) arrays."""
+    car_index = lap.carIndex
+
+    lap_data = session[PacketID.LAP_DATA]
+    lap_rows = lap_slice(lap_data, lap)
+    session_time = np.asarray(lap_data.time[lap_rows], dtype=np.float64)
+    distance = np.asarray(lap_data['lapDistance'][lap_rows, car_index], dtype=np.float64)
+    lap_time = np.asarray(lap_data['currentLapTime'][lap_rows, car_index], dtype=np.float64)
+
+    # Before the car crosses the line for the first time, the lap distance is negative.
+    on_lap = (distance >= 0.0)
+    (session_time, distance, lap_time) = (session_time[on_lap], distance[on_lap], lap_time[on_lap])
+
+    nan_grid = np.full(len(grid), np.nan)
+    if len(distance) < 2:
+        return (nan_grid, {name: nan_grid for name in channels})
+
+    # numpy.interp() needs increasing sample points; the lap distance may jitter back a little.
+    distance = np.maximum.accumulate(distance)
+
+    time = np.interp(grid, distance, lap_time, left=np.nan, right=np.nan)
+
+    values = {}
+    if PacketID.CAR_TELEMETRY in session:
+        telemetry = session[PacketID.CAR_TELEMETRY]
+        telemetry_rows = lap_slice(telemetry, lap)
+        # The lap distance of each telemetry sample, from the lap data packets around it.
+        telemetry_distance = np.interp(np.asarray(telemetry.time[telemetry_rows], dtype=np.float64), session_time, distance,
+                                       left=np.nan, right=np.nan)
+        known = ~np.isnan(telemetry_distance)
+        for name in channels:
+            channel = np.asarray(telemetry[name][telemetry_rows, car_index], dtype=np.float64)[known]
+            if len(channel) < 2:
+                values[name] = nan_grid
+            else:
+                values[name] = np.interp(grid, telemetry_distance[known], channel, left=np.nan, right=np.nan)
+    else:
+        values = {name: nan_grid for name in channels}
+
+    return (time, values)
+
+
+def resample_laps(selections, distance_step: float = 5.0, channels=DEFAULT_CHANNELS, track_length: float = None) -> LapTraces:
+    """Resample laps onto a common distance grid.
+
+    Args:
+        selections: an iterable of LapSelection tuples.
+        distance_step: the distance between grid points, in metres.
+        channels: the names of the car telemetry fields to resample.
+        track_length: the length of the grid, in metres; by default, the shortest track length of the sessions.
+
+    Returns:
+        A LapTraces instance, with the laps in the order of 'selections'.
+
+    Raises:
+        KeyError: if a selected lap is not in its session's lap index.
+    """
+    selections = [LapSelection(*selection) for selection in selections]
+
+    # Load each session file and its lap index once. The lap index is read first: building it modifies the file.
+    sessions = {}
+    for path in dict.fromkeys(selection.path for selection in selections):
+        lap_index = read_lap_index(path)
+        sessions[path] = (load_session(path), lap_index)
+
+    laps = [sessions[selection.path][1][(selection.carIndex, selection.lapNum)] for selection in selections]
+
+    if track_length is None:
+        track_lengths = [_track_length(session) for (session, lap_index) in sessions.values()]
+        track_lengths = [length for length in track_lengths if length]
+        if not track_lengths:
+            raise ValueError("Unable to determine the track length; please specify it.")
+        track_length = min(track_lengths)
+
+    grid = np.arange(0.0, track_length, distance_step)
+
+    time = np.empty((len(laps), len(grid)))
+    values = {name: np.empty((len(laps), len(grid))) for name in channels}
+    for (row, (selection, lap)) in enumerate(zip(selections, laps)):
+        (time[row], lap_values) = _resample_lap(sessions[selection.path][0], lap, grid, channels)
+        for name in channels:
+            values[name][row] = lap_values[name]
+
+    lap_times = np.array([lap.lapTime if lap.lapTime is not None else np.nan for lap in laps])
+
+    return LapTraces(selections, grid, time, values, lap_times)
+
+
+def compare_laps(reference, others, distance_step: float = 5.0, channels=DEFAULT_CHANNELS, track_length: float = None) -> LapComparison:
+    """Compare laps to a reference lap.
+
+    Args:
+        reference: the LapSelection of the reference lap.
+        others: an iterable of LapSelection tuples of the laps to compare.
+        distance_step, channels, track_length: see resample_laps().
+
+    Returns:
+        A LapComparison instance.
+    """
+    traces = resample_laps([reference] + list(others), distance_step, channels, track_length)
+    reference_traces = LapTraces(traces.selections[:1], traces.distance, traces.time[:1],
+                                 {name: values[:1] for (name, values) in traces.channels.items()}, traces.lap_times[:1])
+    other_traces = LapTraces(traces.selections[1:], traces.distance, traces.time[1:],
+                             {name: values[1:] for (name, values) in traces.channels.items()}, traces.lap_times[1:])
+    return LapComparison(reference_traces, other_traces)
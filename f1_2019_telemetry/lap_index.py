@@ -0,0 +1,235 @@
+"""Index the laps of a recorded session file, for fast per-lap and per-car access to its packets.
+
+Finding the packets of a single lap (e.g. all car telemetry of car 7 on lap 23) otherwise requires decoding the lap
+data packets of the entire session. build_lap_index() does this once, and stores the result in a 'laps' table inside
+the session file:
+
+    build_lap_index("F1_2019_0123456789abcdef.sqlite3")
+    lap = read_lap_index("F1_2019_0123456789abcdef.sqlite3")[(7, 23)]
+    packets = read_lap_packets("F1_2019_0123456789abcdef.sqlite3", lap, [PacketID.CAR_TELEMETRY])
+
+Each lap covers a range of packet rows (pkt_id values) in the session file: from the first lap data packet that
+reports the lap as the car's current lap, up to (but not including) the first lap data packet that reports a
+different lap. Since pkt_id is the primary key of the packets table, reading a lap is a range scan over just that
+lap's rows. For sessions loaded with load_session(), lap_slice() gives the slice of a packet type's columns that
+covers a lap.
+
+If a car's lap number goes back (e.g. after a flashback), a lap that is driven again replaces the earlier attempt.
+
+Note that writing the 'laps' table modifies the session file, which invalidates its session_loader cache. Build the
+lap index before loading the session, if both are needed.
+
+This module requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import sqlite3
+import collections
+import ctypes
+
+import numpy as np
+
+from .packets import PacketID, PacketLapData_V1
+from .session_loader import packet_dtype
+from .sqlite_utils import connect_read_only
+
+LapIndexEntry = collections.namedtuple("LapIndexEntry", (
+    "carIndex, lapNum, "
+    "startSessionTime, endSessionTime, startFrameIdentifier, endFrameIdentifier, startPktId, endPktId, "
+    "complete, valid, lapTime, sector1Time, sector2Time, sector3Time"))
+
+LapIndexEntry.__doc__ = """A single lap of a single car.
+
+The packets of the lap have pkt_id values in the half-open range [startPktId, endPktId). The session time and frame
+identifier are those of the first and last lap data packet of the lap. A lap is complete if the car went on to the next
+lap; only complete laps have a lap time, taken from the 'lastLapTime' field. Times are in seconds; sector times that
+were not reported by the game are None.
+"""
+
+_create_laps_table_query = """
+    CREATE TABLE laps (
+        carIndex              INTEGER NOT NULL,
+        lapNum                INTEGER NOT NULL,
+        startSessionTime      REAL    NOT NULL,  -- Session time of the first lap data packet of the lap.
+        endSessionTime        REAL    NOT NULL,  -- Session time of the last lap data packet of the lap.
+        startFrameIdentifier  INTEGER NOT NULL,
+        endFrameIdentifier    INTEGER NOT NULL,
+        startPktId            INTEGER NOT NULL,  -- First pkt_id of the lap.
+        endPktId              INTEGER NOT NULL,  -- One past the last pkt_id of the lap.
+        complete              INTEGER NOT NULL,  -- 1 if the car went on to the next lap.
+        valid                 INTEGER NOT NULL,  -- 0 if the game flagged the lap as invalid.
+        lapTime               REAL,
+        sector1Time           REAL,
+        sector2Time           REAL,
+        sector3Time           REAL,
+        PRIMARY KEY (carIndex, lapNum)
+    );
+    """
+
+_NUM_CARS = 20
+
+
+def _lap_data_rows(conn):
+    """Return the pkt_id values and the decoded records of all lap data packets in a session file."""
+    packet_size = ctypes.sizeof(PacketLapData_V1)
+    cursor = conn.execute("SELECT pkt_id, packet FROM packets WHERE packetId = ? ORDER BY pkt_id;", (PacketID.LAP_DATA,))
+    pkt_ids = []
+    blobs = []
+    for (pkt_id, packet) in cursor:
+        if len(packet) == packet_size:
+            pkt_ids.append(pkt_id)
+            blobs.append(packet)
+    cursor.close()
+
+    records = np.frombuffer(b"".join(blobs), dtype=packet_dtype(PacketLapData_V1))
+    return (np.array(pkt_ids, dtype=np.int64), records)
+
+
+def _optional_time(value):
+    return float(value) if value > 0.0 else None
+
+
+def _car_laps(car_index, pkt_ids, records, end_of_session_pkt_id):
+    """Yield the LapIndexEntry tuples of a single car, in order of appearance."""
+    lap_data = records['lapData'][:, car_index]
+    lap_nums = lap_data['currentLapNum']
+    if len(lap_nums) == 0:
+        return
+
+    # The indices of the first lap data packet of each run of packets with the same lap number.
+    starts = np.flatnonzero(np.diff(lap_nums.astype(np.int16))) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.concatenate((starts[1:], [len(lap_nums)]))
+
+    session_times = records['header']['sessionTime']
+    frames = records['header']['frameIdentifier']
+
+    for (start, end) in zip(starts.tolist(), ends.tolist()):
+        lap_num = int(lap_nums[start])
+        if lap_num == 0:
+            # The car is not (yet) active.
+            continue
+        last = end - 1
+        complete = (end < len(lap_nums) and int(lap_nums[end]) == lap_num + 1)
+        lap_time = _optional_time(lap_data['lastLapTime'][end]) if complete else None
+        sector1_time = _optional_time(lap_data['sector1Time'][last])
+        sector2_time = _optional_time(lap_data['sector2Time'][last])
+        if lap_time is not None and sector1_time is not None and sector2_time is not None:
+            sector3_time = lap_time - sector1_time - sector2_time
+        else:
+            sector3_time = None
+        yield LapIndexEntry(
+            car_index, lap_num,
+            float(session_times[start]), float(session_times[last]),
+            int(frames[start]), int(frames[last]),
+            int(pkt_ids[start]), int(pkt_ids[end]) if end < len(lap_nums) else end_of_session_pkt_id,
+            complete, bool(lap_data['currentLapInvalid'][last] == 0),
+            lap_time, sector1_time, sector2_time, sector3_time)
+
+
+def compute_lap_index(conn):
+    """Compute the lap index of an open session file, without storing it; return a list of LapIndexEntry tuples."""
+    (pkt_ids, records) = _lap_data_rows(conn)
+    if len(pkt_ids) == 0:
+        return []
+
+    (max_pkt_id, ) = conn.execute("SELECT MAX(pkt_id) FROM packets;").fetchone()
+
+    laps = {}
+    for car_index in range(_NUM_CARS):
+        for lap in _car_laps(car_index, pkt_ids, records, max_pkt_id + 1):
+            # A lap that is driven again (after a flashback) replaces the earlier attempt.
+            laps[(lap.carIndex, lap.lapNum)] = lap
+    return [laps[key] for key in sorted(laps)]
+
+
+def build_lap_index(path: str):
+    """Compute the lap index of a session file, and (re)write it to the file's 'laps' table.
+
+    Returns:
+        The list of LapIndexEntry tuples, ordered by car index and lap number.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        laps = compute_lap_index(conn)
+        query = "".join(line[4:] + "\n" for line in _create_laps_table_query.split("\n")[1:-1])
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS laps;")
+            conn.execute(query)
+            conn.executemany("INSERT INTO laps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", laps)
+    finally:
+        conn.close()
+    return laps
+
+
+def has_lap_index(conn):
+    """Return True if an open session file has a 'laps' table."""
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'laps';")
+    return cursor.fetchone() is not None
+
+
+def read_lap_index(path: str, build: bool = True):
+    """Read the lap index of a session file.
+
+    Args:
+        path: the path of the session file.
+        build: if True, build the lap index if the file doesn't have one yet.
+
+    Returns:
+        An ordered dict that maps (carIndex, lapNum) tuples to LapIndexEntry tuples, ordered by car index and lap
+        number; or None if the file has no lap index and 'build' is False.
+    """
+    conn = connect_read_only(path)
+    try:
+        if has_lap_index(conn):
+            cursor = conn.execute("SELECT * FROM laps ORDER BY carIndex, lapNum;")
+            laps = [LapIndexEntry(*row[:8], bool(row[8]), bool(row[9]), *row[10:]) for row in cursor]
+        else:
+            laps = None
+    finally:
+        conn.close()
+
+    if laps is None:
+        if not build:
+            return None
+        laps = build_lap_index(path)
+
+    return collections.OrderedDict(((lap.carIndex, lap.lapNum), lap) for lap in laps)
+
+
+def read_lap_packets(path: str, lap: LapIndexEntry, packet_ids=None):
+    """Read the packets of a lap from a session file.
+
+    Args:
+        path: the path of the session file.
+        lap: a LapIndexEntry of the session file.
+        packet_ids: if given, an iterable of the PacketIDs to read; all packet types otherwise.
+
+    Returns:
+        A list of (pkt_id, timestamp, packet) tuples, where packet is the raw packet as bytes.
+    """
+    query = "SELECT pkt_id, timestamp, packet FROM packets WHERE pkt_id >= ? AND pkt_id < ?"
+    parameters = [lap.startPktId, lap.endPktId]
+    if packet_ids is not None:
+        packet_ids = [int(packet_id) for packet_id in packet_ids]
+        query += " AND packetId IN ({})".format(", ".join("?" * len(packet_ids)))
+        parameters += packet_ids
+    query += " ORDER BY pkt_id;"
+
+    conn = connect_read_only(path)
+    try:
+        return conn.execute(query, parameters).fetchall()
+    finally:
+        conn.close()
+
+
+def lap_slice(packet_columns, lap: LapIndexEntry):
+    """Return the slice of a PacketColumns instance (as returned by load_session) that covers a lap.
+
+    Use it to index the columns, e.g.:
+
+        telemetry['speed'][lap_slice(telemetry, lap), lap.carIndex]
+    """
+    pkt_ids = packet_columns.pkt_id
+    start = int(np.searchsorted(pkt_ids, lap.startPktId, side='left'))
+    stop = int(np.searchsorted(pkt_ids, lap.endPktId, side='left'))
+    return slice(start, stop)
@@ -0,0 +1,49 @@
+"""Statistics of latencies in the order of microseconds to milliseconds, e.g. of packet reception or forwarding.
+
+Latencies are counted in a histogram with fixed bucket boundaries, so adding a latency takes constant time and
+memory. Percentiles are reported as the upper bound of the bucket that contains them.
+"""
+
+
+class LatencyStatistics:
+    """Statistics of a latency, kept as a histogram with fixed bucket boundaries."""
+
+    # Upper bounds of the histogram buckets, in microseconds. The last bucket is unbounded.
+    bucket_bounds = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * (len(self.bucket_bounds) + 1)
+
+    def add(self, latency_us: float):
+        self.count += 1
+        self.total += latency_us
+        if latency_us > self.maximum:
+            self.maximum = latency_us
+        for (index, bound) in enumerate(self.bucket_bounds):
+            if latency_us <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, fraction: float):
+        """Return the upper bound (in microseconds) of the bucket that contains the given percentile."""
+        threshold = fraction * self.count
+        cumulative = 0
+        for (index, bucket_count) in enumerate(self.buckets):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return self.bucket_bounds[index] if index < len(self.bucket_bounds) else self.maximum
+        return self.maximum
+
+    def summary(self):
+        if self.count == 0:
+            return "no packets"
+        return "{} packets, latency mean {:.1f} us, p50 <= {:.0f} us, p99 <= {:.0f} us, max {:.1f} us".format(
+            self.count, self.total / self.count, self.percentile(0.50), self.percentile(0.99), self.maximum)
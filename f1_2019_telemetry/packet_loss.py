@@ -0,0 +1,210 @@
+"""Detect lost telemetry packets, per packet type, from the packet headers.
+
+The F1 2019 game doesn't number its packets, but the 'sessionTime' and 'frameIdentifier' header fields allow us to
+detect gaps in the stream of packets of each type:
+
+* Packet types that are sent at a fixed, low rate (session, participants, car setups) have a known nominal interval.
+* Packet types that are sent at the menu-selected rate (motion, lap data, car telemetry, car status) have an interval
+  that is not known in advance; it is learned from the packets themselves.
+
+When the 'sessionTime' interval between two consecutive packets of the same type is a multiple of the expected
+interval, the packets in between are counted as lost. An interval that is not close to a multiple of the expected
+interval is counted as irregular. A 'frameIdentifier' increment that is much larger than usual is counted as a frame
+gap; a decreasing 'sessionTime' or 'frameIdentifier' (e.g., after a flashback) is counted as out-of-order.
+
+Event packets are only sent when an event occurs, so no gap detection is done for them.
+
+The PacketLossDetector only maintains cumulative counters, so it can be updated from one thread and reported on from
+another thread. Rolling loss percentages are computed from the differences between cumulative counters over time.
+"""
+
+import time
+import collections
+
+from .packets import PacketID
+
+# Snapshot of the cumulative counters of all packet types at a given (monotonic) time.
+_CounterSnapshot = collections.namedtuple('_CounterSnapshot', 'time, received, lost, kernel_drop_count')
+
+
+class PacketTypeLossStatistics:
+    """Cumulative loss statistics for a single packet type."""
+
+    # Relative deviation from a multiple of the expected interval that is still considered regular.
+    _tolerance = 0.25
+
+    # Smoothing factor for learning the expected interval of packets sent at the menu-selected rate.
+    _smoothing = 0.05
+
+    # A step back of more than this many seconds or frames is a rewind (a flashback), not a packet out of order.
+    _rewind_time = 1.0
+    _rewind_frames = 60
+
+    def __init__(self, packet_id):
+        self.packet_id = packet_id
+        self.received = 0
+        self.lost = 0
+        self.irregular = 0
+        self.frame_gaps = 0
+        self.out_of_order = 0
+
+        self.expected_interval = PacketID.fixed_interval.get(packet_id)
+        self._learn_interval = packet_id in PacketID.menu_rate_packets
+        self._expected_frame_step = None
+
+        self._last_session_time = None
+        self._last_frame_identifier = None
+
+    def restart(self):
+        """Forget the previous packet; called when a new session starts."""
+        self._last_session_time = None
+        self._last_frame_identifier = None
+
+    def update(self, session_time, frame_identifier):
+        """Account for a newly received packet with the given header fields."""
+        self.received += 1
+
+        last_session_time = self._last_session_time
+        last_frame_identifier = self._last_frame_identifier
+
+        if last_session_time is None:
+            self._last_session_time = session_time
+            self._last_frame_identifier = frame_identifier
+            return
+
+        dt = session_time - last_session_time
+        df = frame_identifier - last_frame_identifier
+
+        if dt < 0.0 or df < 0:
+            self.out_of_order += 1
+            if dt < -self._rewind_time or df < -self._rewind_frames:
+                # A rewind; continue from this packet.
+                self._last_session_time = session_time
+                self._last_frame_identifier = frame_identifier
+            # Otherwise, a single packet out of order; keep comparing to the most recent packet in order.
+            return
+
+        self._last_session_time = session_time
+        self._last_frame_identifier = frame_identifier
+
+        if df > 0:
+            if self._expected_frame_step is None or df < self._expected_frame_step:
+                self._expected_frame_step = df
+            elif df > 2 * self._expected_frame_step + 1:
+                self.frame_gaps += 1
+
+        if dt == 0.0:
+            # Same session time: the game is paused, or the packet was duplicated.
+            self.irregular += 1
+            return
+
+        expected_interval = self.expected_interval
+
+        if expected_interval is None:
+            if self._learn_interval:
+                self.expected_interval = dt
+            return
+
+        intervals = round(dt / expected_interval)
+
+        if intervals == 0 or abs(dt - intervals * expected_interval) > self._tolerance * expected_interval:
+            self.irregular += 1
+        elif intervals > 1:
+            self.lost += intervals - 1
+
+        if self._learn_interval:
+            if dt < (1.0 - self._tolerance) * expected_interval:
+                # The send rate went up (or our first estimate included a gap); restart learning from here.
+                self.expected_interval = dt
+            elif intervals == 1:
+                self.expected_interval += self._smoothing * (dt - expected_interval)
+
+    def loss_percentage(self):
+        """Cumulative percentage of lost packets."""
+        total = self.received + self.lost
+        return 100.0 * self.lost / total if total > 0 else 0.0
+
+
+class PacketLossDetector:
+    """The PacketLossDetector tracks lost and irregular packets for all packet types.
+
+    Args:
+        rolling_window: the duration (in seconds) over which rolling loss percentages are calculated.
+    """
+
+    def __init__(self, rolling_window: float = 10.0):
+        self._rolling_window = rolling_window
+        self.statistics = [PacketTypeLossStatistics(packet_id) for packet_id in PacketID]
+        self._sessionUID = None
+        self._snapshots = collections.deque()
+
+        # The cumulative number of datagrams dropped by the kernel, as reported by the socket (if supported).
+        self.kernel_drop_count = None
+
+    def update(self, header):
+        """Account for a newly received packet, given its header.
+
+        Any object with the sessionUID, packetId, sessionTime and frameIdentifier header fields will do, such as a
+        SessionPacket of the recorder.
+        """
+        if header.sessionUID != self._sessionUID:
+            # New session: the session time and frame identifier restart.
+            self._sessionUID = header.sessionUID
+            for statistics in self.statistics:
+                statistics.restart()
+        packet_id = header.packetId
+        if packet_id < len(self.statistics):
+            self.statistics[packet_id].update(header.sessionTime, header.frameIdentifier)
+
+    def _take_snapshot(self):
+        """Record the current cumulative counters and discard snapshots that fall outside of the rolling window."""
+        now = time.monotonic()
+        snapshot = _CounterSnapshot(now, [s.received for s in self.statistics], [s.lost for s in self.statistics], self.kernel_drop_count or 0)
+        self._snapshots.append(snapshot)
+        while len(self._snapshots) > 2 and self._snapshots[1].time <= now - self._rolling_window:
+            self._snapshots.popleft()
+        return snapshot
+
+    def rolling_loss(self):
+        """Return a (loss_percentages, kernel_drops) tuple over the rolling window.
+
+        The 'loss_percentages' is a dictionary mapping packet types to their loss percentage;
+        packet types that were not received in the window are omitted.
+
+        Rolling values are based on the snapshots taken by previous calls; call this method regularly,
+        from a single thread.
+        """
+        newest = self._take_snapshot()
+        oldest = self._snapshots[0]
+
+        loss_percentages = {}
+        for packet_id in PacketID:
+            received = newest.received[packet_id] - oldest.received[packet_id]
+            lost = newest.lost[packet_id] - oldest.lost[packet_id]
+            if received + lost > 0 and packet_id != PacketID.EVENT:
+                loss_percentages[packet_id] = 100.0 * lost / (received + lost)
+
+        kernel_drops = newest.kernel_drop_count - oldest.kernel_drop_count
+
+        return (loss_percentages, kernel_drops)
+
+    def report(self):
+        """Return a one-line description of the rolling loss percentages."""
+        (loss_percentages, kernel_drops) = self.rolling_loss()
+
+        if loss_percentages:
+            loss = ", ".join("{} {:.1f}%".format(PacketID.short_description[packet_id], percentage)
+                             for (packet_id, percentage) in loss_percentages.items())
+        else:
+            loss = "no packets"
+
+        irregular = sum(statistics.irregular for statistics in self.statistics)
+        out_of_order = sum(statistics.out_of_order for statistics in self.statistics)
+
+        if self.kernel_drop_count is None:
+            kernel = "kernel drops n/a"
+        else:
+            kernel = "kernel drops {} (total {})".format(kernel_drops, self.kernel_drop_count)
+
+        return "loss over {:.0f} s: {}; irregular {}, out-of-order {}; {}".format(
+            self._rolling_window, loss, irregular, out_of_order, kernel)
@@ -102,6 +102,24 @@ PacketID.long_description = {
     PacketID.CAR_STATUS    : 'Status data for all cars such as damage'
 }
 
+
+# The packet types that are sent at the 'UDP Send Rate' selected in the game's telemetry settings.
+# The other packet types are sent at a fixed, low rate, or only when an event occurs.
+PacketID.menu_rate_packets = frozenset({
+    PacketID.MOTION,
+    PacketID.LAP_DATA,
+    PacketID.CAR_TELEMETRY,
+    PacketID.CAR_STATUS
+})
+
+
+# The nominal interval (in seconds) between packets of the packet types that are sent at a fixed, low rate.
+PacketID.fixed_interval = {
+    PacketID.SESSION      : 0.5,
+    PacketID.PARTICIPANTS : 5.0,
+    PacketID.CAR_SETUPS   : 0.5
+}
+
 #########################################################
 #                                                       #
 #  __________  Packet ID 0 : MOTION PACKET  __________  #
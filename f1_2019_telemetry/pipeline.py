@@ -0,0 +1,501 @@
+"""A pipeline that receives telemetry packets once, and feeds them through processing stages to any number of sinks.
+
+Recording, monitoring and logging each need the same first steps: receive a datagram, check its header, and
+(usually) decode it. With a Pipeline, these steps are done once per datagram, however many sinks there are:
+
+    pipeline = Pipeline([ValidateStage()])
+    pipeline.add_sink(ThreadedSink(SQLiteSink()), [BatchStage(interval=1.0)])
+    pipeline.add_sink(CallbackSink(show_packets), [FilterStage([PacketID.LAP_DATA]), DecodeStage()])
+
+    receiver_thread = PipelineReceiverThread(pipeline, 20777)
+
+The f1-2019-telemetry-live script uses a pipeline to record and monitor a session from a single socket.
+
+Data flow
+---------
+
+Each received datagram is wrapped in a PipelinePacket, and travels through the pipeline in batches (lists) of
+PipelinePacket instances. The pipeline's own stages process every batch first; then, for each sink, the batch is
+processed by the sink's private stages and handed to the sink.
+
+Stages never copy or re-wrap a packet: they annotate the PipelinePacket in place and pass it on, or leave it out.
+The ValidateStage parses the header, and the DecodeStage decodes the packet; since PipelinePacket instances are
+shared between the branches of all sinks, a packet is decoded at most once, even if several sinks decode it.
+
+Stages and sinks run in the thread that feeds the pipeline, unless a sink is wrapped in a ThreadedSink, which
+hands batches to a worker thread. Slow sinks, such as the SQLiteSink, should be wrapped this way.
+
+The time spent in each stage and sink is measured; see Pipeline.report().
+"""
+
+import sys
+import time
+import queue
+import socket
+import logging
+import threading
+import selectors
+
+from .packets import PacketID
+from .sockets import MAX_PACKET_SIZE, bind_telemetry_socket, ANCILLARY_BUFFER_SIZE, enable_receive_overflow_counter, receive_overflow_count
+from .sockets import enable_kernel_timestamps, kernel_timestamp
+from .latency import LatencyStatistics
+from .recording import PacketRecorder, check_packet, make_session_packet
+
+
+class PipelinePacket:
+    """A received telemetry packet, annotated by the stages it passes through.
+
+    Attributes:
+        timestamp: the POSIX time of reception.
+        datagram: the raw packet.
+        header: the PacketHeader, set by the ValidateStage.
+        packet_type: the packet structure type, set by the ValidateStage.
+        packet: the decoded packet, set by the DecodeStage.
+    """
+
+    __slots__ = ('timestamp', 'datagram', 'header', 'packet_type', 'packet')
+
+    def __init__(self, timestamp: float, datagram: bytes):
+        self.timestamp = timestamp
+        self.datagram = datagram
+        self.header = None
+        self.packet_type = None
+        self.packet = None
+
+
+class PipelineStage:
+    """Base class of the pipeline stages.
+
+    A stage processes a batch (list) of PipelinePacket instances, and returns the batch of packets to pass on.
+    """
+
+    name = 'stage'
+
+    def __init__(self):
+        self.packet_count = 0
+        self.duration = 0.0
+
+    def process(self, batch):
+        raise NotImplementedError
+
+    def flush(self):
+        """Return any packets held back by the stage; called when the pipeline is flushed or closed."""
+        return []
+
+
+class ValidateStage(PipelineStage):
+    """Parses the header of each packet, and leaves out packets that are not valid telemetry packets.
+
+    The checks are those of the recorder; see f1_2019_telemetry.recording.check_packet.
+    """
+
+    name = 'validate'
+
+    def __init__(self):
+        super().__init__()
+        self.dropped_count = 0
+
+    def process(self, batch):
+        valid = []
+        for item in batch:
+            if item.header is None:
+                checked = check_packet(item.datagram)
+                if checked is None:
+                    self.dropped_count += 1
+                    continue
+                (item.header, item.packet_type) = checked
+            valid.append(item)
+        return valid
+
+
+class DecodeStage(PipelineStage):
+    """Decodes each packet, unless it was decoded before. Must come after a ValidateStage."""
+
+    name = 'decode'
+
+    def process(self, batch):
+        for item in batch:
+            if item.packet is None:
+                item.packet = item.packet_type.from_buffer_copy(item.datagram)
+        return batch
+
+
+class FilterStage(PipelineStage):
+    """Passes on only the packets with the given packet types, and/or for which 'predicate' returns True.
+
+    Must come after a ValidateStage; the predicate is called with the PipelinePacket.
+    """
+
+    name = 'filter'
+
+    def __init__(self, packet_ids=None, predicate=None):
+        super().__init__()
+        self._packet_ids = None if packet_ids is None else frozenset(packet_ids)
+        self._predicate = predicate
+
+    def process(self, batch):
+        if self._packet_ids is not None:
+            packet_ids = self._packet_ids
+            batch = [item for item in batch if item.header.packetId in packet_ids]
+        if self._predicate is not None:
+            batch = [item for item in batch if self._predicate(item)]
+        return batch
+
+
+class BatchStage(PipelineStage):
+    """Collects packets, and passes them on when 'max_size' packets are collected, or 'interval' seconds have passed.
+
+    The interval is only checked when the stage processes a batch; the PipelineReceiverThread makes sure that
+    this happens regularly, even if no packets arrive.
+    """
+
+    name = 'batch'
+
+    def __init__(self, max_size: int = None, interval: float = 1.0):
+        super().__init__()
+        self._max_size = max_size
+        self._interval = interval
+        self._collected = []
+        self._t_first = None
+
+    def process(self, batch):
+        if batch:
+            if not self._collected:
+                self._t_first = time.monotonic()
+            self._collected.extend(batch)
+        if not self._collected:
+            return []
+        if (self._max_size is not None and len(self._collected) >= self._max_size) or time.monotonic() - self._t_first >= self._interval:
+            return self.flush()
+        return []
+
+    def flush(self):
+        (collected, self._collected) = (self._collected, [])
+        return collected
+
+
+class PipelineSink:
+    """Base class of the pipeline sinks."""
+
+    name = 'sink'
+
+    def __init__(self):
+        self.packet_count = 0
+        self.duration = 0.0
+
+    def consume(self, batch):
+        raise NotImplementedError
+
+    def tick(self):
+        """Called regularly while no packets arrive, e.g. to act on timeouts."""
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteSink(PipelineSink):
+    """Records packets into SQLite3 session files with a PacketRecorder. Must come after a ValidateStage.
+
+    If 'catalog_path' is given, the entry of each file in that session catalog is updated when the file is closed.
+    If 'loss_detector' is given, it is updated with the recorded packets. If 'inactivity_timeout' is given, the open
+    file is closed when no packets arrive for that many seconds.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, filename_format: str = "F1_2019_{:s}.sqlite3", catalog_path=None, loss_detector=None, inactivity_timeout: float = None):
+        super().__init__()
+        self._recorder = PacketRecorder(loss_detector, filename_format=filename_format, catalog_path=catalog_path)
+        self._inactivity_timeout = inactivity_timeout
+        self._last_consume_time = None
+
+    def consume(self, batch):
+        self._recorder.process_session_packets([make_session_packet(item.timestamp, item.header, item.datagram) for item in batch])
+        self._last_consume_time = time.monotonic()
+
+    def tick(self):
+        if self._inactivity_timeout is not None and self._last_consume_time is not None:
+            age = time.monotonic() - self._last_consume_time
+            if age >= self._inactivity_timeout:
+                self._recorder.no_packets_received(age)
+                self._last_consume_time = None
+
+    def close(self):
+        self._recorder.close()
+
+
+class TextLogSink(PipelineSink):
+    """Writes a line per packet to a text file (e.g. sys.stdout). Must come after a ValidateStage."""
+
+    name = 'log'
+
+    def __init__(self, output=sys.stdout):
+        super().__init__()
+        self._output = output
+
+    def consume(self, batch):
+        self._output.write("".join("{:.6f} {:016x} frame {:6d} time {:10.3f} {:13s} {:4d} bytes\n".format(
+            item.timestamp, item.header.sessionUID, item.header.frameIdentifier, item.header.sessionTime,
+            PacketID(item.header.packetId).name, len(item.datagram)) for item in batch))
+        self._output.flush()
+
+
+class CallbackSink(PipelineSink):
+    """Calls 'callback' with each batch of PipelinePacket instances."""
+
+    name = 'callback'
+
+    def __init__(self, callback):
+        super().__init__()
+        self._callback = callback
+
+    def consume(self, batch):
+        self._callback(batch)
+
+
+class ThreadedSink(PipelineSink):
+    """Hands batches to another sink that runs in a worker thread, so the pipeline doesn't wait for it."""
+
+    def __init__(self, sink):
+        super().__init__()
+        self.sink = sink
+        self.name = "threaded {}".format(sink.name)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=sink.name)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                break
+            if not batch:
+                self.sink.tick()
+                continue
+            t1 = time.perf_counter()
+            self.sink.consume(batch)
+            self.sink.duration += time.perf_counter() - t1
+            self.sink.packet_count += len(batch)
+        self.sink.close()
+
+    def consume(self, batch):
+        self._queue.put(batch)
+
+    def tick(self):
+        # An empty batch asks the worker thread to tick the sink.
+        self._queue.put([])
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class Pipeline:
+    """Feeds batches of packets through the pipeline stages, to the sinks.
+
+    Args:
+        stages: the stages that process every batch before it is passed on to the sinks.
+    """
+
+    def __init__(self, stages=()):
+        self._stages = list(stages)
+        self._branches = []
+
+    def add_sink(self, sink, stages=()):
+        """Add a sink, preceded by its own stages."""
+        self._branches.append((list(stages), sink))
+
+    def process_datagram(self, timestamp: float, datagram: bytes):
+        """Process a single received datagram."""
+        self.process([PipelinePacket(timestamp, datagram)])
+
+    def process(self, batch):
+        """Process a batch of PipelinePacket instances."""
+        batch = self._run_stages(self._stages, batch, False)
+        for (stages, sink) in self._branches:
+            self._consume(sink, self._run_stages(stages, batch, False))
+
+    def tick(self):
+        """Called regularly while no packets arrive.
+
+        Processes an empty batch, so time-based stages (see BatchStage) can pass on packets; then ticks the sinks.
+        """
+        self.process([])
+        for (stages, sink) in self._branches:
+            sink.tick()
+
+    def flush(self):
+        """Pass on all packets held back by stages."""
+        batch = self._run_stages(self._stages, [], True)
+        for (stages, sink) in self._branches:
+            self._consume(sink, self._run_stages(stages, batch, True))
+
+    def close(self):
+        """Flush the pipeline, and close all sinks."""
+        self.flush()
+        for (stages, sink) in self._branches:
+            sink.close()
+
+    @staticmethod
+    def _run_stages(stages, batch, flush):
+        for stage in stages:
+            t1 = time.perf_counter()
+            if batch:
+                stage.packet_count += len(batch)
+            batch = stage.process(batch)
+            if flush:
+                batch = batch + stage.flush()
+            stage.duration += time.perf_counter() - t1
+        return batch
+
+    @staticmethod
+    def _consume(sink, batch):
+        if batch:
+            t1 = time.perf_counter()
+            sink.consume(batch)
+            sink.duration += time.perf_counter() - t1
+            sink.packet_count += len(batch)
+
+    def report(self):
+        """Return a multi-line string with the number of packets processed and the time spent, per stage and sink."""
+        lines = []
+
+        def add_line(indent, element):
+            per_packet = 1e6 * element.duration / element.packet_count if element.packet_count != 0 else 0.0
+            lines.append("{}{:20s} {:8d} packets {:10.3f} ms {:8.2f} us/packet".format(
+                indent, element.name, element.packet_count, 1e3 * element.duration, per_packet))
+
+        for stage in self._stages:
+            add_line("", stage)
+        for (stages, sink) in self._branches:
+            for stage in stages:
+                add_line("  ", stage)
+            add_line("  ", sink)
+            if isinstance(sink, ThreadedSink):
+                add_line("    ", sink.sink)
+        return "\n".join(lines)
+
+
+class PipelineReceiverThread(threading.Thread):
+    """The PipelineReceiverThread receives telemetry packets on a UDP port, and feeds them into a pipeline.
+
+    If 'hub_subscriber' is given, packets are received from the hub instead; the subscriber is not closed by the thread.
+
+    If 'loss_detector' is given and the platform supports it, its 'kernel_drop_count' is kept up to date with the
+    number of packets dropped by the kernel.
+
+    If 'kernel_timestamps' is True and the platform supports it (Linux only), packets are timestamped at reception
+    by the kernel, rather than when the thread reads them. The delay between the two is logged every
+    'latency_report_interval' seconds.
+
+    Every 'tick_interval' seconds without packets, the pipeline is ticked (see Pipeline.tick()). When the thread
+    stops, the pipeline is closed.
+    """
+
+    def __init__(self, pipeline, udp_port, hub_subscriber=None, loss_detector=None, kernel_timestamps=False,
+                 latency_report_interval: float = 1.0, tick_interval: float = 0.1):
+        super().__init__(name='pipeline')
+        self._pipeline = pipeline
+        self._udp_port = udp_port
+        self._hub_subscriber = hub_subscriber
+        self._loss_detector = loss_detector
+        self._kernel_timestamps = kernel_timestamps
+        self._latency_report_interval = latency_report_interval
+        self._tick_interval = tick_interval
+        self._socketpair = socket.socketpair()
+
+    def close(self):
+        for sock in self._socketpair:
+            sock.close()
+
+    def run(self):
+        """Receive incoming packets and feed them into the pipeline.
+
+        This method runs in its own thread.
+        """
+
+        hub_subscriber = self._hub_subscriber
+        loss_detector = self._loss_detector
+
+        if hub_subscriber is not None:
+            # Receive packets from the hub, rather than directly from the network.
+            udp_socket = hub_subscriber.socket
+            overflow_counter_enabled = False
+            kernel_timestamps_enabled = False
+            source = "hub {!r}".format(hub_subscriber.hub_path)
+        else:
+            # Accept UDP packets from any host.
+            udp_socket = bind_telemetry_socket(self._udp_port)
+
+            # If supported, have the kernel tell us how many packets it dropped.
+            overflow_counter_enabled = loss_detector is not None and enable_receive_overflow_counter(udp_socket)
+            if overflow_counter_enabled:
+                loss_detector.kernel_drop_count = 0
+
+            # If requested and supported, have the kernel timestamp the packets.
+            kernel_timestamps_enabled = self._kernel_timestamps and enable_kernel_timestamps(udp_socket)
+            if self._kernel_timestamps and not kernel_timestamps_enabled:
+                logging.warning("Kernel timestamps are not supported on this platform; using the time of reading packets instead.")
+            source = "UDP port {}".format(self._udp_port)
+
+        selector = selectors.DefaultSelector()
+
+        key_udp_socket = selector.register(udp_socket, selectors.EVENT_READ)
+        key_socketpair = selector.register(self._socketpair[0], selectors.EVENT_READ)
+
+        logging.info("Pipeline receiver thread started, reading packets from {}.".format(source))
+
+        pipeline = self._pipeline
+
+        receive_latencies = LatencyStatistics()
+        latency_report_time = time.monotonic() + self._latency_report_interval
+
+        quitflag = False
+        while not quitflag:
+            events = selector.select(self._tick_interval)
+            if not events:
+                pipeline.tick()
+            for (key, events) in events:
+                if key == key_udp_socket:
+                    timestamp = time.time()
+                    if overflow_counter_enabled or kernel_timestamps_enabled:
+                        (datagram, ancdata, flags, address) = udp_socket.recvmsg(MAX_PACKET_SIZE, ANCILLARY_BUFFER_SIZE)
+                        if overflow_counter_enabled:
+                            kernel_drop_count = receive_overflow_count(ancdata)
+                            if kernel_drop_count is not None:
+                                loss_detector.kernel_drop_count = kernel_drop_count
+                        if kernel_timestamps_enabled:
+                            packet_timestamp = kernel_timestamp(ancdata)
+                            if packet_timestamp is not None:
+                                receive_latencies.add((time.time() - packet_timestamp) * 1e6)
+                                timestamp = packet_timestamp
+                    else:
+                        datagram = udp_socket.recv(MAX_PACKET_SIZE)
+                    pipeline.process_datagram(timestamp, datagram)
+                elif key == key_socketpair:
+                    quitflag = True
+
+            if kernel_timestamps_enabled and time.monotonic() >= latency_report_time:
+                if receive_latencies.count != 0:
+                    logging.info("Kernel to receiver thread: {}.".format(receive_latencies.summary()))
+                    receive_latencies.reset()
+                latency_report_time = time.monotonic() + self._latency_report_interval
+
+        pipeline.close()
+
+        selector.close()
+        if hub_subscriber is None:
+            udp_socket.close()
+        for sock in self._socketpair:
+            sock.close()
+
+        logging.info("Pipeline receiver thread stopped.")
+
+    def request_quit(self):
+        """Request termination of the PipelineReceiverThread.
+
+        Called from the main thread to request that we quit.
+        """
+        self._socketpair[1].send(b'\x00')
@@ -0,0 +1,296 @@
+"""Record telemetry packets into SQLite3 session files.
+
+The PacketRecorder writes each session to its own SQLite3 file, with one row per packet in the 'packets' table.
+It is used by the recorder script, by the monitor for instant replays, by the asyncio API and by the pipeline's
+SQLiteSink.
+"""
+
+import time
+import sqlite3
+import logging
+import ctypes
+
+from collections import namedtuple
+
+from .packets import PacketHeader, PacketID, HeaderFieldsToPacketType, unpack_udp_packet
+from .catalog import update_catalog
+from .summary import SessionSummary, write_session_summary, format_session_summary
+
+# The type used to represent received telemetry packets, with the time of reception.
+TimestampedPacket = namedtuple('TimestampedPacket', 'timestamp, packet')
+
+# The type used to represent telemetry packets for storage in the 'packets' table of a session file.
+SessionPacket = namedtuple('SessionPacket', 'timestamp, packetFormat, gameMajorVersion, gameMinorVersion, packetVersion, packetId, sessionUID, sessionTime, frameIdentifier, playerCarIndex, packet')
+
+
+def check_packet(datagram: bytes):
+    """Check that 'datagram' is a telemetry packet of a known type, with the size of that type.
+
+    Return a (PacketHeader, packet type) tuple; or log an error and return None if the check fails.
+    """
+
+    if len(datagram) < ctypes.sizeof(PacketHeader):
+        logging.error("Dropped bad packet of size {} (too short).".format(len(datagram)))
+        return None
+
+    header = PacketHeader.from_buffer_copy(datagram)
+
+    packet_type_tuple = (header.packetFormat, header.packetVersion, header.packetId)
+
+    packet_type = HeaderFieldsToPacketType.get(packet_type_tuple)
+    if packet_type is None:
+        logging.error("Dropped unrecognized packet (format, version, id) = {!r}.".format(packet_type_tuple))
+        return None
+
+    if len(datagram) != ctypes.sizeof(packet_type):
+        logging.error("Dropped packet with unexpected size; "
+                      "(format, version, id) = {!r} packet, size = {}, expected {}.".format(
+                          packet_type_tuple, len(datagram), ctypes.sizeof(packet_type)))
+        return None
+
+    return (header, packet_type)
+
+
+def make_session_packet(timestamp: float, header, datagram: bytes) -> SessionPacket:
+    """Create an INSERT-able SessionPacket tuple for a checked packet, given its header."""
+
+    # NOTE: the sessionUID is not reliable at the start of a session (in F1 2018, need to check for F1 2019).
+    # See: http://forums.codemasters.com/discussion/138130/bug-f1-2018-pc-v1-0-4-udp-telemetry-bad-session-uid-in-first-few-packets-of-a-session
+
+    # Note that we convert the sessionUID to a 16-digit hex string here.
+    # SQLite3 can store 64-bit numbers, but only signed ones.
+    # To prevent any issues, we represent the sessionUID as a 16-digit hex string instead.
+
+    return SessionPacket(
+        timestamp,
+        header.packetFormat, header.gameMajorVersion, header.gameMinorVersion,
+        header.packetVersion, header.packetId, "{:016x}".format(header.sessionUID),
+        header.sessionTime, header.frameIdentifier, header.playerCarIndex,
+        datagram
+    )
+
+
+class PacketRecorder:
+    """The PacketRecorder records incoming packets to SQLite3 database files.
+
+    A single SQLite3 file stores packets from a single session.
+    Whenever a new session starts, any open file is closed, and a new database file is created.
+
+    The name of each file is made by formatting 'filename_format' with the session UID as a 16-digit hex string.
+
+    While recording, the recorder keeps a SessionSummary of the open file. The summary is written to the file's
+    'session_summary' table when the file is closed.
+
+    If 'catalog_path' is given, the entry of each file in that session catalog is updated when the file is closed.
+    """
+
+    # The SQLite3 query that creates the 'packets' table in the database file.
+    _create_packets_table_query = """
+        CREATE TABLE packets (
+            pkt_id            INTEGER  PRIMARY KEY, -- Alias for SQLite3's 'rowid'.
+            timestamp         REAL     NOT NULL,    -- The POSIX time right after capturing the telemetry packet.
+            packetFormat      INTEGER  NOT NULL,    -- Header field: packet format.
+            gameMajorVersion  INTEGER  NOT NULL,    -- Header field: game major version.
+            gameMinorVersion  INTEGER  NOT NULL,    -- Header field: game minor version.
+            packetVersion     INTEGER  NOT NULL,    -- Header field: packet version.
+            packetId          INTEGER  NOT NULL,    -- Header field: packet type ('packetId' is a bit of a misnomer).
+            sessionUID        CHAR(16) NOT NULL,    -- Header field: unique session id as hex string.
+            sessionTime       REAL     NOT NULL,    -- Header field: session time.
+            frameIdentifier   INTEGER  NOT NULL,    -- Header field: frame identifier.
+            playerCarIndex    INTEGER  NOT NULL,    -- Header field: player car index.
+            packet            BLOB     NOT NULL     -- The packet itself
+        );
+        """
+
+    # The SQLite3 query that inserts packet data into the 'packets' table of an open database file.
+    _insert_packets_query = """
+        INSERT INTO packets(
+            timestamp,
+            packetFormat, gameMajorVersion, gameMinorVersion, packetVersion, packetId, sessionUID,
+            sessionTime, frameIdentifier, playerCarIndex,
+            packet) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """
+
+    def __init__(self, loss_detector=None, filename_format="F1_2019_{:s}.sqlite3", catalog_path=None):
+        self._filename_format = filename_format
+        self._catalog_path = catalog_path
+        self._conn = None
+        self._cursor = None
+        self._filename = None
+        self._sessionUID = None
+        self._summary = None
+        self._loss_detector = loss_detector
+
+    def close(self):
+        """Make sure that no database remains open."""
+        if self._conn is not None:
+            self._close_database()
+
+    def _open_database(self, sessionUID: str):
+        """Open SQLite3 database file and make sure it has the correct schema."""
+        assert self._conn is None
+        filename = self._filename_format.format(sessionUID)
+        logging.info("Opening file {!r}.".format(filename))
+        conn = sqlite3.connect(filename)
+        cursor = conn.cursor()
+
+        # Get rid of indentation and superfluous newlines in the 'CREATE TABLE' command.
+        query = "".join(line[8:] + "\n" for line in PacketRecorder._create_packets_table_query.split("\n")[1:-1])
+
+        # Try to execute the 'CREATE TABLE' statement. If it already exists, this will raise an exception.
+        try:
+            cursor.execute(query)
+        except sqlite3.OperationalError:
+            logging.info("    (Appending to existing file.)")
+            # Continue the summary of the packets that are already in the file.
+            summary = SessionSummary.from_database(conn) or SessionSummary()
+        else:
+            logging.info("    (Created new file.)")
+            summary = SessionSummary()
+
+        self._conn = conn
+        self._cursor = cursor
+        self._filename = filename
+        self._sessionUID = sessionUID
+        self._summary = summary
+
+    def _close_database(self):
+        """Close SQLite3 database file."""
+        assert self._conn is not None
+        logging.info("Closing file {!r}.".format(self._filename))
+        t1 = time.monotonic()
+        try:
+            write_session_summary(self._conn, self._summary)
+        except sqlite3.Error as error:
+            logging.error("Unable to write session summary: {}".format(error))
+        else:
+            t2 = time.monotonic()
+            logging.info("Wrote session summary in {:.3f} ms: {}.".format((t2 - t1) * 1000.0, format_session_summary(self._summary.values())))
+        self._cursor.close()
+        self._cursor = None
+        self._conn.close()
+        self._conn = None
+        if self._catalog_path is not None:
+            try:
+                update_catalog(self._catalog_path, self._filename)
+            except (sqlite3.Error, OSError) as error:
+                logging.error("Unable to update catalog {!r}: {}".format(self._catalog_path, error))
+        self._filename = None
+        self._sessionUID = None
+        self._summary = None
+
+    def _insert_and_commit_same_session_packets(self, same_session_packets):
+        """Insert session packets to database and commit."""
+        assert self._conn is not None
+        for session_packet in same_session_packets:
+            self._summary.add_session_packet(session_packet)
+        self._cursor.executemany(PacketRecorder._insert_packets_query, same_session_packets)
+        self._conn.commit()
+
+    def _process_same_session_packets(self, same_session_packets):
+        """Insert packets from the same session into the 'packets' table of the appropriate database file.
+
+        Precondition: all packets in 'same_session_packets' are from the same session (identical 'sessionUID' field).
+
+        We need to handle four different cases:
+
+        (1) 'same_session_packets' is empty:
+
+            --> return (no-op).
+
+        (2) A database file is currently open, but it stores packets with a different session UID:
+
+            --> Close database;
+            --> Open database with correct session UID;
+            --> Insert 'same_session_packets'.
+
+        (3) No database file is currently open:
+
+            --> Open database with correct session UID;
+            --> Insert 'same_session_packets'.
+
+        (4) A database is currently open, with correct session UID:
+
+            --> Insert 'same_session_packets'.
+        """
+
+        if not same_session_packets:
+            # Nothing to insert.
+            return
+
+        if self._conn is not None and self._sessionUID != same_session_packets[0].sessionUID:
+            # Close database if it's recording a different session.
+            self._close_database()
+
+        if self._conn is None:
+            # Open database with the correct sessionID.
+            self._open_database(same_session_packets[0].sessionUID)
+
+        # Write packets.
+        self._insert_and_commit_same_session_packets(same_session_packets)
+
+    def process_incoming_packets(self, timestamped_packets):
+        """Process incoming packets by recording them into the correct database file.
+
+        The incoming 'timestamped_packets' is a list of timestamped raw UDP packets. Packets that are not valid
+        telemetry packets (see check_packet) are dropped; the others are converted to SessionPacket tuples and
+        recorded by the 'process_session_packets' method.
+        """
+        session_packets = []
+        for (timestamp, packet) in timestamped_packets:
+            checked = check_packet(packet)
+            if checked is not None:
+                (header, packet_type) = checked
+                session_packets.append(make_session_packet(timestamp, header, packet))
+        self.process_session_packets(session_packets)
+
+    def process_session_packets(self, session_packets):
+        """Record SessionPacket tuples, made from validated packets, into the correct database files.
+
+        We process them to a variable 'same_session_packets', which is a list of consecutive
+        packets having the same 'sessionUID' field.
+
+        The 'same_session_packets' are then passed on to the '_process_same_session_packets'
+        method that writes them into the appropriate database file.
+        """
+
+        t1 = time.monotonic()
+
+        # Invariant to be guaranteed: all packets in 'same_session_packets' have the same 'sessionUID' field.
+        same_session_packets = []
+
+        for session_packet in session_packets:
+
+            if self._loss_detector is not None:
+                self._loss_detector.update(session_packet)
+
+            if session_packet.packetId == PacketID.EVENT:  # Log Event packets
+                event_packet = unpack_udp_packet(session_packet.packet)
+                logging.info("Recording event packet: {}".format(event_packet.eventStringCode.decode()))
+
+            if len(same_session_packets) > 0 and same_session_packets[0].sessionUID != session_packet.sessionUID:
+                # Write 'same_session_packets' collected so far to the correct session database, then forget about them.
+                self._process_same_session_packets(same_session_packets)
+                same_session_packets = []
+
+            same_session_packets.append(session_packet)
+
+        # Write 'same_session_packets' to the correct session database.
+        self._process_same_session_packets(same_session_packets)
+
+        t2 = time.monotonic()
+
+        duration = (t2 - t1)
+
+        logging.info("Recorded {} packets in {:.3f} ms.".format(len(session_packets), duration * 1000.0))
+
+        if self._loss_detector is not None:
+            logging.info("Packet {}.".format(self._loss_detector.report()))
+
+    def no_packets_received(self, age: float) -> None:
+        """No packets were received for a considerable time. If a database file is open, close it."""
+        if self._conn is None:
+            logging.info("No packets to record for {:.3f} seconds.".format(age))
+        else:
+            logging.info("No packets to record for {:.3f} seconds; closing file due to inactivity.".format(age))
+            self._close_database()
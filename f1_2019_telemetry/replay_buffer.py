@@ -0,0 +1,73 @@
+"""A memory-bounded ring buffer of the most recently received raw telemetry packets, for instant replays.
+
+The ReplayBuffer keeps the raw datagrams of (at most) the last few minutes, so they can be written to a session file
+when something interesting happens -- without recording the entire session.
+
+All memory is allocated up front: a single bytearray with a fixed-size slot per packet, and arrays for the reception
+timestamps and packet lengths. Adding a packet copies it into the next slot, overwriting the oldest packet once the
+buffer is full; no objects are allocated per packet.
+
+The number of slots is the replay duration times the maximum packet rate. At a rate of 60 Hz, the game sends about
+250 packets per second for a 20-car session; each slot takes up the size of the largest packet type (1347 bytes).
+"""
+
+import array
+import ctypes
+
+from .packets import HeaderFieldsToPacketType
+
+# The slot size: the size of the largest telemetry packet type.
+REPLAY_SLOT_SIZE = max(ctypes.sizeof(packet_type) for packet_type in HeaderFieldsToPacketType.values())
+
+
+class ReplayBuffer:
+    """Keeps the raw telemetry packets received during the last 'duration' seconds.
+
+    Args:
+        duration: the replay duration, in seconds.
+        max_packet_rate: the maximum rate, in packets per second, for which the full duration is kept.
+            At higher rates, the oldest packets are overwritten sooner.
+    """
+
+    def __init__(self, duration: float, max_packet_rate: float = 300.0):
+        self.duration = duration
+        self.capacity = max(1, int(duration * max_packet_rate))
+        self._buffer = bytearray(self.capacity * REPLAY_SLOT_SIZE)
+        self._timestamps = array.array('d', bytes(8 * self.capacity))
+        self._lengths = array.array('H', bytes(2 * self.capacity))
+        self._next = 0
+        self._count = 0
+        self.oversized_count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timestamp: float, datagram):
+        """Store a raw packet, received at 'timestamp', overwriting the oldest packet if the buffer is full."""
+        size = len(datagram)
+        if size > REPLAY_SLOT_SIZE:
+            self.oversized_count += 1
+            return
+        index = self._next
+        offset = index * REPLAY_SLOT_SIZE
+        self._buffer[offset:offset + size] = datagram
+        self._timestamps[index] = timestamp
+        self._lengths[index] = size
+        self._next = index + 1 if index + 1 < self.capacity else 0
+        if self._count < self.capacity:
+            self._count += 1
+
+    def packets(self):
+        """Return the packets of the last 'duration' seconds, oldest first, as a list of (timestamp, packet) tuples.
+
+        The packets are copied, so the buffer can be added to while the returned packets are written elsewhere.
+        """
+        if self._count == 0:
+            return []
+        first = (self._next - self._count) % self.capacity
+        indices = [(first + i) % self.capacity for i in range(self._count)]
+        # At low packet rates, the buffer holds more than 'duration' seconds.
+        start_time = self._timestamps[indices[-1]] - self.duration
+        with memoryview(self._buffer) as view:
+            return [(self._timestamps[index], bytes(view[index * REPLAY_SLOT_SIZE:index * REPLAY_SLOT_SIZE + self._lengths[index]]))
+                    for index in indices if self._timestamps[index] >= start_time]
@@ -0,0 +1,159 @@
+"""Align the packet streams of a session onto a common time base.
+
+The game sends each packet type at its own rate: motion, lap data, car telemetry and car status packets at the rate
+chosen in the menus, session and car setup packets twice per second, participants packets every five seconds. The
+streams are only related by their 'sessionTime'. resample_session() takes the columns of a session as loaded by
+load_session(), and computes the value of every field at each time of a chosen time base:
+
+    session = load_session("F1_2019_0123456789abcdef.sqlite3")
+    resampled = resample_session(session, uniform_times(session, 20.0))
+    table = resampled.car_table(7)      # one column per field, one row per time, for car 7
+    table['speed'], table['tyresWear'], table['currentLapNum'], table['weather']
+
+Floating point fields are linearly interpolated between the packets before and after each time. Other fields (integers
+such as the gear or the lap number, and names) take the value of the last packet at or before each time, i.e. an
+'as-of' join. Times before the first packet of a type take that packet's values; times after the last packet take the
+last packet's values.
+
+The interpolation positions and weights are computed once per packet type, and then applied to all fields and all
+20 cars of that packet type in a single vectorized operation per field.
+
+If the session time goes back (after a flashback), the packets that were superseded by the rewind are discarded, so
+each stream has strictly increasing times.
+
+This module requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import collections
+
+import numpy as np
+
+from .packets import PacketID
+
+# Columns that are not resampled: the header fields and the recorder's columns.
+_EXCLUDED_COLUMNS = frozenset(('pkt_id', 'timestamp', 'packetFormat', 'gameMajorVersion', 'gameMinorVersion', 'packetVersion',
+                               'packetId', 'sessionUID', 'sessionTime', 'frameIdentifier', 'playerCarIndex'))
+
+# The packet types that are resampled by default. Event packets are not a stream; they are left out.
+DEFAULT_PACKET_IDS = (PacketID.MOTION, PacketID.SESSION, PacketID.LAP_DATA, PacketID.PARTICIPANTS,
+                      PacketID.CAR_SETUPS, PacketID.CAR_TELEMETRY, PacketID.CAR_STATUS)
+
+_NUM_CARS = 20
+
+
+def _current_rows(times):
+    """Return the indices of the packets that were not superseded by a rewind of the session time."""
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) == 0:
+        return np.arange(0)
+    # A packet is kept if its time is before the times of all later packets.
+    later_minimum = np.minimum.accumulate(times[::-1])[::-1]
+    keep = np.empty(len(times), dtype=bool)
+    keep[:-1] = times[:-1] < later_minimum[1:]
+    keep[-1] = True
+    return np.flatnonzero(keep)
+
+
+def packet_times(session, packet_id=PacketID.MOTION):
+    """Return the session times of the packets of a type, for use as a time base; rewinds are removed."""
+    times = np.asarray(session[packet_id].time, dtype=np.float64)
+    return times[_current_rows(times)]
+
+
+def uniform_times(session, rate: float):
+    """Return a time base of 'rate' times per second, spanning the session times of all packets of the session."""
+    starts = [float(np.min(session[packet_id].time)) for packet_id in session.keys() if len(session[packet_id]) != 0]
+    ends = [float(np.max(session[packet_id].time)) for packet_id in session.keys() if len(session[packet_id]) != 0]
+    if not starts:
+        return np.arange(0.0)
+    return np.arange(min(starts), max(ends), 1.0 / rate)
+
+
+class ResampledSession:
+    """The fields of a session, resampled onto a time base.
+
+    Attributes:
+        times: the session times of the time base, shape (n_times, ).
+        columns: a dict that maps field names to arrays with a first dimension of n_times. Per-car fields have a
+            second dimension of 20 cars.
+    """
+
+    def __init__(self, times, columns):
+        self.times = times
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def keys(self):
+        return self.columns.keys()
+
+    def car_table(self, car_index: int):
+        """Return the fields of a single car as an ordered dict of columns, starting with 'sessionTime'.
+
+        Per-car fields are given for the car; fields that are common to all cars are included as they are.
+        """
+        table = collections.OrderedDict(sessionTime=self.times)
+        for (name, column) in self.columns.items():
+            if column.ndim >= 2 and column.shape[1] == _NUM_CARS:
+                table[name] = column[:, car_index]
+            else:
+                table[name] = column
+        return table
+
+
+def _interpolation(source_times, times):
+    """Return the (before, after, weight) arrays that interpolate samples at 'source_times' to 'times'."""
+    after = np.searchsorted(source_times, times, side='right')
+    before = np.clip(after - 1, 0, len(source_times) - 1)
+    after = np.clip(after, 0, len(source_times) - 1)
+    span = source_times[after] - source_times[before]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(span > 0.0, (times - source_times[before]) / span, 0.0)
+    return (before, after, np.clip(weight, 0.0, 1.0))
+
+
+def resample_session(session, times, packet_ids=DEFAULT_PACKET_IDS, fields=None) -> ResampledSession:
+    """Resample the fields of a session onto a time base.
+
+    Args:
+        session: a SessionData instance, as returned by load_session().
+        times: the session times to resample to, in increasing order (see packet_times() and uniform_times()).
+        packet_ids: the packet types whose fields are resampled.
+        fields: if given, only these fields are resampled.
+
+    Returns:
+        A ResampledSession instance.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    wanted = set(fields) if fields is not None else None
+
+    columns = collections.OrderedDict()
+    for packet_id in packet_ids:
+        if packet_id not in session:
+            continue
+        packet_columns = session[packet_id]
+        names = [name for name in packet_columns.keys() if name not in _EXCLUDED_COLUMNS and (wanted is None or name in wanted)]
+        if not names or len(packet_columns) == 0:
+            continue
+
+        rows = _current_rows(packet_columns.time)
+        source_times = np.asarray(packet_columns.time, dtype=np.float64)[rows]
+        (before, after, weight) = _interpolation(source_times, times)
+
+        for name in names:
+            values = np.asarray(packet_columns[name])[rows]
+            if values.dtype.kind == 'f':
+                # Linear interpolation, broadcast over the cars and any further dimensions.
+                w = weight.reshape((-1, ) + (1, ) * (values.ndim - 1))
+                columns[name] = values[before] * (1.0 - w) + values[after] * w
+            else:
+                # As-of: the value of the last packet at or before each time.
+                columns[name] = values[before]
+
+    if wanted is not None:
+        missing = wanted.difference(columns)
+        if missing:
+            raise KeyError("Unknown fields: {}.".format(", ".join(sorted(missing))))
+
+    return ResampledSession(times, columns)
@@ -0,0 +1,359 @@
+"""Load a recorded session file as columnar NumPy arrays, one set of columns per packet type.
+
+Analysis of a session usually needs a few fields of many packets, e.g. the speed of all cars over the whole session.
+Decoding the packets one by one with unpack_udp_packet() is slow; load_session() instead decodes all packets of a
+type in one go, using a NumPy structured dtype that is derived from the packet's ctypes structure, and splits the
+result into contiguous columns:
+
+    session = load_session("F1_2019_0123456789abcdef.sqlite3")
+    telemetry = session[PacketID.CAR_TELEMETRY]
+    telemetry.time                   # sessionTime, shape (n_packets,)
+    telemetry['speed']               # shape (n_packets, 20)
+    telemetry['tyresPressure']       # shape (n_packets, 20, 4)
+
+Column names
+------------
+
+Each packet type has the columns 'pkt_id' (the packet's row id in the session file, in increasing order),
+'timestamp' (the recorder's timestamp) and the header fields (e.g. 'sessionTime', 'frameIdentifier'). The fields of
+the per-car array of the packet type (e.g. the 'lapData' array of lap data packets) are columns with the field's own
+name and a second dimension of 20 cars. Other fields keep their name; fields of other nested structures get a dotted
+name (e.g. 'marshalZones.zoneStart'). Character arrays (such as the participants' 'name') become NumPy bytes arrays.
+
+Cache
+-----
+
+The first load of a session stores the columns as .npy files in a sidecar directory next to the session file
+(the session file name with '.cache' appended). Later loads memory-map these files, which is nearly instantaneous.
+The cache is rebuilt if the session file's modification time or size changed since the cache was written.
+
+A cache is written to a temporary directory first, which then replaces the previous cache directory; a concurrent
+load of the session keeps its memory maps of the previous cache, or finds no cache at all and reads the file.
+
+This module requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import os
+import json
+import uuid
+import shutil
+import logging
+import ctypes
+
+import numpy as np
+
+from .packets import PacketID, HeaderFieldsToPacketType
+from .sqlite_utils import connect_read_only
+
+# Bumped whenever the cache layout changes, to invalidate existing caches.
+_CACHE_VERSION = 2
+
+_CACHE_INDEX_FILENAME = "index.json"
+
+# The number of cars in the per-car arrays of the packets.
+_NUM_CARS = 20
+
+# The number of bytes of raw packets of a type that are collected before they are decoded.
+_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class PacketColumns:
+    """The columns of all packets of a single type in a session, as a mapping from column name to NumPy array.
+
+    Attributes:
+        packet_id: the PacketID of the packet type.
+        columns: a dict that maps column names to arrays; all arrays have the same length.
+    """
+
+    def __init__(self, packet_id, columns):
+        self.packet_id = packet_id
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['timestamp'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        return self.columns.keys()
+
+    @property
+    def pkt_id(self):
+        return self.columns['pkt_id']
+
+    @property
+    def timestamp(self):
+        return self.columns['timestamp']
+
+    @property
+    def time(self):
+        return self.columns['sessionTime']
+
+    @property
+    def frame(self):
+        return self.columns['frameIdentifier']
+
+
+class SessionData:
+    """The columns of all packet types in a session, as a mapping from PacketID to PacketColumns.
+
+    Packet types that don't occur in the session are absent.
+    """
+
+    def __init__(self, path, packet_columns):
+        self.path = path
+        self.packet_columns = packet_columns
+
+    def __getitem__(self, packet_id):
+        return self.packet_columns[PacketID(packet_id)]
+
+    def __contains__(self, packet_id):
+        return packet_id in self.packet_columns
+
+    def get(self, packet_id, default=None):
+        return self.packet_columns.get(packet_id, default)
+
+    def keys(self):
+        return self.packet_columns.keys()
+
+
+def packet_dtype(packet_type):
+    """Return the NumPy structured dtype that corresponds to a ctypes packet structure type."""
+    dtype = np.dtype(packet_type)
+    assert dtype.itemsize == ctypes.sizeof(packet_type)
+    return dtype
+
+
+def _add_columns(columns, array, prefix=""):
+    """Add the fields of a structured array to 'columns', flattening nested structures."""
+    for name in array.dtype.names:
+        field = array[name]
+        if field.dtype.names is not None:
+            is_header = (name == 'header')
+            is_car_array = (field.ndim == 2 and field.shape[1] == _NUM_CARS)
+            _add_columns(columns, field, "" if is_header or is_car_array else prefix + name + ".")
+            continue
+        column_name = prefix + name
+        if column_name in columns:
+            raise RuntimeError("Duplicate column name {!r}.".format(column_name))
+        if field.dtype == np.dtype('S1') and field.ndim > 1:
+            # A character array; turn its last dimension into a bytes string.
+            field = np.ascontiguousarray(field).view('S{}'.format(field.shape[-1]))[..., 0]
+        columns[column_name] = np.ascontiguousarray(field)
+
+
+class _PacketColumnsBuilder:
+    """Collects the raw packets of one packet type, and decodes them into columns, one chunk at a time.
+
+    At most one chunk of raw packets is held in memory; decoded chunks are concatenated into columns by finish().
+    """
+
+    def __init__(self, packet_id, packet_type):
+        self.packet_id = packet_id
+        self.dtype = packet_dtype(packet_type)
+        self.packet_size = self.dtype.itemsize
+        self._chunk_length = max(1, _CHUNK_SIZE // self.packet_size)
+        self._buffer = bytearray()
+        self._pkt_ids = []
+        self._timestamps = []
+        self._pieces = []
+
+    def add(self, pkt_id, timestamp, packet):
+        """Add a raw packet of the right size."""
+        self._buffer += packet
+        self._pkt_ids.append(pkt_id)
+        self._timestamps.append(timestamp)
+        if len(self._pkt_ids) == self._chunk_length:
+            self._decode_chunk()
+
+    def _decode_chunk(self):
+        if self._pkt_ids:
+            records = np.frombuffer(self._buffer, dtype=self.dtype)
+            columns = {'pkt_id': np.array(self._pkt_ids, dtype=np.int64), 'timestamp': np.array(self._timestamps, dtype=np.float64)}
+            _add_columns(columns, records)
+            self._pieces.append(columns)
+        # The columns of a single packet are views of the buffer rather than copies; start a new buffer.
+        self._buffer = bytearray()
+        self._pkt_ids = []
+        self._timestamps = []
+
+    def finish(self):
+        """Return the PacketColumns of all packets added, or None if no packets were added."""
+        self._decode_chunk()
+        (pieces, self._pieces) = (self._pieces, [])
+        if not pieces:
+            return None
+        columns = {}
+        for name in list(pieces[0]):
+            # Concatenate one column at a time, releasing its pieces right away.
+            parts = [piece.pop(name) for piece in pieces]
+            columns[name] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return PacketColumns(self.packet_id, columns)
+
+
+def source_signature(path):
+    """Return the signature of a session file that its cache is checked against."""
+    stat = os.stat(path)
+    return {'version': _CACHE_VERSION, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def cache_path(path):
+    """Return the path of the sidecar cache directory of a session file."""
+    return path + ".cache"
+
+
+def _read_cache_index(path):
+    """Return the index of the cache of a session file, or None if there's no valid cache."""
+    try:
+        with open(os.path.join(cache_path(path), _CACHE_INDEX_FILENAME)) as fi:
+            index = json.load(fi)
+    except (OSError, ValueError):
+        return None
+    if index.get('source') != source_signature(path):
+        return None
+    return index
+
+
+def _load_cache(path):
+    """Return the SessionData from the cache of a session file, memory-mapped; or None if there's no valid cache."""
+    index = _read_cache_index(path)
+    if index is None:
+        return None
+
+    directory = cache_path(path)
+    try:
+        packet_columns = {}
+        for (packet_id_name, column_names) in index['columns'].items():
+            packet_id = PacketID[packet_id_name]
+            columns = {name: np.load(os.path.join(directory, "{}.{}.npy".format(packet_id_name, name)), mmap_mode='r') for name in column_names}
+            packet_columns[packet_id] = PacketColumns(packet_id, columns)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return SessionData(path, packet_columns)
+
+
+def cache_is_current(path):
+    """Return True if a session file has a valid cache."""
+    return _read_cache_index(path) is not None
+
+
+def write_cache(path, session, signature):
+    """Write the columns of a session to a new cache directory, which then replaces the previous one.
+
+    The 'signature' is the source_signature() of the session file, taken before the session was read.
+    """
+    directory = cache_path(path)
+    temporary_directory = "{}.{}.tmp".format(directory, uuid.uuid4().hex)
+    os.makedirs(temporary_directory)
+
+    try:
+        index = {'source': signature, 'columns': {}}
+        for (packet_id, packet_columns) in session.packet_columns.items():
+            for (name, column) in packet_columns.columns.items():
+                np.save(os.path.join(temporary_directory, "{}.{}.npy".format(packet_id.name, name)), column)
+            index['columns'][packet_id.name] = list(packet_columns.columns)
+
+        with open(os.path.join(temporary_directory, _CACHE_INDEX_FILENAME), "w") as fo:
+            json.dump(index, fo)
+
+        # A directory can't replace a non-empty directory; move the previous cache out of the way first. Its files
+        # are only removed after the new cache is in place, and stay valid for anyone who memory-mapped them.
+        previous_directory = None
+        if os.path.isdir(directory):
+            previous_directory = temporary_directory + ".old"
+            os.replace(directory, previous_directory)
+        os.replace(temporary_directory, directory)
+    except BaseException:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+        raise
+
+    if previous_directory is not None:
+        shutil.rmtree(previous_directory, ignore_errors=True)
+
+
+def read_session(path: str, pkt_id_range=None) -> SessionData:
+    """Read and decode a session file (or the packets in a half-open pkt_id range of it), bypassing the cache.
+
+    The packets are read in a single pass in pkt_id order, and decoded per packet type in chunks.
+    """
+
+    # The recorder only stores packets of known types; use the most recent packet version if there are several.
+    latest_keys = {}
+    for key in sorted(HeaderFieldsToPacketType):
+        latest_keys[key[2]] = key
+    builders = {key: _PacketColumnsBuilder(PacketID(key[2]), HeaderFieldsToPacketType[key]) for key in latest_keys.values()}
+
+    query = "SELECT pkt_id, timestamp, packetFormat, packetVersion, packetId, packet FROM packets"
+    parameters = ()
+    if pkt_id_range is not None:
+        query += " WHERE pkt_id >= ? AND pkt_id < ?"
+        parameters = tuple(pkt_id_range)
+
+    conn = connect_read_only(path)
+    try:
+        cursor = conn.execute(query + " ORDER BY pkt_id;", parameters)
+        for (pkt_id, timestamp, packet_format, packet_version, packet_id, packet) in cursor:
+            builder = builders.get((packet_format, packet_version, packet_id))
+            if builder is not None and len(packet) == builder.packet_size:
+                builder.add(pkt_id, timestamp, packet)
+        cursor.close()
+    finally:
+        conn.close()
+
+    packet_columns = {}
+    for builder in sorted(builders.values(), key=lambda builder: builder.packet_id):
+        columns = builder.finish()
+        if columns is not None:
+            packet_columns[builder.packet_id] = columns
+    return SessionData(path, packet_columns)
+
+
+def concatenate_sessions(sessions) -> SessionData:
+    """Concatenate the columns of parts of the same session file, read with read_session() in pkt_id order."""
+    sessions = list(sessions)
+    packet_columns = {}
+    for packet_id in PacketID:
+        parts = [session.packet_columns[packet_id] for session in sessions if packet_id in session.packet_columns]
+        if parts:
+            columns = {name: np.concatenate([part.columns[name] for part in parts]) for name in parts[0].columns}
+            packet_columns[packet_id] = PacketColumns(packet_id, columns)
+    return SessionData(sessions[0].path, packet_columns)
+
+
+def load_session(path: str, cache: bool = True) -> SessionData:
+    """Load a session file as columnar arrays per packet type.
+
+    Args:
+        path: the path of the session file, as written by the recorder.
+        cache: if True, use the sidecar cache if it is valid, and (re)build it otherwise.
+
+    Returns:
+        A SessionData instance. Arrays loaded from the cache are read-only memory maps.
+    """
+    if cache:
+        session = _load_cache(path)
+        if session is not None:
+            return session
+
+    # Take the signature before reading, so a file that changes while we read it is not cached as up-to-date.
+    signature = source_signature(path)
+
+    session = read_session(path)
+
+    if cache:
+        try:
+            write_cache(path, session, signature)
+        except OSError as error:
+            logging.warning("Unable to write cache for {!r}: {}".format(path, error))
+        else:
+            # Return the memory-mapped columns, so the in-memory copies can be released.
+            cached_session = _load_cache(path)
+            if cached_session is not None:
+                return cached_session
+
+    return session
@@ -0,0 +1,236 @@
+"""Share the latest telemetry packet of each type with local readers through a shared memory block.
+
+Programs like overlays and dashboards usually only need the most recent values. Rather than receiving and decoding
+the full UDP stream themselves, they can attach to a shared memory block that is kept up-to-date by a single writer
+(e.g. the f1-2019-telemetry-hub script, when started with the --shared-memory option). Readers poll the block at
+their own rate, without any socket I/O.
+
+Layout
+------
+
+The block starts with a 16-byte header: the magic bytes b"F119", a 32-bit layout version, and a 64-bit count of
+updates. It is followed by one slot per packet type, in PacketID order. Each slot consists of a 64-bit sequence
+number, a 32-bit packet length, the 32-bit CRC-32 of the packet, and room for the largest packet of that type.
+
+Sequence lock
+-------------
+
+Each slot is protected by a sequence lock. The writer increments the slot's sequence number before it starts
+changing the slot (making it odd), and again when it is done (making it even again). A reader copies the packet
+and then checks that the sequence number was even, and unchanged, throughout; if not, it tries again. The writer
+never waits for readers, and readers never block each other or the writer. A reader that has to retry yields the
+CPU, with an increasing delay, so it doesn't compete with the writer it is waiting for.
+
+The 64-bit sequence numbers are naturally aligned, so they are read and written as a whole. On x86 and x86-64,
+stores become visible to other processes in program order, and the sequence check alone is sufficient. Other
+processors (e.g. ARM, including Apple Silicon) may make the stores visible in a different order, so a reader could
+see an unchanged, even sequence number around a copy that is still partly old. Python offers no memory barriers, so
+the writer also stores the CRC-32 of the packet in the slot, and a reader only accepts a copy whose CRC-32 matches.
+A torn copy is then detected, and retried, like any other concurrent update.
+
+Slots are independent: a snapshot holds a consistent copy of each packet, but the packets of different types in a
+snapshot may have been written at slightly different times, just like they arrive at different times from the game.
+
+The multiprocessing.shared_memory module requires Python 3.8 or later.
+"""
+
+import sys
+import time
+import zlib
+import ctypes
+import logging
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Before Python 3.8; the module can be imported (e.g. for DEFAULT_SHARED_STATE_NAME), but the classes can't be used.
+    shared_memory = None
+
+from .packets import PacketHeader, PacketID, HeaderFieldsToPacketType, unpack_udp_packet
+
+# The default name of the shared memory block.
+DEFAULT_SHARED_STATE_NAME = "f1-2019-telemetry-state"
+
+_MAGIC = b"F119"
+_LAYOUT_VERSION = 2
+
+# Size of the block header, and of the fixed part of each slot.
+_HEADER_SIZE = 16
+_SLOT_HEADER_SIZE = 16
+
+# The maximum packet size per packet type; slots are padded to a multiple of 8 bytes, to keep sequence numbers aligned.
+_MAX_PACKET_SIZES = [max(ctypes.sizeof(packet_type) for ((packet_format, packet_version, packet_id), packet_type) in HeaderFieldsToPacketType.items()
+                         if packet_id == pid) for pid in PacketID]
+
+_SLOT_OFFSETS = []
+_offset = _HEADER_SIZE
+for _max_packet_size in _MAX_PACKET_SIZES:
+    _SLOT_OFFSETS.append(_offset)
+    _offset += _SLOT_HEADER_SIZE + (_max_packet_size + 7) // 8 * 8
+
+SHARED_STATE_SIZE = _offset
+
+del _offset, _max_packet_size
+
+
+class SharedStateError(Exception):
+    pass
+
+
+def _attach(name):
+    """Attach to an existing shared memory block without taking ownership of it.
+
+    Before Python 3.13, attaching registers the block with the resource tracker, which then unlinks it when the
+    attaching process exits -- pulling it away from the writer and all other readers. We undo the registration.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedStateWriter:
+    """Keeps the latest raw telemetry packet of each type in a shared memory block.
+
+    Only a single writer should exist for a given name. A stale block that was left behind by a writer that didn't
+    exit cleanly is replaced.
+    """
+
+    def __init__(self, name: str = DEFAULT_SHARED_STATE_NAME):
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=SHARED_STATE_SIZE)
+        except FileExistsError:
+            logging.warning("Replacing stale shared memory block {!r}.".format(name))
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name, create=True, size=SHARED_STATE_SIZE)
+
+        self.name = name
+        buf = self._shm.buf
+        buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+        self._update_count = ctypes.c_uint64.from_buffer(buf, 8)
+        self._sequences = [ctypes.c_uint64.from_buffer(buf, offset) for offset in _SLOT_OFFSETS]
+        self._lengths = [ctypes.c_uint32.from_buffer(buf, offset + 8) for offset in _SLOT_OFFSETS]
+        self._checksums = [ctypes.c_uint32.from_buffer(buf, offset + 12) for offset in _SLOT_OFFSETS]
+        for (sequence, length, checksum) in zip(self._sequences, self._lengths, self._checksums):
+            sequence.value = 0
+            length.value = 0
+            checksum.value = 0
+        ctypes.c_uint32.from_buffer(buf, 4).value = _LAYOUT_VERSION
+        # Write the magic last: readers refuse to attach to the block until it is fully initialized.
+        buf[:4] = _MAGIC
+
+    def update(self, datagram) -> bool:
+        """Store a raw telemetry packet as the latest packet of its type. Return False if the datagram was ignored."""
+        size = len(datagram)
+        if size < ctypes.sizeof(PacketHeader):
+            return False
+        packet_id = datagram[PacketHeader.packetId.offset]
+        if packet_id >= len(_SLOT_OFFSETS) or size > _MAX_PACKET_SIZES[packet_id]:
+            return False
+
+        sequence = self._sequences[packet_id]
+        data_offset = _SLOT_OFFSETS[packet_id] + _SLOT_HEADER_SIZE
+
+        sequence.value += 1
+        self._shm.buf[data_offset:data_offset + size] = datagram
+        self._lengths[packet_id].value = size
+        self._checksums[packet_id].value = zlib.crc32(datagram)
+        sequence.value += 1
+
+        self._update_count.value += 1
+        return True
+
+    def close(self):
+        """Release and remove the shared memory block."""
+        # The ctypes views must be released before the block can be closed.
+        del self._update_count, self._sequences, self._lengths, self._checksums
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedStateReader:
+    """Reads consistent copies of the latest telemetry packets from a shared memory block maintained by a writer.
+
+    Raises FileNotFoundError if the block doesn't exist, and SharedStateError if it isn't (yet) a valid block.
+    """
+
+    # The time (in seconds) to keep retrying to read a slot before giving up; a single retry almost always suffices.
+    timeout = 0.1
+
+    # The maximum delay (in seconds) between two attempts to read a slot.
+    max_retry_delay = 0.001
+
+    def __init__(self, name: str = DEFAULT_SHARED_STATE_NAME):
+        self._shm = _attach(name)
+        self.name = name
+        buf = self._shm.buf
+        if len(buf) < SHARED_STATE_SIZE or bytes(buf[:4]) != _MAGIC or ctypes.c_uint32.from_buffer(buf, 4).value != _LAYOUT_VERSION:
+            self._shm.close()
+            raise SharedStateError("Shared memory block {!r} is not a telemetry state block with layout version {}.".format(name, _LAYOUT_VERSION))
+        self._update_count = ctypes.c_uint64.from_buffer(buf, 8)
+        self._sequences = [ctypes.c_uint64.from_buffer(buf, offset) for offset in _SLOT_OFFSETS]
+        self._lengths = [ctypes.c_uint32.from_buffer(buf, offset + 8) for offset in _SLOT_OFFSETS]
+        self._checksums = [ctypes.c_uint32.from_buffer(buf, offset + 12) for offset in _SLOT_OFFSETS]
+
+    def close(self):
+        """Detach from the shared memory block; the block itself is left alone."""
+        del self._update_count, self._sequences, self._lengths, self._checksums
+        self._shm.close()
+
+    @property
+    def update_count(self) -> int:
+        """The total number of packets stored by the writer; can be polled cheaply to see if anything changed."""
+        return self._update_count.value
+
+    def sequence(self, packet_id: PacketID) -> int:
+        """Return the sequence number of a slot; it changes whenever a new packet of that type is stored."""
+        return self._sequences[packet_id].value
+
+    def read(self, packet_id: PacketID):
+        """Return a consistent copy of the latest raw packet of the given type, or None if there is none (yet).
+
+        Raises SharedStateError if no consistent copy could be made within 'timeout' seconds, which only happens if
+        the writer is updating the slot continuously, or died while updating it.
+        """
+        sequence = self._sequences[packet_id]
+        length = self._lengths[packet_id]
+        checksum = self._checksums[packet_id]
+        max_packet_size = _MAX_PACKET_SIZES[packet_id]
+        data_offset = _SLOT_OFFSETS[packet_id] + _SLOT_HEADER_SIZE
+        buf = self._shm.buf
+
+        deadline = None
+        delay = 0.0
+        while True:
+            before = sequence.value
+            if before == 0:
+                return None
+            if not before & 1:
+                size = length.value
+                expected_checksum = checksum.value
+                if size <= max_packet_size:
+                    datagram = bytes(buf[data_offset:data_offset + size])
+                    # The checksum catches copies that are torn despite the sequence check (see the module docstring).
+                    if sequence.value == before and zlib.crc32(datagram) == expected_checksum:
+                        return datagram
+
+            # The writer is updating the slot. Give it the CPU (the first time just by yielding), then try again.
+            if deadline is None:
+                deadline = time.monotonic() + self.timeout
+            elif time.monotonic() >= deadline:
+                raise SharedStateError("Unable to read a consistent {} packet within {:.3f} seconds.".format(PacketID(packet_id).name, self.timeout))
+            time.sleep(delay)
+            delay = min(2.0 * delay + 1e-6, self.max_retry_delay)
+
+    def packet(self, packet_id: PacketID):
+        """Return the latest packet of the given type as a telemetry packet structure, or None if there is none (yet)."""
+        datagram = self.read(packet_id)
+        return None if datagram is None else unpack_udp_packet(datagram)
+
+    def snapshot(self):
+        """Return a list of the latest raw packets, indexed by PacketID; entries are None for types not seen yet."""
+        return [self.read(packet_id) for packet_id in PacketID]
@@ -0,0 +1,101 @@
+"""Socket-level support for receiving F1 2019 telemetry packets.
+
+The bind_telemetry_socket() function creates the UDP socket on which telemetry packets are received, in the same way
+for all tools in the package.
+
+On Linux, the kernel can report the number of datagrams it had to drop because the socket's receive buffer was full.
+This is enabled with the SO_RXQ_OVFL socket option; the drop counter is then passed as ancillary data with each
+datagram received using recvmsg(). On other platforms, this information is not available.
+
+Also on Linux, the kernel can timestamp each datagram when it is received, which is more accurate than taking the
+time in user space after select() returns. This is enabled with the SO_TIMESTAMPNS socket option; the timestamp is
+passed as ancillary data as well. Both kinds of ancillary data fit in a buffer of ANCILLARY_BUFFER_SIZE bytes.
+"""
+
+import sys
+import socket
+import struct
+
+# The Linux socket option values for SO_RXQ_OVFL and SO_TIMESTAMPNS; Python's socket module doesn't define them.
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+
+# The kernel timestamp is a 'struct timespec': seconds and nanoseconds, both of the platform's 'long' type.
+_TIMESPEC_FORMAT = "@ll"
+_TIMESPEC_SIZE = struct.calcsize(_TIMESPEC_FORMAT)
+
+# All telemetry UDP packets fit in 2048 bytes with room to spare.
+MAX_PACKET_SIZE = 2048
+
+# Size of the ancillary data buffer to pass to recvmsg(), with room for the overflow counter and the timestamp.
+ANCILLARY_BUFFER_SIZE = socket.CMSG_SPACE(4) + socket.CMSG_SPACE(_TIMESPEC_SIZE) if hasattr(socket, 'CMSG_SPACE') else 0
+
+
+def bind_telemetry_socket(udp_port: int, host: str = ''):
+    """Return a UDP socket bound to the given port, accepting packets from any host unless 'host' is given.
+
+    Multiple receiving endpoints are allowed to bind the same port.
+    """
+    udp_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+
+    # Allow multiple receiving endpoints.
+    if sys.platform in ['darwin']:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    elif sys.platform in ['linux', 'win32']:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    udp_socket.bind((host, udp_port))
+    return udp_socket
+
+
+def enable_receive_overflow_counter(udp_socket) -> bool:
+    """Ask the kernel to report its receive buffer overflow counter with each datagram.
+
+    Returns True if successful; in that case, datagrams should be received using recvmsg(), and the counter
+    can be extracted from the ancillary data using receive_overflow_count().
+    """
+    if not sys.platform.startswith('linux') or not hasattr(udp_socket, 'recvmsg'):
+        return False
+    try:
+        udp_socket.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+    except OSError:
+        return False
+    return True
+
+
+def receive_overflow_count(ancdata):
+    """Return the cumulative number of datagrams dropped by the kernel, from the ancillary data returned by recvmsg().
+
+    The kernel only includes the counter once it is non-zero; None is returned if it is absent.
+    """
+    for (cmsg_level, cmsg_type, cmsg_data) in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == SO_RXQ_OVFL and len(cmsg_data) >= 4:
+            return struct.unpack("=I", cmsg_data[:4])[0]
+    return None
+
+
+def enable_kernel_timestamps(udp_socket) -> bool:
+    """Ask the kernel to timestamp each datagram upon reception.
+
+    Returns True if successful; in that case, datagrams should be received using recvmsg(), and the timestamp
+    can be extracted from the ancillary data using kernel_timestamp().
+    """
+    if not sys.platform.startswith('linux') or not hasattr(udp_socket, 'recvmsg'):
+        return False
+    try:
+        udp_socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+
+def kernel_timestamp(ancdata):
+    """Return the POSIX time at which the kernel received a datagram, from the ancillary data returned by recvmsg().
+
+    None is returned if the timestamp is absent.
+    """
+    for (cmsg_level, cmsg_type, cmsg_data) in ancdata:
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS and len(cmsg_data) >= _TIMESPEC_SIZE:
+            (seconds, nanoseconds) = struct.unpack(_TIMESPEC_FORMAT, cmsg_data[:_TIMESPEC_SIZE])
+            return seconds + nanoseconds * 1e-9
+    return None
@@ -0,0 +1,31 @@
+"""Utility functions for SQLite3 session files."""
+
+import os
+import sqlite3
+import urllib.request
+
+
+def connect_read_only(path: str) -> sqlite3.Connection:
+    """Open an existing SQLite3 file for reading only.
+
+    The file is opened through a 'file:' URI, in which the path is quoted, so paths that contain characters
+    such as '?', '#' or '%' are opened correctly.
+    """
+    uri = "file:{}?mode=ro".format(urllib.request.pathname2url(os.path.abspath(path)))
+    return sqlite3.connect(uri, uri=True)
+
+
+def is_session_file(path: str) -> bool:
+    """Return True if 'path' is an SQLite3 file that has a 'packets' table, like the session files of the recorder.
+
+    Other SQLite3 files, such as the session catalog, and files that are not SQLite3 databases at all, return False.
+    """
+    try:
+        conn = connect_read_only(path)
+        try:
+            cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'packets';")
+            return cursor.fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
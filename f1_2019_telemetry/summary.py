@@ -0,0 +1,246 @@
+"""Summary statistics of a recorded session, stored in a 'session_summary' table inside the session file.
+
+The summary holds the facts about a session that listing tools need, so they don't have to scan the packets: packet
+counts per packet type, the time span, the track, session type and formula, and the number of laps.
+
+The SessionSummary class accumulates the summary one packet at a time, at the cost of a few assignments per packet.
+Only the most recent session, lap data and participants packets are kept; they are decoded once, when the summary is
+written. For session files without a summary, SessionSummary.from_database() computes it from the packets table.
+"""
+
+import collections
+import ctypes
+
+from .packets import PacketID, PacketHeader, PacketSessionData_V1, PacketLapData_V1, PacketParticipantsData_V1, TrackIDs
+
+# The session types, as used in the 'sessionType' field of the session packet.
+SessionTypes = {
+     0 : 'Unknown',
+     1 : 'P1',
+     2 : 'P2',
+     3 : 'P3',
+     4 : 'Short P',
+     5 : 'Q1',
+     6 : 'Q2',
+     7 : 'Q3',
+     8 : 'Short Q',
+     9 : 'OSQ',
+    10 : 'R',
+    11 : 'R2',
+    12 : 'Time Trial'
+}
+
+# The formulas, as used in the 'formula' field of the session packet.
+Formulas = {
+    0 : 'F1 Modern',
+    1 : 'F1 Classic',
+    2 : 'F2',
+    3 : 'F1 Generic'
+}
+
+
+def _packet_count_column(packet_id):
+    """Return the name of the column that holds the number of packets of a type, e.g. 'carTelemetryPacketCount'."""
+    words = packet_id.name.lower().split("_")
+    return words[0] + "".join(word.capitalize() for word in words[1:]) + "PacketCount"
+
+
+_PACKET_COUNT_COLUMNS = collections.OrderedDict((packet_id, _packet_count_column(packet_id)) for packet_id in PacketID)
+
+_HEADER_COLUMNS = ("sessionUID", "packetFormat", "gameMajorVersion", "gameMinorVersion",
+                   "firstTimestamp", "lastTimestamp", "firstSessionTime", "lastSessionTime",
+                   "firstFrameIdentifier", "lastFrameIdentifier", "playerCarIndex", "packetCount")
+
+# The names of the columns of the session_summary table, in order.
+SESSION_SUMMARY_COLUMNS = _HEADER_COLUMNS + tuple(_PACKET_COUNT_COLUMNS.values()) + (
+    "trackId", "sessionType", "formula", "totalLaps", "sessionDuration", "numActiveCars", "lapCount", "bestLapTime")
+
+_create_session_summary_table_query = """
+    CREATE TABLE session_summary (
+        sessionUID            CHAR(16) NOT NULL,  -- Unique session id as hex string.
+        packetFormat          INTEGER  NOT NULL,
+        gameMajorVersion      INTEGER  NOT NULL,
+        gameMinorVersion      INTEGER  NOT NULL,
+        firstTimestamp        REAL     NOT NULL,  -- The POSIX time of the first packet.
+        lastTimestamp         REAL     NOT NULL,  -- The POSIX time of the last packet.
+        firstSessionTime      REAL     NOT NULL,
+        lastSessionTime       REAL     NOT NULL,
+        firstFrameIdentifier  INTEGER  NOT NULL,
+        lastFrameIdentifier   INTEGER  NOT NULL,
+        playerCarIndex        INTEGER  NOT NULL,
+        packetCount           INTEGER  NOT NULL,
+{}
+        trackId               INTEGER,            -- From the last session packet; see TrackIDs.
+        sessionType           INTEGER,            -- From the last session packet.
+        formula               INTEGER,            -- From the last session packet.
+        totalLaps             INTEGER,            -- From the last session packet.
+        sessionDuration       INTEGER,            -- From the last session packet, in seconds.
+        numActiveCars         INTEGER,            -- From the last participants packet.
+        lapCount              INTEGER,            -- The player's current lap number in the last lap data packet.
+        bestLapTime           REAL                -- The best lap time of all cars in the last lap data packet.
+    );
+    """.format("\n".join("        {:23s} INTEGER  NOT NULL,".format(column) for column in _PACKET_COUNT_COLUMNS.values()))
+
+# The packet types of which the most recent packet is kept.
+_KEPT_PACKET_IDS = (PacketID.SESSION, PacketID.LAP_DATA, PacketID.PARTICIPANTS)
+
+
+class SessionSummary:
+    """Accumulates the summary of a single session, one packet at a time."""
+
+    def __init__(self):
+        self.sessionUID = None
+        self.packetFormat = None
+        self.gameMajorVersion = None
+        self.gameMinorVersion = None
+        self.firstTimestamp = None
+        self.lastTimestamp = None
+        self.firstSessionTime = None
+        self.lastSessionTime = None
+        self.firstFrameIdentifier = None
+        self.lastFrameIdentifier = None
+        self.playerCarIndex = None
+        self.packet_counts = collections.Counter()
+        self.last_packets = {}
+
+    @property
+    def packetCount(self):
+        return sum(self.packet_counts.values())
+
+    def add(self, timestamp: float, header: PacketHeader, packet: bytes):
+        """Add a packet to the summary; 'header' is the decoded header of 'packet'."""
+        if self.sessionUID is None:
+            self._start(timestamp, "{:016x}".format(header.sessionUID), header)
+        self._update(timestamp, header, packet)
+
+    def add_session_packet(self, session_packet):
+        """Add a packet to the summary, given as a SessionPacket tuple as made by the recorder."""
+        if self.sessionUID is None:
+            self._start(session_packet.timestamp, session_packet.sessionUID, session_packet)
+        self._update(session_packet.timestamp, session_packet, session_packet.packet)
+
+    def _start(self, timestamp, sessionUID, fields):
+        """Set the values taken from the first packet; 'fields' has the header fields as attributes."""
+        self.sessionUID = sessionUID
+        self.packetFormat = fields.packetFormat
+        self.gameMajorVersion = fields.gameMajorVersion
+        self.gameMinorVersion = fields.gameMinorVersion
+        self.firstTimestamp = timestamp
+        self.firstSessionTime = fields.sessionTime
+        self.firstFrameIdentifier = fields.frameIdentifier
+
+    def _update(self, timestamp, fields, packet):
+        """Update the values taken from the most recent packet; 'fields' has the header fields as attributes."""
+        self.lastTimestamp = timestamp
+        self.lastSessionTime = fields.sessionTime
+        self.lastFrameIdentifier = fields.frameIdentifier
+        self.playerCarIndex = fields.playerCarIndex
+        packet_id = fields.packetId
+        self.packet_counts[packet_id] += 1
+        if packet_id in _KEPT_PACKET_IDS:
+            self.last_packets[packet_id] = packet
+
+    @classmethod
+    def from_database(cls, conn):
+        """Compute the summary of an open session file from its packets table; return None if it has no packets."""
+        summary = cls()
+
+        query = """SELECT timestamp, sessionUID, packetFormat, gameMajorVersion, gameMinorVersion,
+                          sessionTime, frameIdentifier, playerCarIndex FROM packets ORDER BY pkt_id {} LIMIT 1;"""
+        first = conn.execute(query.format("ASC")).fetchone()
+        if first is None:
+            return None
+        last = conn.execute(query.format("DESC")).fetchone()
+
+        (summary.firstTimestamp, summary.sessionUID, summary.packetFormat, summary.gameMajorVersion, summary.gameMinorVersion,
+         summary.firstSessionTime, summary.firstFrameIdentifier, _) = first
+        (summary.lastTimestamp, _, _, _, _, summary.lastSessionTime, summary.lastFrameIdentifier, summary.playerCarIndex) = last
+
+        for (packet_id, count) in conn.execute("SELECT packetId, COUNT(*) FROM packets GROUP BY packetId;"):
+            summary.packet_counts[packet_id] = count
+
+        for packet_id in _KEPT_PACKET_IDS:
+            row = conn.execute("SELECT packet FROM packets WHERE packetId = ? ORDER BY pkt_id DESC LIMIT 1;", (packet_id, )).fetchone()
+            if row is not None:
+                summary.last_packets[packet_id] = row[0]
+
+        return summary
+
+    def _last_packet(self, packet_id, packet_type):
+        packet = self.last_packets.get(packet_id)
+        if packet is None or len(packet) != ctypes.sizeof(packet_type):
+            return None
+        return packet_type.from_buffer_copy(packet)
+
+    def values(self):
+        """Return the summary as an ordered dict that maps the session_summary column names to their values."""
+        values = collections.OrderedDict()
+        for name in _HEADER_COLUMNS:
+            values[name] = getattr(self, name)
+        for (packet_id, column) in _PACKET_COUNT_COLUMNS.items():
+            values[column] = self.packet_counts[packet_id]
+
+        session = self._last_packet(PacketID.SESSION, PacketSessionData_V1)
+        values['trackId'] = session.trackId if session is not None else None
+        values['sessionType'] = session.sessionType if session is not None else None
+        values['formula'] = session.m_formula if session is not None else None
+        values['totalLaps'] = session.totalLaps if session is not None else None
+        values['sessionDuration'] = session.sessionDuration if session is not None else None
+
+        participants = self._last_packet(PacketID.PARTICIPANTS, PacketParticipantsData_V1)
+        values['numActiveCars'] = participants.numActiveCars if participants is not None else None
+
+        lap_data = self._last_packet(PacketID.LAP_DATA, PacketLapData_V1)
+        if lap_data is not None:
+            values['lapCount'] = lap_data.lapData[self.playerCarIndex].currentLapNum if self.playerCarIndex < 20 else None
+            best_lap_times = [car.bestLapTime for car in lap_data.lapData if car.bestLapTime > 0.0]
+            values['bestLapTime'] = min(best_lap_times) if best_lap_times else None
+        else:
+            values['lapCount'] = None
+            values['bestLapTime'] = None
+
+        return values
+
+
+def has_session_summary(conn):
+    """Return True if an open session file has a 'session_summary' table."""
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_summary';")
+    return cursor.fetchone() is not None
+
+
+def write_session_summary(conn, summary: SessionSummary):
+    """(Re)write the 'session_summary' table of an open session file, and commit."""
+    values = summary.values()
+    query = "".join(line[4:] + "\n" for line in _create_session_summary_table_query.split("\n")[1:-1])
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS session_summary;")
+        conn.execute(query)
+        conn.execute("INSERT INTO session_summary({}) VALUES ({});".format(", ".join(values), ", ".join("?" * len(values))),
+                     list(values.values()))
+
+
+def read_session_summary(conn):
+    """Return the summary of an open session file as a dict that maps column names to values, or None if it has none."""
+    if not has_session_summary(conn):
+        return None
+    cursor = conn.execute("SELECT * FROM session_summary;")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return collections.OrderedDict(zip((description[0] for description in cursor.description), row))
+
+
+def format_session_summary(values) -> str:
+    """Return a one-line description of a session, given the values of its summary as returned by read_session_summary()."""
+    if values['lapCount'] is not None:
+        laps = "{} laps".format(values['lapCount'])
+    else:
+        laps = "no lap data"
+    if values['bestLapTime'] is not None:
+        best_lap = ", best lap {:d}:{:06.3f}".format(int(values['bestLapTime'] // 60), values['bestLapTime'] % 60)
+    else:
+        best_lap = ""
+    return "{}, {}, {}: {}{}, {:.1f} minutes, {} packets".format(
+        TrackIDs.get(values['trackId'], "unknown track"), SessionTypes.get(values['sessionType'], "unknown session type"),
+        Formulas.get(values['formula'], "unknown formula"), laps, best_lap,
+        (values['lastSessionTime'] - values['firstSessionTime']) / 60.0, values['packetCount'])
@@ -0,0 +1,147 @@
+"""Live timing: gaps to the leader and intervals between cars, computed from lap data packets.
+
+The gap of a car to the leader is the time that passed since the leader was at the car's current position on track.
+To find that time without searching, the TimingEngine keeps a checkpoint table for every car: the session time at
+which the car passed each multiple of the table resolution (e.g. every 10 metres) of its 'totalDistance'.
+
+Each lap data packet extends the tables of all cars with the checkpoints they passed since the previous packet,
+using linear interpolation between the two packets. A car typically passes one or two checkpoints per packet, so this
+is O(1) per car. Looking up the time at which another car passed a given distance is an O(1) table lookup, again with
+linear interpolation. Gaps and intervals for all cars are therefore computed in O(cars) per lap data packet.
+"""
+
+import array
+import collections
+
+# Live timing of a single car. Gaps are in seconds; they are None when they cannot be determined (yet).
+CarTiming = collections.namedtuple('CarTiming', 'carIndex, position, lapNum, gapToLeader, interval')
+
+
+class CarCheckpoints:
+    """The session times at which a single car passed distance checkpoints.
+
+    Entry 'i' of the table is the session time at which the car passed distance (first_checkpoint + i) * resolution.
+    """
+
+    def __init__(self, resolution: float, distance_offset: float):
+        self._resolution = resolution
+        self._distance_offset = distance_offset
+        self._first_checkpoint = None
+        self._times = array.array('d')
+        self._last_distance = None
+        self._last_time = None
+
+    def update(self, total_distance: float, session_time: float):
+        """Add the checkpoints passed since the previous update."""
+        distance = (total_distance + self._distance_offset) / self._resolution
+
+        if self._last_distance is None or distance < self._last_distance:
+            if self._last_distance is not None:
+                # The car went backwards (e.g. a flashback): forget the checkpoints beyond its current position.
+                keep = int(distance) + 1 - self._first_checkpoint
+                if keep > 0:
+                    del self._times[keep:]
+                else:
+                    self._first_checkpoint = None
+                    del self._times[:]
+            if self._first_checkpoint is None:
+                self._first_checkpoint = int(distance) + 1
+            self._last_distance = distance
+            self._last_time = session_time
+            return
+
+        next_checkpoint = self._first_checkpoint + len(self._times)
+        if distance >= next_checkpoint and session_time > self._last_time:
+            # Interpolate the passing times of all checkpoints between the previous and the current position.
+            rate = (session_time - self._last_time) / (distance - self._last_distance)
+            for checkpoint in range(next_checkpoint, int(distance) + 1):
+                self._times.append(self._last_time + (checkpoint - self._last_distance) * rate)
+
+        self._last_distance = distance
+        self._last_time = session_time
+
+    def time_at(self, total_distance: float):
+        """Return the session time at which the car passed 'total_distance', or None if unknown."""
+        if self._first_checkpoint is None:
+            return None
+        position = (total_distance + self._distance_offset) / self._resolution - self._first_checkpoint
+        if position < 0.0:
+            # Before the start of our table.
+            return None
+        index = int(position)
+        last_index = len(self._times) - 1
+        if index < last_index:
+            t0 = self._times[index]
+            return t0 + (position - index) * (self._times[index + 1] - t0)
+
+        # Beyond the last checkpoint that the car passed: interpolate up to the car's latest position.
+        last_position = self._last_distance - self._first_checkpoint
+        if last_index < 0 or position > last_position:
+            return None
+        t0 = self._times[last_index]
+        if last_position <= last_index:
+            return t0
+        return t0 + (position - last_index) / (last_position - last_index) * (self._last_time - t0)
+
+
+class TimingEngine:
+    """The TimingEngine computes gaps to the leader and intervals to the car ahead for all cars.
+
+    Args:
+        resolution: the distance (in metres) between checkpoints.
+        distance_offset: the checkpoint tables start at this distance (in metres) before the start line, since
+            the 'totalDistance' of cars that start behind the line is negative at the start of a race.
+    """
+
+    def __init__(self, resolution: float = 10.0, distance_offset: float = 1000.0):
+        self._resolution = resolution
+        self._distance_offset = distance_offset
+        self._sessionUID = None
+        self._checkpoints = None
+        self.timings = []
+
+    def update(self, lap_packet):
+        """Process a PacketLapData_V1 packet; return the list of CarTiming tuples, ordered by position.
+
+        The list is also available as the 'timings' attribute, which is replaced (never modified) on each update.
+        """
+        header = lap_packet.header
+        if header.sessionUID != self._sessionUID:
+            self._sessionUID = header.sessionUID
+            self._checkpoints = [CarCheckpoints(self._resolution, self._distance_offset) for lap_data in lap_packet.lapData]
+
+        session_time = header.sessionTime
+
+        # Update the checkpoint tables of all cars, and order them by position.
+        by_position = [None] * (len(lap_packet.lapData) + 1)
+        for (car_index, lap_data) in enumerate(lap_packet.lapData):
+            # Skip cars that are not (or no longer) active.
+            if lap_data.resultStatus < 2 or not 1 <= lap_data.carPosition < len(by_position):
+                continue
+            self._checkpoints[car_index].update(lap_data.totalDistance, session_time)
+            by_position[lap_data.carPosition] = car_index
+
+        timings = []
+        leader = None
+        ahead = None
+        for (position, car_index) in enumerate(by_position):
+            if car_index is None:
+                continue
+            lap_data = lap_packet.lapData[car_index]
+            if leader is None:
+                leader = car_index
+                gap_to_leader = 0.0
+                interval = 0.0
+            else:
+                gap_to_leader = self._gap(leader, lap_data.totalDistance, session_time)
+                interval = self._gap(ahead, lap_data.totalDistance, session_time)
+            timings.append(CarTiming(car_index, position, lap_data.currentLapNum, gap_to_leader, interval))
+            ahead = car_index
+
+        self.timings = timings
+        return timings
+
+    def _gap(self, other_car_index, total_distance, session_time):
+        """Return the time since the other car was at 'total_distance', or None if unknown."""
+        other_time = self._checkpoints[other_car_index].time_at(total_distance)
+        return None if other_time is None else session_time - other_time
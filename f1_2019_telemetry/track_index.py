@@ -0,0 +1,299 @@
+"""A spatial index of the positions of all cars on a track, built from recorded motion data.
+
+A TrackIndex holds every position sample (worldPositionX/Y/Z) of every car in a set of session files recorded on the
+same track, together with the car's lap distance and sector at that moment (from the lap data packets). It answers:
+
+    index = build_track_index(["session1.sqlite3", "session2.sqlite3"])
+    (lap_distance, sector, distance) = index.locate(x, z)     # where on the track is this point?
+    samples = index.within_radius(x, z, 25.0)                # which samples are near this corner?
+    index.session_time[samples], index.car_index[samples], index.session_paths[index.session[samples]]
+
+Positions are indexed in the horizontal (x, z) plane, using a uniform grid of square cells. The samples are sorted by
+cell, so the samples of a cell are a contiguous range, and the samples in a row of cells as well. A radius query only
+looks at the rows of cells that overlap the circle. Nearest-sample queries (locate() and nearest()) are vectorized
+over many query points at once: for each neighbouring cell offset, the candidates of all query points are gathered
+into one flat array, and reduced to the nearest candidate per query point with numpy.minimum.reduceat().
+
+Building the index requires loading the sessions; the result can be cached in a directory, one file per track id,
+with cached_track_index(). A cached index is rebuilt if its set of session files (or their sizes or modification times)
+changed.
+
+This module requires NumPy (pip install f1-2019-telemetry[analysis]).
+"""
+
+import os
+import json
+
+import numpy as np
+
+from .packets import PacketID
+from .session_loader import load_session, source_signature
+from .resample import resample_session, packet_times
+
+# The version of the cache file layout.
+_CACHE_VERSION = 1
+
+
+def session_track_id(session):
+    """Return the track id of a session loaded by load_session(), from its last session packet; or None."""
+    if PacketID.SESSION not in session or len(session[PacketID.SESSION]) == 0:
+        return None
+    return int(session[PacketID.SESSION]['trackId'][-1])
+
+
+class GridIndex:
+    """A uniform grid over a set of points in the (x, z) plane."""
+
+    def __init__(self, x, z, cell_size: float):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.z = np.asarray(z, dtype=np.float64)
+        self.cell_size = cell_size
+
+        if len(self.x) != 0:
+            (self.x0, self.z0) = (float(self.x.min()), float(self.z.min()))
+            self.nx = int((self.x.max() - self.x0) // cell_size) + 1
+            self.nz = int((self.z.max() - self.z0) // cell_size) + 1
+        else:
+            (self.x0, self.z0, self.nx, self.nz) = (0.0, 0.0, 1, 1)
+
+        cells = self._cell_x(self.x) * self.nz + self._cell_z(self.z)
+        # The points sorted by cell, and for each cell the index of its first point in 'order'.
+        self.order = np.argsort(cells, kind='stable')
+        self.cell_start = np.searchsorted(cells[self.order], np.arange(self.nx * self.nz + 1))
+
+    def _cell_x(self, x):
+        return np.floor((np.asarray(x, dtype=np.float64) - self.x0) / self.cell_size).astype(np.int64)
+
+    def _cell_z(self, z):
+        return np.floor((np.asarray(z, dtype=np.float64) - self.z0) / self.cell_size).astype(np.int64)
+
+    def within_radius(self, x: float, z: float, radius: float):
+        """Return the indices of the points within 'radius' of (x, z), in increasing order."""
+        ix_range = range(max(int(self._cell_x(x - radius)), 0), min(int(self._cell_x(x + radius)), self.nx - 1) + 1)
+        iz_first = max(int(self._cell_z(z - radius)), 0)
+        iz_last = min(int(self._cell_z(z + radius)), self.nz - 1)
+        if iz_first > iz_last:
+            return np.arange(0)
+
+        # The cells of a row (fixed ix) are consecutive, so their points form a single range of 'order'.
+        candidates = [self.order[self.cell_start[ix * self.nz + iz_first]:self.cell_start[ix * self.nz + iz_last + 1]] for ix in ix_range]
+        if not candidates:
+            return np.arange(0)
+        candidates = np.concatenate(candidates)
+        inside = (self.x[candidates] - x) ** 2 + (self.z[candidates] - z) ** 2 <= radius ** 2
+        return np.sort(candidates[inside])
+
+    def nearest(self, x, z, max_distance: float = None, chunk_size: int = 4096):
+        """Return the (indices, distances) of the nearest points to the query points (x, z).
+
+        Only points within 'max_distance' (default: the cell size) are considered; for query points without such
+        a point, the index is -1 and the distance is infinite.
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z, dtype=np.float64))
+        if max_distance is None:
+            max_distance = self.cell_size
+
+        indices = np.full(len(x), -1, dtype=np.int64)
+        distances = np.full(len(x), np.inf)
+        for first in range(0, len(x), chunk_size):
+            chunk = slice(first, first + chunk_size)
+            (indices[chunk], distances[chunk]) = self._nearest(x[chunk], z[chunk], max_distance)
+        return (indices, distances)
+
+    def _nearest(self, x, z, max_distance):
+        rings = int(np.ceil(max_distance / self.cell_size))
+        (ix, iz) = (self._cell_x(x), self._cell_z(z))
+
+        indices = np.full(len(x), -1, dtype=np.int64)
+        squared_best = np.full(len(x), np.inf)
+        for dx in range(-rings, rings + 1):
+            for dz in range(-rings, rings + 1):
+                (cx, cz) = (ix + dx, iz + dz)
+                in_grid = (cx >= 0) & (cx < self.nx) & (cz >= 0) & (cz < self.nz)
+                cells = np.where(in_grid, cx * self.nz + cz, 0)
+                starts = self.cell_start[cells]
+                counts = np.where(in_grid, self.cell_start[cells + 1] - starts, 0)
+                queries = np.flatnonzero(counts)
+                if len(queries) == 0:
+                    continue
+                (starts, counts) = (starts[queries], counts[queries])
+
+                # Expand each query point to the points of its cell; the candidates of a query point are consecutive.
+                total = int(counts.sum())
+                first = np.cumsum(counts) - counts
+                candidates = self.order[np.repeat(starts - first, counts) + np.arange(total)]
+                repeated = np.repeat(queries, counts)
+                squared_distances = (self.x[candidates] - x[repeated]) ** 2 + (self.z[candidates] - z[repeated]) ** 2
+
+                # The nearest candidate of each query point: the first one that has the minimum distance.
+                minimum = np.minimum.reduceat(squared_distances, first)
+                positions = np.flatnonzero(squared_distances == np.repeat(minimum, counts))
+                positions = positions[np.searchsorted(positions, first)]
+
+                better = minimum < squared_best[queries]
+                squared_best[queries[better]] = minimum[better]
+                indices[queries[better]] = candidates[positions[better]]
+
+        within = (squared_best <= max_distance ** 2)
+        indices[~within] = -1
+        distances = np.where(within, np.sqrt(squared_best), np.inf)
+        return (indices, distances)
+
+
+class TrackIndex:
+    """The position samples of all cars in a set of sessions on the same track, with a GridIndex over them.
+
+    Attributes (arrays with one element per sample):
+        x, y, z: the world position in metres.
+        lap_distance: the car's lap distance in metres.
+        sector: the car's sector (0, 1 or 2).
+        car_index: the index of the car.
+        session: the index of the sample's session file in 'session_paths'.
+        session_time: the session time of the sample.
+    """
+
+    _ARRAYS = ('x', 'y', 'z', 'lap_distance', 'sector', 'car_index', 'session', 'session_time')
+
+    def __init__(self, track_id, session_paths, arrays, cell_size: float = 10.0, sources=None):
+        self.track_id = track_id
+        self.session_paths = list(session_paths)
+        self.sources = sources
+        for name in TrackIndex._ARRAYS:
+            setattr(self, name, arrays[name])
+        self.cell_size = cell_size
+        self.grid = GridIndex(self.x, self.z, cell_size)
+
+        # For locate(), one sample per square metre is enough; many cars drive over the same spots, lap after lap.
+        squares = np.floor(self.x).astype(np.int64) * (1 << 32) + np.floor(self.z).astype(np.int64)
+        self._locator_samples = np.sort(np.unique(squares, return_index=True)[1])
+        self._locator = GridIndex(self.x[self._locator_samples], self.z[self._locator_samples], cell_size)
+
+    def __len__(self):
+        return len(self.x)
+
+    def within_radius(self, x: float, z: float, radius: float):
+        """Return the indices of the samples within 'radius' metres of (x, z)."""
+        return self.grid.within_radius(x, z, radius)
+
+    def nearest(self, x, z, max_distance: float = None):
+        """Return the (indices, distances) of the nearest samples to the query points; see GridIndex.nearest()."""
+        return self.grid.nearest(x, z, max_distance)
+
+    def locate(self, x, z, max_distance: float = None):
+        """Map positions to (lap_distance, sector, distance) arrays, using a nearby sample of each position.
+
+        The sample is the nearest one of a subset with one sample per square metre, so 'distance' may be up to about
+        a metre more than that of nearest(). Positions without a sample within 'max_distance' get a NaN lap distance
+        and sector -1.
+        """
+        (indices, distances) = self._locator.nearest(x, z, max_distance)
+        found = (indices >= 0)
+        samples = self._locator_samples[np.maximum(indices, 0)]
+        lap_distance = np.where(found, self.lap_distance[samples], np.nan)
+        sector = np.where(found, self.sector[samples].astype(np.int8), -1)
+        return (lap_distance, sector, distances)
+
+    def save(self, path: str):
+        """Save the index to an .npz file."""
+        metadata = {'version': _CACHE_VERSION, 'track_id': self.track_id, 'session_paths': self.session_paths,
+                    'cell_size': self.cell_size, 'sources': self.sources}
+        temporary_path = path + ".tmp.npz"
+        np.savez(temporary_path, metadata=np.array(json.dumps(metadata)), **{name: getattr(self, name) for name in TrackIndex._ARRAYS})
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load an index saved by save(); return None if the file is missing or has an unknown layout."""
+        try:
+            with np.load(path) as data:
+                metadata = json.loads(str(data['metadata']))
+                arrays = {name: data[name] for name in TrackIndex._ARRAYS}
+        except (OSError, KeyError, ValueError):
+            return None
+        if metadata.get('version') != _CACHE_VERSION:
+            return None
+        return cls(metadata['track_id'], metadata['session_paths'], arrays, metadata['cell_size'], metadata['sources'])
+
+
+def _session_samples(session):
+    """Return the position samples of all cars in a session, as a dict of flat arrays."""
+    resampled = resample_session(session, packet_times(session, PacketID.MOTION), packet_ids=(PacketID.MOTION, PacketID.LAP_DATA),
+                                 fields=['worldPositionX', 'worldPositionY', 'worldPositionZ', 'lapDistance', 'sector'])
+    (n_times, n_cars) = resampled['worldPositionX'].shape
+    arrays = {
+        'x': resampled['worldPositionX'],
+        'y': resampled['worldPositionY'],
+        'z': resampled['worldPositionZ'],
+        'lap_distance': resampled['lapDistance'],
+        'sector': resampled['sector'],
+        'car_index': np.broadcast_to(np.arange(n_cars, dtype=np.uint8), (n_times, n_cars)),
+        'session_time': np.broadcast_to(resampled.times[:, np.newaxis], (n_times, n_cars))
+    }
+    # Leave out cars that are not on the track: inactive cars have all-zero positions, and the lap distance is
+    # negative before a car first crosses the line.
+    keep = ((arrays['x'] != 0.0) | (arrays['z'] != 0.0)) & (arrays['lap_distance'] >= 0.0)
+    return {name: np.asarray(values)[keep] for (name, values) in arrays.items()}
+
+
+def build_track_index(paths, cell_size: float = 10.0) -> TrackIndex:
+    """Build the track index of session files recorded on the same track.
+
+    Raises:
+        ValueError: if the sessions are not all on the same (known) track.
+    """
+    paths = list(paths)
+    track_id = None
+    parts = []
+    for (session_number, path) in enumerate(paths):
+        session = load_session(path)
+        session_track = session_track_id(session)
+        if session_track is None or (track_id is not None and session_track != track_id):
+            raise ValueError("Session file {!r} is not on track {}.".format(path, track_id if track_id is not None else "(known)"))
+        track_id = session_track
+        samples = _session_samples(session)
+        samples['session'] = np.full(len(samples['x']), session_number, dtype=np.uint16)
+        parts.append(samples)
+
+    arrays = {
+        'x': np.concatenate([part['x'] for part in parts]).astype(np.float32),
+        'y': np.concatenate([part['y'] for part in parts]).astype(np.float32),
+        'z': np.concatenate([part['z'] for part in parts]).astype(np.float32),
+        'lap_distance': np.concatenate([part['lap_distance'] for part in parts]).astype(np.float32),
+        'sector': np.concatenate([part['sector'] for part in parts]).astype(np.uint8),
+        'car_index': np.concatenate([part['car_index'] for part in parts]).astype(np.uint8),
+        'session': np.concatenate([part['session'] for part in parts]),
+        'session_time': np.concatenate([part['session_time'] for part in parts]).astype(np.float32)
+    } if parts else {name: np.zeros(0) for name in TrackIndex._ARRAYS}
+
+    sources = [source_signature(path) for path in paths]
+    return TrackIndex(track_id, paths, arrays, cell_size, sources)
+
+
+def track_index_path(directory: str, track_id: int) -> str:
+    """Return the path of the cached track index of a track in a cache directory."""
+    return os.path.join(directory, "track_{:02d}.npz".format(track_id))
+
+
+def cached_track_index(paths, directory: str, cell_size: float = 10.0) -> TrackIndex:
+    """Return the track index of session files on the same track, from the cache directory if it is up to date.
+
+    Otherwise, the index is built, and saved in the cache directory.
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    sources = [source_signature(path) for path in paths]
+
+    # The track id is needed to find the cache file; get it from the first session.
+    track_id = session_track_id(load_session(paths[0]))
+    if track_id is None:
+        raise ValueError("Session file {!r} has no session packets.".format(paths[0]))
+
+    cache_file = track_index_path(directory, track_id)
+    index = TrackIndex.load(cache_file)
+    if index is not None and index.session_paths == paths and index.sources == sources and index.cell_size == cell_size:
+        return index
+
+    index = build_track_index(paths, cell_size)
+    os.makedirs(directory, exist_ok=True)
+    index.save(cache_file)
+    return index
@@ -29,11 +29,24 @@ setup(
     packages=['f1_2019_telemetry', 'f1_2019_telemetry.cli'],
     #packages=['f1_2019_telemetry', 'f1_2019_telemetry.cli', 'f1_2019_telemetry.gui'],
 
+    # Optional dependencies of the analysis modules (e.g. f1_2019_telemetry.session_loader), and of heatmap rendering.
+    extras_require={
+        'analysis': ['numpy'],
+        'plots': ['numpy', 'matplotlib']
+    },
+
     entry_points={
         'console_scripts': [
             'f1-2019-telemetry-recorder=f1_2019_telemetry.cli.recorder:main',
             'f1-2019-telemetry-player=f1_2019_telemetry.cli.player:main',
-            'f1-2019-telemetry-monitor=f1_2019_telemetry.cli.monitor:main'
+            'f1-2019-telemetry-monitor=f1_2019_telemetry.cli.monitor:main',
+            'f1-2019-telemetry-live=f1_2019_telemetry.cli.live:main',
+            'f1-2019-telemetry-hub=f1_2019_telemetry.cli.hub:main',
+            'f1-2019-telemetry-relay=f1_2019_telemetry.cli.relay:main',
+            'f1-2019-telemetry-convert=f1_2019_telemetry.cli.convert:main',
+            'f1-2019-telemetry-catalog=f1_2019_telemetry.cli.catalog:main',
+            'f1-2019-telemetry-heatmap=f1_2019_telemetry.cli.heatmap:main',
+            'f1-2019-telemetry-export=f1_2019_telemetry.cli.export:main'
         #   'f1-2019-telemetry-monitor-gui=f1_2019_telemetry.gui.monitor:main'
         ]
     },
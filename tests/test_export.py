@@ -0,0 +1,77 @@
+"""Tests for f1_2019_telemetry.cli.export."""
+
+import io
+import json
+import unittest
+
+from f1_2019_telemetry.packets import PacketCarTelemetryData_V1, PacketMotionData_V1, PacketParticipantsData_V1, PacketEventData_V1
+from f1_2019_telemetry.cli.export import FieldProjection, write_json_lines
+
+
+class FieldProjectionTest(unittest.TestCase):
+
+    def test_player_is_not_duplicated(self):
+        projection = FieldProjection(PacketCarTelemetryData_V1, ['speed'])
+        packet = PacketCarTelemetryData_V1()
+        for (car_index, car_telemetry) in enumerate(packet.carTelemetryData):
+            car_telemetry.speed = 100 + car_index
+        row = (1000.0, 12.5, 750, 0, bytes(packet))
+        self.assertEqual([values[3] for values in projection.rows([row], [0, 'player'])], [0])
+        # The player is resolved per packet.
+        row = (1000.0, 12.5, 750, 3, bytes(packet))
+        self.assertEqual([(values[3], values[4]) for values in projection.rows([row], [0, 'player'])], [(0, 100), (3, 103)])
+
+    def test_batch_of_packets(self):
+        projection = FieldProjection(PacketCarTelemetryData_V1, ['speed', 'tyresPressure'])
+        packets = []
+        for frame in range(3):
+            packet = PacketCarTelemetryData_V1()
+            for (car_index, car_telemetry) in enumerate(packet.carTelemetryData):
+                car_telemetry.speed = 100 * frame + car_index
+                car_telemetry.tyresPressure[:] = (21.0, 21.5, 22.0, frame)
+            packets.append((1000.0 + frame, 12.5 + frame, 750 + frame, frame + 1, bytes(packet)))
+        rows = projection.rows(packets, ['player', 2])
+        self.assertEqual(projection.columns, ['timestamp', 'sessionTime', 'frameIdentifier', 'carIndex', 'speed',
+                                              'tyresPressure[0]', 'tyresPressure[1]', 'tyresPressure[2]', 'tyresPressure[3]'])
+        # The player's car is the requested car 2 in the second packet; it is output only once.
+        self.assertEqual(rows, [(1000.0, 12.5, 750, 1, 1, 21.0, 21.5, 22.0, 0.0),
+                                (1000.0, 12.5, 750, 2, 2, 21.0, 21.5, 22.0, 0.0),
+                                (1001.0, 13.5, 751, 2, 102, 21.0, 21.5, 22.0, 1.0),
+                                (1002.0, 14.5, 752, 3, 203, 21.0, 21.5, 22.0, 2.0),
+                                (1002.0, 14.5, 752, 2, 202, 21.0, 21.5, 22.0, 2.0)])
+
+    def test_packet_fields_and_strings(self):
+        projection = FieldProjection(PacketParticipantsData_V1, ['numActiveCars', 'name'])
+        packet = PacketParticipantsData_V1()
+        packet.numActiveCars = 2
+        packet.participants[1].name = "Driver 1".encode()
+        rows = projection.rows([(1000.0, 12.5, 750, 0, bytes(packet))], [1])
+        self.assertEqual(rows, [(1000.0, 12.5, 750, 1, 2, "Driver 1")])
+
+    def test_packet_without_cars(self):
+        projection = FieldProjection(PacketEventData_V1)
+        packet = PacketEventData_V1()
+        packet.eventStringCode = b"SSTA"
+        rows = projection.rows([(1000.0, 12.5, 750, 0, bytes(packet))] * 2, [0, 1])
+        self.assertEqual(projection.columns[:4], ['timestamp', 'sessionTime', 'frameIdentifier', 'eventStringCode'])
+        self.assertEqual([row[:4] for row in rows], [(1000.0, 12.5, 750, "SSTA")] * 2)
+
+
+class WriteJsonLinesTest(unittest.TestCase):
+
+    def test_non_finite_values_are_null(self):
+        projection = FieldProjection(PacketMotionData_V1, ['worldPositionX'])
+        packet = PacketMotionData_V1()
+        packet.carMotionData[0].worldPositionX = float('nan')
+        packet.carMotionData[1].worldPositionX = float('inf')
+        packet.carMotionData[2].worldPositionX = 1.5
+        rows = projection.rows([(1000.0, 12.5, 750, 0, bytes(packet))], [0, 1, 2])
+        fo = io.StringIO()
+        self.assertEqual(write_json_lines([rows], projection.columns, fo), 3)
+        objects = [json.loads(line) for line in fo.getvalue().splitlines()]
+        self.assertEqual([obj['worldPositionX'] for obj in objects], [None, None, 1.5])
+        self.assertNotIn("NaN", fo.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
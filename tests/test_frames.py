@@ -0,0 +1,55 @@
+"""Tests for f1_2019_telemetry.frames."""
+
+import unittest
+
+from f1_2019_telemetry.packets import PacketID, PacketSessionData_V1, PacketCarTelemetryData_V1
+from f1_2019_telemetry.frames import FrameAssembler
+
+
+def make_packet(packet_type, packet_id, frame_identifier, session_uid=1):
+    packet = packet_type()
+    packet.header.packetFormat = 2019
+    packet.header.packetVersion = 1
+    packet.header.packetId = packet_id
+    packet.header.sessionUID = session_uid
+    packet.header.frameIdentifier = frame_identifier
+    return packet
+
+
+def telemetry(frame_identifier):
+    return make_packet(PacketCarTelemetryData_V1, PacketID.CAR_TELEMETRY, frame_identifier)
+
+
+class FrameAssemblerTest(unittest.TestCase):
+
+    def test_late_packet_is_dropped(self):
+        assembler = FrameAssembler(reorder_window=2)
+        for frame_identifier in range(10, 15):
+            assembler.add(telemetry(frame_identifier))
+        self.assertEqual(assembler.add(telemetry(11)), [])
+        self.assertEqual(assembler.late_packet_count, 1)
+        self.assertEqual(assembler.rewind_count, 0)
+
+    def test_backward_jump_is_a_rewind(self):
+        assembler = FrameAssembler(reorder_window=2)
+        assembler.add(make_packet(PacketSessionData_V1, PacketID.SESSION, 100))
+        for frame_identifier in range(100, 110):
+            assembler.add(telemetry(frame_identifier))
+
+        # The frame identifier jumps back, e.g. after a flashback: the open frames are completed right away.
+        completed = assembler.add(telemetry(50))
+        self.assertEqual([frame.frameIdentifier for frame in completed], [108, 109])
+        self.assertEqual(assembler.rewind_count, 1)
+        self.assertEqual(assembler.late_packet_count, 0)
+
+        # Frames are produced again after the rewind, with the carried-forward session packet.
+        completed = []
+        for frame_identifier in range(51, 55):
+            completed.extend(assembler.add(telemetry(frame_identifier)))
+        self.assertEqual([frame.frameIdentifier for frame in completed], [50, 51, 52])
+        self.assertTrue(all(PacketID.SESSION in frame for frame in completed))
+        self.assertEqual(assembler.late_packet_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
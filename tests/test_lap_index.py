@@ -0,0 +1,91 @@
+"""Tests for f1_2019_telemetry.lap_index."""
+
+import sqlite3
+import unittest
+
+import numpy as np
+
+from f1_2019_telemetry.packets import PacketID, PacketLapData_V1
+from f1_2019_telemetry.session_loader import packet_dtype
+from f1_2019_telemetry.lap_index import _car_laps, compute_lap_index
+
+
+def _lap_data_records(lap_nums):
+    """Return lap data records in which car 0 is on the given laps, one packet every 0.1 s."""
+    records = np.zeros(len(lap_nums), dtype=packet_dtype(PacketLapData_V1))
+    records['header']['packetId'] = PacketID.LAP_DATA
+    records['header']['sessionTime'] = np.arange(len(lap_nums)) * 0.1
+    records['header']['frameIdentifier'] = np.arange(len(lap_nums))
+    records['lapData']['currentLapNum'][:, 0] = lap_nums
+    return records
+
+
+class CarLapsTest(unittest.TestCase):
+
+    def test_complete_and_incomplete_laps(self):
+        records = _lap_data_records([0, 0, 1, 1, 1, 2, 2, 3, 3])
+        lap_data = records['lapData'][:, 0]
+        # The sector times of lap 1 are in its last packet; its lap time arrives with the first packet of lap 2.
+        lap_data['sector1Time'][4] = 25.0
+        lap_data['sector2Time'][4] = 30.0
+        lap_data['lastLapTime'][5] = 80.5
+        lap_data['currentLapInvalid'][6] = 1
+        pkt_ids = np.arange(100, 109)
+
+        laps = list(_car_laps(0, pkt_ids, records, 120))
+
+        self.assertEqual([lap.lapNum for lap in laps], [1, 2, 3])
+        (lap1, lap2, lap3) = laps
+
+        self.assertEqual((lap1.startPktId, lap1.endPktId), (102, 105))
+        self.assertEqual((lap1.startFrameIdentifier, lap1.endFrameIdentifier), (2, 4))
+        self.assertAlmostEqual(lap1.startSessionTime, 0.2)
+        self.assertAlmostEqual(lap1.endSessionTime, 0.4)
+        self.assertTrue(lap1.complete)
+        self.assertTrue(lap1.valid)
+        self.assertAlmostEqual(lap1.lapTime, 80.5)
+        self.assertAlmostEqual(lap1.sector1Time, 25.0)
+        self.assertAlmostEqual(lap1.sector2Time, 30.0)
+        self.assertAlmostEqual(lap1.sector3Time, 25.5)
+
+        # No lap time was reported for lap 2, so it has no sector 3 time either.
+        self.assertTrue(lap2.complete)
+        self.assertFalse(lap2.valid)
+        self.assertIsNone(lap2.lapTime)
+        self.assertIsNone(lap2.sector3Time)
+
+        # The last lap runs until the end of the session.
+        self.assertEqual((lap3.startPktId, lap3.endPktId), (107, 120))
+        self.assertFalse(lap3.complete)
+        self.assertIsNone(lap3.lapTime)
+
+    def test_inactive_car(self):
+        records = _lap_data_records([0, 0, 0])
+        self.assertEqual(list(_car_laps(0, np.arange(3), records, 3)), [])
+        self.assertEqual(list(_car_laps(0, np.arange(0), records[:0], 0)), [])
+
+
+class ComputeLapIndexTest(unittest.TestCase):
+
+    def test_flashback_replaces_lap(self):
+        # After lap 2 has started, a flashback takes car 0 back to lap 1, which it then completes again.
+        records = _lap_data_records([1, 1, 2, 2, 1, 1, 2, 2, 3])
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE packets (pkt_id INTEGER PRIMARY KEY, packetId INTEGER NOT NULL, packet BLOB NOT NULL);")
+        conn.executemany("INSERT INTO packets VALUES (?, ?, ?);", [(pkt_id, PacketID.LAP_DATA, records[index].tobytes()) for (index, pkt_id) in enumerate(range(1, 10))])
+
+        laps = [lap for lap in compute_lap_index(conn) if lap.carIndex == 0]
+        conn.close()
+
+        self.assertEqual([lap.lapNum for lap in laps], [1, 2, 3])
+        (lap1, lap2, lap3) = laps
+        self.assertEqual((lap1.startPktId, lap1.endPktId), (5, 7))
+        self.assertTrue(lap1.complete)
+        self.assertEqual((lap2.startPktId, lap2.endPktId), (7, 9))
+        self.assertTrue(lap2.complete)
+        self.assertEqual((lap3.startPktId, lap3.endPktId), (9, 10))
+        self.assertFalse(lap3.complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+"""Tests for f1_2019_telemetry.packet_loss."""
+
+import unittest
+
+from f1_2019_telemetry.packets import PacketID
+from f1_2019_telemetry.packet_loss import PacketTypeLossStatistics
+
+
+class PacketTypeLossStatisticsTest(unittest.TestCase):
+
+    def test_out_of_order_packet_keeps_reference(self):
+        statistics = PacketTypeLossStatistics(PacketID.CAR_TELEMETRY)
+        for frame_identifier in range(10):
+            statistics.update(frame_identifier * 0.05, frame_identifier)
+        # Frame 8 arrives again, late; frame 10 follows in order.
+        statistics.update(8 * 0.05, 8)
+        statistics.update(10 * 0.05, 10)
+        self.assertEqual(statistics.out_of_order, 1)
+        self.assertEqual((statistics.lost, statistics.irregular, statistics.frame_gaps), (0, 0, 0))
+
+    def test_rewind_restarts_from_new_packet(self):
+        statistics = PacketTypeLossStatistics(PacketID.CAR_TELEMETRY)
+        for frame_identifier in range(100, 200):
+            statistics.update(frame_identifier * 0.05, frame_identifier)
+        for frame_identifier in range(20, 30):
+            statistics.update(frame_identifier * 0.05, frame_identifier)
+        self.assertEqual(statistics.out_of_order, 1)
+        self.assertEqual((statistics.lost, statistics.irregular, statistics.frame_gaps), (0, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
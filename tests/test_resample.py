@@ -0,0 +1,77 @@
+"""Tests for f1_2019_telemetry.resample."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from f1_2019_telemetry.packets import PacketID, PacketCarTelemetryData_V1
+from f1_2019_telemetry.recording import PacketRecorder, TimestampedPacket
+from f1_2019_telemetry.session_loader import read_session
+from f1_2019_telemetry.resample import resample_session, packet_times
+
+
+def _telemetry_packet(session_time, frame, speed, throttle):
+    packet = PacketCarTelemetryData_V1()
+    packet.header.packetFormat = 2019
+    packet.header.packetVersion = 1
+    packet.header.packetId = PacketID.CAR_TELEMETRY
+    packet.header.sessionUID = 0x1234
+    packet.header.sessionTime = session_time
+    packet.header.frameIdentifier = frame
+    for telemetry in packet.carTelemetryData:
+        telemetry.speed = speed
+        telemetry.throttle = throttle
+    return TimestampedPacket(1000.0 + frame, bytes(packet))
+
+
+class ResampleSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        # Four packets, then a flashback to 0.375 s: the packets at 0.5 and 0.75 s are superseded by the rewind.
+        # The throttle goes up linearly along the kept packets; the superseded packets have a throttle of 1.0.
+        samples = [(0.0, 100, 0.0), (0.25, 110, 0.25), (0.5, 999, 1.0), (0.75, 999, 1.0),
+                   (0.375, 120, 0.375), (0.625, 130, 0.625), (0.875, 140, 0.875)]
+        self.directory = tempfile.mkdtemp()
+        filename_format = os.path.join(self.directory, "F1_2019_{:s}.sqlite3")
+        recorder = PacketRecorder(filename_format=filename_format)
+        recorder.process_incoming_packets([_telemetry_packet(session_time, frame, speed, throttle)
+                                           for (frame, (session_time, speed, throttle)) in enumerate(samples)])
+        recorder.close()
+        self.session = read_session(filename_format.format("0000000000001234"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rewind_is_removed_from_time_base(self):
+        np.testing.assert_array_equal(packet_times(self.session, PacketID.CAR_TELEMETRY), [0.0, 0.25, 0.375, 0.625, 0.875])
+
+    def test_float_fields_are_interpolated(self):
+        times = [0.125, 0.5, 0.75]
+        resampled = resample_session(self.session, times, packet_ids=[PacketID.CAR_TELEMETRY], fields=['throttle'])
+        self.assertEqual(resampled['throttle'].shape, (3, 20))
+        # Interpolated between the kept packets only; the superseded packets would give 1.0 at 0.5 and 0.75 s.
+        np.testing.assert_allclose(resampled['throttle'][:, 0], times)
+        np.testing.assert_allclose(resampled['throttle'][:, 19], times)
+
+    def test_integer_fields_are_as_of(self):
+        times = [0.25, 0.3, 0.5, 0.625, 0.75]
+        resampled = resample_session(self.session, times, packet_ids=[PacketID.CAR_TELEMETRY], fields=['speed'])
+        self.assertEqual(resampled['speed'].dtype, np.uint16)
+        # The value of the last kept packet at or before each time; never the superseded 999.
+        np.testing.assert_array_equal(resampled['speed'][:, 7], [110, 110, 120, 130, 130])
+
+    def test_times_outside_packets(self):
+        resampled = resample_session(self.session, [-1.0, 2.0], packet_ids=[PacketID.CAR_TELEMETRY], fields=['speed', 'throttle'])
+        np.testing.assert_array_equal(resampled['speed'][:, 0], [100, 140])
+        np.testing.assert_allclose(resampled['throttle'][:, 0], [0.0, 0.875])
+
+    def test_unknown_field(self):
+        with self.assertRaises(KeyError):
+            resample_session(self.session, [0.0], packet_ids=[PacketID.CAR_TELEMETRY], fields=['noSuchField'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Tests for f1_2019_telemetry.session_loader."""
+
+import os
+import ctypes
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from f1_2019_telemetry.packets import PacketID, PacketCarTelemetryData_V1, PacketLapData_V1
+from f1_2019_telemetry.recording import PacketRecorder, TimestampedPacket
+from f1_2019_telemetry import session_loader
+from f1_2019_telemetry.session_loader import load_session, read_session, cache_is_current, cache_path
+
+
+def _packet(packet_type, packet_id, frame):
+    packet = packet_type()
+    packet.header.packetFormat = 2019
+    packet.header.packetVersion = 1
+    packet.header.packetId = packet_id
+    packet.header.sessionUID = 0x1234
+    packet.header.sessionTime = frame / 20
+    packet.header.frameIdentifier = frame
+    return packet
+
+
+def _session_packets(first_frame, num_frames):
+    """Return the timestamped lap data and car telemetry packets of a few frames."""
+    packets = []
+    for frame in range(first_frame, first_frame + num_frames):
+        lap_packet = _packet(PacketLapData_V1, PacketID.LAP_DATA, frame)
+        for (car_index, lap_data) in enumerate(lap_packet.lapData):
+            lap_data.lapDistance = frame * 10.0 + car_index
+        telemetry_packet = _packet(PacketCarTelemetryData_V1, PacketID.CAR_TELEMETRY, frame)
+        for (car_index, telemetry) in enumerate(telemetry_packet.carTelemetryData):
+            telemetry.speed = frame + car_index
+            telemetry.tyresPressure[:] = (21.0, 21.5, 22.0, 22.5)
+        packets.append(TimestampedPacket(1000.0 + frame / 20, bytes(lap_packet)))
+        packets.append(TimestampedPacket(1000.0 + frame / 20, bytes(telemetry_packet)))
+    return packets
+
+
+class SessionLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename_format = os.path.join(self.directory, "F1_2019_{:s}.sqlite3")
+        self.path = self.filename_format.format("0000000000001234")
+        self._record(_session_packets(0, 10))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _record(self, packets):
+        recorder = PacketRecorder(filename_format=self.filename_format)
+        recorder.process_incoming_packets(packets)
+        recorder.close()
+
+    def test_column_shapes(self):
+        # Decode in chunks of 3 packets, to check that the chunks are joined in order.
+        with unittest.mock.patch.object(session_loader, '_CHUNK_SIZE', 3 * ctypes.sizeof(PacketCarTelemetryData_V1)):
+            session = read_session(self.path)
+        self.assertEqual(sorted(session.keys()), [PacketID.LAP_DATA, PacketID.CAR_TELEMETRY])
+        telemetry = session[PacketID.CAR_TELEMETRY]
+        self.assertEqual(len(telemetry), 10)
+        self.assertEqual(telemetry.time.shape, (10,))
+        self.assertEqual(telemetry['speed'].shape, (10, 20))
+        self.assertEqual(telemetry['tyresPressure'].shape, (10, 20, 4))
+        self.assertTrue(np.all(np.diff(telemetry.pkt_id) > 0))
+        np.testing.assert_array_equal(telemetry.frame, np.arange(10))
+        np.testing.assert_array_equal(telemetry['speed'][:, 3], np.arange(10) + 3)
+        np.testing.assert_array_equal(telemetry['tyresPressure'][4, 5], [21.0, 21.5, 22.0, 22.5])
+        np.testing.assert_array_equal(session[PacketID.LAP_DATA]['lapDistance'][7, :2], [70.0, 71.0])
+
+    def test_pkt_id_range(self):
+        session = read_session(self.path, (3, 9))
+        np.testing.assert_array_equal(session[PacketID.LAP_DATA].pkt_id, [3, 5, 7])
+        np.testing.assert_array_equal(session[PacketID.CAR_TELEMETRY].pkt_id, [4, 6, 8])
+
+    def test_cache_hit_after_reload(self):
+        session = load_session(self.path)
+        self.assertTrue(cache_is_current(self.path))
+        with unittest.mock.patch.object(session_loader, 'read_session', side_effect=AssertionError("cache not used")):
+            cached_session = load_session(self.path)
+        self.assertIsInstance(cached_session[PacketID.CAR_TELEMETRY]['speed'], np.memmap)
+        np.testing.assert_array_equal(cached_session[PacketID.CAR_TELEMETRY]['speed'], session[PacketID.CAR_TELEMETRY]['speed'])
+        # Only the cache directory itself is left behind.
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([os.path.basename(self.path), os.path.basename(cache_path(self.path))]))
+
+    def test_cache_invalidated_by_mtime(self):
+        load_session(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertFalse(cache_is_current(self.path))
+        load_session(self.path)
+        self.assertTrue(cache_is_current(self.path))
+
+    def test_cache_invalidated_by_size(self):
+        load_session(self.path)
+        stat = os.stat(self.path)
+        self._record(_session_packets(10, 40))
+        # Keep the modification time, so only the size tells the cache apart.
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertNotEqual(os.stat(self.path).st_size, stat.st_size)
+        self.assertFalse(cache_is_current(self.path))
+        self.assertEqual(len(load_session(self.path)[PacketID.CAR_TELEMETRY]), 50)
+        self.assertTrue(cache_is_current(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Tests for f1_2019_telemetry.shared_state."""
+
+import os
+import time
+import ctypes
+import unittest
+
+from f1_2019_telemetry.packets import PacketID, PacketHeader
+from f1_2019_telemetry.shared_state import SharedStateWriter, SharedStateReader, SharedStateError, _SLOT_OFFSETS, _SLOT_HEADER_SIZE
+
+
+class SharedStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = SharedStateWriter("f1-2019-telemetry-test-{}".format(os.getpid()))
+        self.reader = SharedStateReader(self.writer.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def _event_datagram(self, fill):
+        datagram = bytearray([fill]) * (ctypes.sizeof(PacketHeader) + 8)
+        datagram[PacketHeader.packetId.offset] = PacketID.EVENT
+        return bytes(datagram)
+
+    def test_read(self):
+        self.assertIsNone(self.reader.read(PacketID.EVENT))
+        datagram = self._event_datagram(0)
+        self.assertTrue(self.writer.update(datagram))
+        self.assertEqual(self.reader.read(PacketID.EVENT), datagram)
+
+    def test_read_times_out_while_slot_is_being_written(self):
+        # Leave the slot's sequence number odd, as if the writer were updating it forever.
+        self.writer.update(self._event_datagram(0))
+        self.writer._sequences[PacketID.EVENT].value += 1
+        self.reader.timeout = 0.05
+        t1 = time.monotonic()
+        with self.assertRaises(SharedStateError):
+            self.reader.read(PacketID.EVENT)
+        self.assertGreaterEqual(time.monotonic() - t1, 0.05)
+
+    def test_torn_copy_is_rejected(self):
+        self.writer.update(self._event_datagram(0))
+        # Change part of the packet while the sequence number stays even, as a reader on a processor with weakly
+        # ordered stores (e.g. ARM) may see a slot that is being written.
+        data_offset = _SLOT_OFFSETS[PacketID.EVENT] + _SLOT_HEADER_SIZE
+        self.writer._shm.buf[data_offset + 24:data_offset + 28] = b"\xff\xff\xff\xff"
+        self.reader.timeout = 0.05
+        with self.assertRaises(SharedStateError):
+            self.reader.read(PacketID.EVENT)
+        # The next complete update is accepted again.
+        datagram = self._event_datagram(1)
+        self.writer.update(datagram)
+        self.assertEqual(self.reader.read(PacketID.EVENT), datagram)
+
+
+if __name__ == '__main__':
+    unittest.main()
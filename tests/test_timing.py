@@ -0,0 +1,31 @@
+"""Tests for f1_2019_telemetry.timing."""
+
+import unittest
+
+from f1_2019_telemetry.timing import CarCheckpoints
+
+
+class CarCheckpointsTest(unittest.TestCase):
+
+    def setUp(self):
+        # A car at a constant 50 m/s, sampled every 0.05 s, with checkpoints every 10 m.
+        self.checkpoints = CarCheckpoints(10.0, 0.0)
+        for step in range(21):
+            self.checkpoints.update(step * 2.5, step * 0.05)
+
+    def test_time_at_passed_checkpoints(self):
+        self.assertAlmostEqual(self.checkpoints.time_at(25.0), 0.5)
+
+    def test_time_at_beyond_last_checkpoint(self):
+        # The car is at 50 m; its last checkpoint is at 50 m too. Move it a little further, between checkpoints.
+        self.checkpoints.update(57.5, 1.15)
+        self.assertAlmostEqual(self.checkpoints.time_at(55.0), 1.1)
+        self.assertAlmostEqual(self.checkpoints.time_at(57.5), 1.15)
+        self.assertIsNone(self.checkpoints.time_at(58.0))
+
+    def test_time_at_before_table(self):
+        self.assertIsNone(self.checkpoints.time_at(-20.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Tests for f1_2019_telemetry.track_index."""
+
+import unittest
+
+import numpy as np
+
+from f1_2019_telemetry.track_index import GridIndex
+
+
+class GridIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(2019)
+        # Points on a rough track-sized area, with a few exact duplicates, so that there are ties.
+        self.x = random.uniform(-500.0, 500.0, 2000)
+        self.z = random.uniform(-300.0, 300.0, 2000)
+        self.x[1000:1010] = self.x[:10]
+        self.z[1000:1010] = self.z[:10]
+        self.grid = GridIndex(self.x, self.z, 10.0)
+        # Query points inside the grid, on points of the grid, and outside the grid.
+        self.qx = np.concatenate((random.uniform(-520.0, 520.0, 500), self.x[:10], [-2000.0, 2000.0]))
+        self.qz = np.concatenate((random.uniform(-320.0, 320.0, 500), self.z[:10], [0.0, 2000.0]))
+
+    def _distances(self, qx, qz):
+        return np.hypot(self.x - qx, self.z - qz)
+
+    def _check_nearest(self, max_distance, chunk_size=4096):
+        (indices, distances) = self.grid.nearest(self.qx, self.qz, max_distance, chunk_size=chunk_size)
+        if max_distance is None:
+            max_distance = self.grid.cell_size
+        for (qx, qz, index, distance) in zip(self.qx, self.qz, indices, distances):
+            brute_force = self._distances(qx, qz)
+            if brute_force.min() <= max_distance:
+                # With ties, any of the nearest points will do.
+                self.assertAlmostEqual(distance, brute_force.min())
+                self.assertAlmostEqual(brute_force[index], brute_force.min())
+            else:
+                self.assertEqual(index, -1)
+                self.assertEqual(distance, np.inf)
+
+    def test_nearest_within_cell_size(self):
+        self._check_nearest(None)
+
+    def test_nearest_within_several_cells(self):
+        self._check_nearest(35.0)
+
+    def test_nearest_in_chunks(self):
+        self._check_nearest(15.0, chunk_size=7)
+
+    def test_nearest_on_points(self):
+        (indices, distances) = self.grid.nearest(self.x[:10], self.z[:10])
+        np.testing.assert_array_equal(distances, 0.0)
+        np.testing.assert_array_equal(self.x[indices], self.x[:10])
+
+    def test_within_radius(self):
+        for (qx, qz) in zip(self.qx[::10], self.qz[::10]):
+            for radius in (5.0, 25.0, 80.0):
+                expected = np.flatnonzero(self._distances(qx, qz) <= radius)
+                np.testing.assert_array_equal(self.grid.within_radius(qx, qz, radius), expected)
+
+    def test_within_radius_outside_grid(self):
+        self.assertEqual(len(self.grid.within_radius(-2000.0, 0.0, 100.0)), 0)
+
+    def test_empty_grid(self):
+        grid = GridIndex([], [], 10.0)
+        (indices, distances) = grid.nearest([1.0, 2.0], [3.0, 4.0])
+        np.testing.assert_array_equal(indices, [-1, -1])
+        np.testing.assert_array_equal(distances, [np.inf, np.inf])
+        self.assertEqual(len(grid.within_radius(0.0, 0.0, 10.0)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()